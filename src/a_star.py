@@ -4,6 +4,7 @@ from cli_client.connection import Connection
 from warehouse_server.storage import Position, Storage, Box
 from a_star_client.move_compression import compress_moves
 from a_star_client.navigator import a_star_navigate
+from a_star_client.route_cache import RouteCache
 
 parser = argparse.ArgumentParser("A Star Algorithm")
 parser.add_argument("--server", type=str, required=True)
@@ -13,6 +14,7 @@ parser.add_argument("x", type=int)
 parser.add_argument("y", type=int)
 parser.add_argument("z", type=int)
 parser.add_argument("--time", default=1, type=float)
+parser.add_argument("--cache", type=str, help="File to keep found routes in")
 
 args = parser.parse_args()
 target = Position(args.x, args.y, args.z)
@@ -36,12 +38,17 @@ for item in state:
 print("Storage built successfully")
 
 print("Finding route...")
-route = a_star_navigate(
-    storage,
-    args.box_id,
-    storage.get_box_position(args.box_id),
-    target,
-)
+if args.cache is not None:
+    cache = RouteCache(path=args.cache)
+    route = cache.navigate(storage, args.box_id, target)
+    cache.save()
+else:
+    route = a_star_navigate(
+        storage,
+        args.box_id,
+        storage.get_box_position(args.box_id),
+        target,
+    )
 
 if type(route) == str:
     print("No route found:")
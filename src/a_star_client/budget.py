@@ -0,0 +1,114 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+
+from warehouse_server.storage import Position
+
+# Limits on how much a search can do before it gives up, and what it has to show for itself when it does
+# A fast pick can be given a few milliseconds, and a nightly re-slot as long as it likes
+# The search checks its budget between expansions and stops by itself, so the storage is always put back
+# as it was (unlike killing the thread it runs in)
+
+
+# How a search ended
+class Outcome(Enum):
+    FOUND = "found"
+    # Every state was searched, so there's no route
+    NO_ROUTE = "no route"
+    # Every state was searched, apart from the ones past the longest route allowed
+    ROUTE_LENGTH = "route length"
+    EXPANSIONS = "expansions"
+    NODES = "nodes"
+    MEMORY = "memory"
+    DEADLINE = "deadline"
+    CANCELLED = "cancelled"
+
+
+# Lets another thread (or a handler on the same one) stop a search, or several searches at once
+# It can also carry a deadline, so a whole batch of searches shares the same time limit
+class CancellationToken:
+    def __init__(self, deadline: float = None):
+        # A time.monotonic() time
+        self.deadline = deadline
+        # Setting a flag is atomic, so cancel() is safe to call from any thread
+        self.cancelRequested = False
+
+    # A token that runs out the given number of seconds from now
+    @classmethod
+    def after(cls, seconds: float):
+        return cls(time.monotonic() + seconds)
+
+    def cancel(self):
+        self.cancelRequested = True
+
+    # Why anything using the token should stop, or None if it can carry on
+    def check(self) -> Outcome or None:
+        if self.cancelRequested:
+            return Outcome.CANCELLED
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return Outcome.DEADLINE
+        return None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.check() is not None
+
+
+# Budgets are frozen, so they can be part of a RouteCache key
+@dataclass(frozen=True)
+class SearchBudget:
+    # The most Nodes to expand
+    maxExpansions: int = None
+    # The most Nodes to hold in the open list, and in the closed set
+    maxNodes: int = 50000
+    # The most memory (in bytes) to hold Nodes in, estimated from how many there are
+    maxMemory: int = None
+    # When to give up by, as a time.monotonic() time
+    deadline: float = None
+    # The longest route to look for, in moves
+    maxRouteLength: int = None
+    # Stops the search when it's cancelled or its deadline passes
+    token: CancellationToken = None
+
+    # Roughly how much memory a Node takes up, including its share of the open list and closed set
+    nodeBytes = 1100
+
+    # A budget that runs out the given number of seconds from now
+    @classmethod
+    def within(cls, seconds: float, **limits):
+        return cls(deadline=time.monotonic() + seconds, **limits)
+
+    # Which budget has run out, or None if there's some of each left
+    def exceeded(self, expanded: int, queued: int, visited: int) -> Outcome or None:
+        if visited > self.maxNodes or queued > self.maxNodes:
+            return Outcome.NODES
+        if self.maxExpansions is not None and expanded >= self.maxExpansions:
+            return Outcome.EXPANSIONS
+        if (
+            self.maxMemory is not None
+            and (queued + visited) * self.nodeBytes > self.maxMemory
+        ):
+            return Outcome.MEMORY
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return Outcome.DEADLINE
+        if self.token is not None:
+            return self.token.check()
+        return None
+
+
+# What a search found, or why it didn't find anything
+# When there's no route, the best state reached is the one the heuristic put closest to a target
+@dataclass
+class SearchResult:
+    route: deque = None
+    outcome: Outcome = Outcome.NO_ROUTE
+
+    # The moves to the best state reached, where the selected box was, and the heuristic's estimate from there
+    bestRoute: deque = None
+    bestPosition: Position = None
+    bestEstimate: float = None
+
+    @property
+    def found(self) -> bool:
+        return self.outcome is Outcome.FOUND
@@ -4,20 +4,23 @@ import random
 
 from warehouse_server.warehouse import seed
 from a_star_client import navigator
+from a_star_client.budget import SearchBudget
 from warehouse_server.storage import Position, Box
 from warehouse_server.warehouse import Warehouse
-from warehouse_server import utils
 
 positiveInfinity = 100000
 
 
+# The search stops itself once the time limit is up, so it never leaves a thread running in the background
 def assess(warehouse_test, startPos, endPos, weights, timelimit):
-    def function():
-        return navigator.a_star_navigate(
-            warehouse_test, 1, startPos, endPos, weights=weights
-        )
-
-    outcome = utils.beat_the_clock(function, (), timelimit)
+    outcome = navigator.a_star_navigate(
+        warehouse_test,
+        1,
+        startPos,
+        endPos,
+        weights=weights,
+        budget=SearchBudget.within(timelimit),
+    )
 
     if type(outcome) != deque:
         return positiveInfinity
@@ -0,0 +1,30 @@
+# Keeps track of every Node that has already been expanded, indexed by the state it represents
+# Membership is a single dictionary lookup, rather than comparing against every visited Node
+class ClosedSet:
+    def __init__(self):
+        # State key -> the Node that reached that state with the smallest distanceFromStart
+        self.bestNodes = dict()
+
+    def __len__(self):
+        return len(self.bestNodes)
+
+    def __contains__(self, node):
+        return node.stateKey() in self.bestNodes
+
+    # Get the best Node found so far for the same state (if there is one)
+    def get(self, node):
+        return self.bestNodes.get(node.stateKey())
+
+    # Check if the state has already been reached with the same or a smaller distanceFromStart
+    # If it has, there's no point looking at the node again
+    def isWorse(self, node) -> bool:
+        best = self.bestNodes.get(node.stateKey())
+        return best is not None and best.distanceFromStart <= node.distanceFromStart
+
+    # Mark a node as visited
+    # If the state was already visited, but with a worse distanceFromStart, the new node replaces it
+    def add(self, node):
+        self.bestNodes[node.stateKey()] = node
+
+    def remove(self, node):
+        self.bestNodes.pop(node.stateKey(), None)
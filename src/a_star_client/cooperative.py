@@ -0,0 +1,111 @@
+from dataclasses import dataclass, field
+
+from a_star_client.navigator import Move, a_star_navigate
+from warehouse_server import error_messages
+from warehouse_server.storage import Position, Storage
+
+# Plans routes for several boxes at once, and merges them into one schedule of moves made at the same time
+# The boxes are planned one at a time, in priority order, each one against the storage as the routes before
+# it leave it (and without disturbing the boxes already delivered), so the routes work one after the other
+# Every move is then put in the earliest timestep it can go in, using a reservation table of which cells
+# are used in which timestep. A move only depends on the cells next to the cells it moves between, so it just
+# has to come after the last move that used any of those, and moves in the same timestep never interfere
+
+
+# Which cells are used by a move in which timestep
+# Moves only ever go after the last move near them, so the last timestep each cell was used in is all it keeps
+class ReservationTable:
+    def __init__(self):
+        # Cell -> the last timestep it was used in
+        self.lastUsed = dict()
+        self.makespan = 0
+
+    def reserve(self, cell: Position, timestep: int):
+        self.lastUsed[cell] = max(self.lastUsed.get(cell, -1), timestep)
+        self.makespan = max(self.makespan, timestep + 1)
+
+    # The earliest timestep a move can go in, after every move near the cells it moves between
+    def earliest(self, start: Position, end: Position) -> int:
+        timestep = 0
+        for cell in (start, end):
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for dz in (-1, 0, 1):
+                        near = Position(cell.x + dx, cell.y + dy, cell.z + dz)
+                        timestep = max(timestep, self.lastUsed.get(near, -1) + 1)
+        return timestep
+
+
+@dataclass
+class Schedule:
+    # Box ID -> its route (None if there isn't one)
+    routes: dict = field(default_factory=dict)
+    # Lists of moves that Storage.move_multiple_boxes can make at once, in order
+    groups: list = field(default_factory=list)
+
+    # How many timesteps the schedule takes
+    @property
+    def makespan(self) -> int:
+        return len(self.groups)
+
+    # How many timesteps it would take to make every move one after the other
+    @property
+    def serialLength(self) -> int:
+        return sum(len(route) for route in self.routes.values() if route is not None)
+
+
+# jobs are (box ID, target) pairs in priority order, where a target is anything a_star_navigate takes
+# Any other keyword arguments are passed to a_star_navigate for every route
+# The storage is left as it was
+def cooperative_navigate(storage: Storage, jobs, **searchOptions) -> Schedule:
+    schedule = Schedule()
+    table = ReservationTable()
+
+    journalLength = len(storage.moveJournal)
+    delivered = set()
+    # Moves that make or steady an unstable box have to go in a timestep of their own
+    floor = 0
+
+    try:
+        for box_id, target in jobs:
+            movable = set(storage.boxes) - delivered
+            route = a_star_navigate(
+                storage,
+                box_id,
+                storage.get_box_position(box_id),
+                target,
+                movable=movable,
+                **searchOptions,
+            )
+            schedule.routes[box_id] = route
+            if route is None:
+                continue
+
+            for move in route:
+                start = storage.get_box_position(move.box_id)
+                wasUnstable = storage.unstableBoxID is not None
+
+                message = storage.apply_move(move.box_id, move.direction)
+                if message != error_messages.MOVE_BOX.format(move.box_id):
+                    raise ValueError("Planned an invalid move: %s" % message)
+                end = storage.get_box_position(move.box_id)
+
+                if wasUnstable or storage.unstableBoxID is not None:
+                    timestep = max(floor, table.makespan)
+                    floor = timestep + 1
+                else:
+                    timestep = max(floor, table.earliest(start, end))
+
+                table.reserve(start, timestep)
+                table.reserve(end, timestep)
+
+                while len(schedule.groups) <= timestep:
+                    schedule.groups.append([])
+                schedule.groups[timestep].append(Move(move.box_id, move.direction))
+
+            delivered.add(box_id)
+
+    finally:
+        storage.rollback(journalLength)
+
+    return schedule
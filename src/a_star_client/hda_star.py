@@ -0,0 +1,489 @@
+import multiprocessing
+import queue as queues
+import time
+from collections import deque
+from copy import deepcopy
+
+from a_star_client.budget import Outcome, SearchBudget, SearchResult
+from a_star_client.closed_set import ClosedSet
+from a_star_client.heuristic import ManhattanHeuristic
+from a_star_client.navigator import (
+    Move,
+    Node,
+    getPossibleNodes,
+    isGoal,
+    scoreNeighbour,
+    targetSet,
+)
+from a_star_client.open_list import HeapOpenList
+from a_star_client.routing_service import decodeSnapshot, encodeSnapshot
+from a_star_client.search_stats import SearchStats
+from warehouse_server import error_messages
+from warehouse_server.storage import ALL_DIRECTIONS, Position, Storage
+
+# Hash-distributed A* (HDA*): one search shared between several processes
+# Every state belongs to one worker, picked by its Zobrist hash, and only that worker ever queues or expands it,
+# so each worker keeps its own open list and closed set, and no state is searched twice
+# A worker expanding a Node sends each neighbour to the worker that owns it, in batches to keep the overhead down
+# Nodes are sent as the moves that reach them (plus what their score was worked out from), and each worker
+# replays them on its own copy of the storage
+#
+# Termination: a shared counter holds how many batches have been sent but not taken in yet, and each worker
+# has an idle flag. A sender counts a batch before sending it, and a receiver clears its idle flag before
+# counting a batch as taken in, all under one lock. So once every worker is idle and no batches are left,
+# there's nothing left anywhere that could make more work, and there's no route
+#
+# Each worker checks the budget against its own share of the search (the Nodes it holds and the Nodes it has
+# expanded), and tells the coordinator which part ran out. The coordinator watches the deadline and the token,
+# as a token cancelled in this process isn't cancelled in the copies the workers have
+
+
+# Everything a Node's score depends on, in a form that can be sent between processes
+def packNode(node: Node, path: tuple) -> tuple:
+    return (
+        node.score,
+        path,
+        node.movers,
+        node.zobrist,
+        node.unstableBoxID,
+        None if node.parentNode is None else node.parentNode.unstableBoxID,
+        node.distanceFromStart,
+        node.distanceToExitApproximate,
+        node.totalNumBoxesMoved,
+        node.totalBoxesMoved,
+        node.exitClogged,
+        node.targetUnsafe,
+    )
+
+
+def unpackNode(packed: tuple) -> Node:
+    (
+        score,
+        path,
+        movers,
+        zobrist,
+        unstableBoxID,
+        parentUnstableBoxID,
+        distanceFromStart,
+        distanceToExitApproximate,
+        totalNumBoxesMoved,
+        totalBoxesMoved,
+        exitClogged,
+        targetUnsafe,
+    ) = packed
+
+    # getPossibleNodes looks at the last two moves, so the parent is filled in as far as that
+    parent = None
+    move = Move(None, None)
+    if len(path) > 0:
+        parentMove = Move(None, None)
+        if len(path) > 1:
+            parentMove = Move(path[-2][0], ALL_DIRECTIONS[path[-2][1]])
+        parent = Node(None, parentMove, parentUnstableBoxID, dict(), None)
+        move = Move(path[-1][0], ALL_DIRECTIONS[path[-1][1]])
+
+    node = Node(parent, move, unstableBoxID, movers, None, zobrist)
+    node.score = score
+    node.distanceFromStart = distanceFromStart
+    node.distanceToExitApproximate = distanceToExitApproximate
+    node.totalNumBoxesMoved = totalNumBoxesMoved
+    node.totalBoxesMoved = totalBoxesMoved
+    node.exitClogged = exitClogged
+    node.targetUnsafe = targetUnsafe
+    node.path = path
+    return node
+
+
+# Move the storage from the end of one path to the end of another, only undoing back to where they split
+# Returns the path the storage is now at, which falls short of the new path if one of its moves doesn't work
+def switchPath(storage: Storage, fromPath: tuple, toPath: tuple) -> tuple:
+    common = 0
+    for a, b in zip(fromPath, toPath):
+        if a != b:
+            break
+        common += 1
+
+    for _ in range(len(fromPath) - common):
+        storage.undo_move()
+
+    for index in range(common, len(toPath)):
+        box_id, direction = toPath[index]
+        message = storage.apply_move(box_id, ALL_DIRECTIONS[direction])
+        if message != error_messages.MOVE_BOX.format(box_id):
+            return toPath[:index]
+
+    return toPath
+
+
+class Worker:
+    def __init__(
+        self,
+        index: int,
+        snapshot: bytes,
+        inboxes: list,
+        results,
+        lock,
+        counters,
+        stop,
+        settings: dict,
+    ):
+        self.index = index
+        self.inboxes = inboxes
+        self.results = results
+        self.lock = lock
+        # counters[0] is the number of batches in flight, counters[1 + i] is 1 if worker i is idle
+        self.counters = counters
+        self.stop = stop
+
+        self.selectedBoxID = settings["selectedBoxID"]
+        self.targets = settings["targets"]
+        self.onlyMoveThisBox = settings["onlyMoveThisBox"]
+        self.weights = settings["weights"]
+        self.partialOrder = settings["partialOrder"]
+        self.movable = settings["movable"]
+        self.batchSize = settings["batchSize"]
+        self.budget = settings["budget"]
+
+        self.storage = decodeSnapshot(snapshot)
+        self.estimator = settings["heuristic"].forStorage(
+            self.storage, self.selectedBoxID, self.targets
+        )
+        self.originalBoxPositions = deepcopy(self.storage.boxes)
+        self.storagePath = ()
+
+        self.queue = HeapOpenList()
+        self.visited = ClosedSet()
+        self.outgoing = [[] for _ in inboxes]
+
+        self.stats = SearchStats()
+        # The Node the heuristic puts closest to a target, where the selected box was there,
+        # and if any Node was left out for going past the longest route allowed
+        self.bestNode = None
+        self.bestPosition = None
+        self.tooLong = False
+
+    def owner(self, node: Node) -> int:
+        return node.zobrist % len(self.inboxes)
+
+    def send(self, owner: int):
+        batch = self.outgoing[owner]
+        if not batch:
+            return
+        self.outgoing[owner] = []
+
+        with self.lock:
+            self.counters[0] += 1
+        self.inboxes[owner].put(batch)
+
+    def flush(self):
+        for owner in range(len(self.inboxes)):
+            self.send(owner)
+
+    def receive(self, batch: list):
+        with self.lock:
+            self.counters[1 + self.index] = 0
+            self.counters[0] -= 1
+
+        for packed in batch:
+            self.push(unpackNode(packed))
+
+    def push(self, node: Node):
+        if self.visited.isWorse(node) or not self.queue.push(node):
+            self.stats.duplicates += 1
+            return
+        self.stats.generated += 1
+        self.stats.peakOpen = max(self.stats.peakOpen, len(self.queue))
+
+    # Take in everything waiting in the inbox, waiting a little while for it if there's nothing else to do
+    def collect(self, block: bool) -> bool:
+        try:
+            batch = self.inboxes[self.index].get(block, 0.01)
+        except queues.Empty:
+            return False
+
+        self.receive(batch)
+        while True:
+            try:
+                batch = self.inboxes[self.index].get_nowait()
+            except queues.Empty:
+                return True
+            self.receive(batch)
+
+    def expand(self, node: Node):
+        began = time.perf_counter()
+        self.storagePath = switchPath(self.storage, self.storagePath, node.path)
+        self.stats.switchTime += time.perf_counter() - began
+        # The move doesn't actually work from the parent's state, so forget about it
+        if self.storagePath != node.path:
+            return
+
+        self.visited.add(node)
+        self.stats.expanded += 1
+        self.stats.peakVisited = len(self.visited)
+
+        if (
+            self.bestNode is None
+            or node.distanceToExitApproximate < self.bestNode.distanceToExitApproximate
+            or isGoal(node)
+        ):
+            self.bestNode = node
+            self.bestPosition = node.boxCurrentPosition(
+                self.selectedBoxID, self.storage
+            )
+
+        if isGoal(node):
+            self.stats.goalHeuristic = node.distanceToExitApproximate
+            self.flush()
+            self.results.put(("route", node.path))
+            self.stop.set()
+            return
+
+        began = time.perf_counter()
+        neighbours = getPossibleNodes(
+            self.storage,
+            node,
+            self.onlyMoveThisBox,
+            self.originalBoxPositions,
+            self.movable,
+            self.partialOrder,
+        )
+        self.stats.neighbourTime += time.perf_counter() - began
+
+        maxRouteLength = self.budget.maxRouteLength
+        for neighbour in neighbours:
+            neighbour.distanceFromStart = node.distanceFromStart + 1
+            if maxRouteLength is not None and (
+                neighbour.distanceFromStart > maxRouteLength
+            ):
+                self.tooLong = True
+                continue
+            owner = self.owner(neighbour)
+            if owner == self.index and self.visited.isWorse(neighbour):
+                self.stats.duplicates += 1
+                continue
+
+            began = time.perf_counter()
+            scoreNeighbour(
+                neighbour,
+                self.storage,
+                self.selectedBoxID,
+                self.targets,
+                self.weights,
+                self.estimator,
+            )
+            self.stats.scoreTime += time.perf_counter() - began
+            move = neighbour.moveUsed
+            path = node.path + ((move.box_id, move.direction.index),)
+
+            if owner == self.index:
+                neighbour.path = path
+                self.push(neighbour)
+            else:
+                self.outgoing[owner].append(packNode(neighbour, path))
+                if len(self.outgoing[owner]) >= self.batchSize:
+                    self.send(owner)
+
+    def run(self):
+        while not self.stop.is_set():
+            self.collect(block=False)
+
+            if len(self.queue) == 0:
+                # Send everything before saying there's nothing left to do
+                self.flush()
+                with self.lock:
+                    self.counters[1 + self.index] = 1
+                self.collect(block=True)
+                continue
+
+            outcome = self.budget.exceeded(
+                self.stats.expanded, len(self.queue), len(self.visited)
+            )
+            if outcome is not None:
+                self.results.put(("stopped", outcome))
+                self.stop.set()
+                break
+
+            # Expand a few Nodes between each look at the inbox
+            for _ in range(self.batchSize):
+                if len(self.queue) == 0:
+                    break
+                self.expand(self.queue.pop())
+                if self.stop.is_set():
+                    break
+
+            # Don't let other workers sit idle waiting for a batch to fill up
+            self.flush()
+
+        best = None
+        if self.bestNode is not None:
+            best = (
+                self.bestNode.path,
+                self.bestPosition,
+                self.bestNode.distanceToExitApproximate,
+            )
+        self.results.put(("done", (self.stats, self.tooLong, best)))
+
+
+def runWorker(*args):
+    Worker(*args).run()
+
+
+# Like a_star_navigate, but shares the search out between several worker processes (see the top of the file)
+# The first route any worker finds is returned, so the route can differ from a_star_navigate's
+# If stats is a SearchStats, what every worker did is added to it (the peaks are the largest of any one worker)
+# movable limits the search to a set of box IDs, like in a_star_navigate
+# budget is a SearchBudget (see the top of the file for how it's shared out between the workers)
+# If result is a SearchResult, it's filled in with how the search ended, like in a_star_navigate
+def hda_star_navigate(
+    storage: Storage,
+    selectedBoxID: int,
+    start: Position,
+    target,
+    onlyMoveThisBox=None,
+    weights=(0.18, 0.65, 0.41, 1.29, 2.81),
+    heuristic=ManhattanHeuristic,
+    stats=None,
+    partialOrder=True,
+    workers=None,
+    movable=None,
+    batchSize=32,
+    budget=None,
+    result=None,
+) -> deque or None:
+    targets = targetSet(target)
+
+    if budget is None:
+        budget = SearchBudget()
+    if result is None:
+        result = SearchResult()
+
+    # Check you're not already there
+    if start in targets:
+        result.outcome = Outcome.FOUND
+        return deque()
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    settings = {
+        "selectedBoxID": selectedBoxID,
+        "targets": targets,
+        "onlyMoveThisBox": onlyMoveThisBox,
+        "weights": weights,
+        "heuristic": heuristic,
+        "partialOrder": partialOrder,
+        "movable": movable,
+        "batchSize": batchSize,
+        "budget": budget,
+    }
+
+    context = multiprocessing.get_context()
+    inboxes = [context.Queue() for _ in range(workers)]
+    results = context.Queue()
+    lock = context.Lock()
+    counters = context.RawArray("q", 1 + workers)
+    stop = context.Event()
+
+    # The root is sent to its owner like any other Node
+    estimator = heuristic.forStorage(storage, selectedBoxID, targets)
+    root = Node(None, Move(None, None), None, dict(), None, storage.zobristHash)
+    root.distanceToExitApproximate = estimator.estimate(start, dict())
+    root.calculateScore(weights)
+    if stats is not None and stats.startHeuristic is None:
+        stats.startHeuristic = root.distanceToExitApproximate
+
+    counters[0] = 1
+    inboxes[root.zobrist % workers].put([packNode(root, ())])
+
+    snapshot = encodeSnapshot(storage)
+    processes = [
+        context.Process(
+            target=runWorker,
+            args=(index, snapshot, inboxes, results, lock, counters, stop, settings),
+            daemon=True,
+        )
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    route = None
+    routePath = None
+    outcome = None
+    tooLong = False
+    # The best state any worker reached, as (path, position, estimate)
+    best = None
+
+    def take(kind, value):
+        nonlocal route, routePath, outcome, tooLong, best
+        if kind == "route" and route is None:
+            routePath = value
+            route = deque(
+                Move(box_id, ALL_DIRECTIONS[direction]) for box_id, direction in value
+            )
+            outcome = Outcome.FOUND
+        elif kind == "stopped" and outcome is None:
+            outcome = value
+        elif kind == "done":
+            workerStats, workerTooLong, workerBest = value
+            tooLong = tooLong or workerTooLong
+            # Once there's a route, the best state is the goal it leads to
+            if workerBest is None:
+                pass
+            elif routePath is not None:
+                if workerBest[0] == routePath:
+                    best = workerBest
+            elif best is None or workerBest[2] < best[2]:
+                best = workerBest
+            if stats is not None:
+                stats.add(workerStats)
+
+    try:
+        while not stop.is_set():
+            try:
+                kind, value = results.get(timeout=0.01)
+            except queues.Empty:
+                # Check if every worker has run out of things to do
+                with lock:
+                    finished = counters[0] == 0 and all(counters[1:])
+                # The workers can't see the token being cancelled, so watch it from here
+                stopped = budget.exceeded(0, 0, 0)
+                if stopped is not None and outcome is None:
+                    outcome = stopped
+                if finished or stopped is not None:
+                    stop.set()
+                continue
+
+            take(kind, value)
+            if kind in ("route", "stopped"):
+                stop.set()
+
+        # Every worker reports how much it did once it's stopped
+        reported = 0
+        while reported < workers:
+            try:
+                kind, value = results.get(timeout=5)
+            except queues.Empty:
+                break
+            take(kind, value)
+            if kind == "done":
+                reported += 1
+
+    finally:
+        stop.set()
+        for inbox in inboxes:
+            inbox.cancel_join_thread()
+        for process in processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+
+    if outcome is None:
+        outcome = Outcome.ROUTE_LENGTH if tooLong else Outcome.NO_ROUTE
+    result.outcome = outcome
+    if best is not None:
+        path, result.bestPosition, result.bestEstimate = best
+        result.bestRoute = deque(
+            Move(box_id, ALL_DIRECTIONS[direction]) for box_id, direction in path
+        )
+    return route
@@ -0,0 +1,187 @@
+import heapq
+from collections import OrderedDict
+
+from warehouse_server.storage import Direction, Position, Storage
+
+# A heuristic estimates how many more moves a Node needs to get the selected box onto a target
+# Any heuristic is built with forStorage(storage, selectedBoxID, targets), before the search moves anything,
+# and estimate(position, movers) is then given where the selected box is and which boxes have moved
+
+
+def manhattanDistance(aPos: Position, bPos: Position):
+    return abs(aPos.x - bPos.x) + abs(aPos.y - bPos.y) + abs(aPos.z - bPos.z)
+
+
+# The distance to the nearest target, as if there were no other boxes around
+class ManhattanHeuristic:
+    def __init__(self, targets: frozenset):
+        self.targets = targets
+
+    @classmethod
+    def forStorage(cls, storage: Storage, selectedBoxID: int, targets: frozenset):
+        return cls(targets)
+
+    def estimate(self, position: Position, movers: dict) -> int:
+        return min(manhattanDistance(position, target) for target in self.targets)
+
+
+# Counts the blockers the selected box has to get past as well, and never overestimates (so it's admissible)
+# It's worked out from two relaxed versions of the storage, and the estimate is the larger of the two:
+#  - Corridors: the box can fly through any cell (ignoring gravity and ledges), but going into a cell that
+#    holds another box costs an extra move, since that box has to be moved out of the way first
+#  - Columns: every box stacked on the selected box has to move before it can, and every box stacked on
+#    the target (from the box in the target up) has to move before it can be reached
+# Both are worked out for the storage as it was when the heuristic was built. Each box that has moved since
+# can have cleared at most one of the cells counted, but only matters if a route through its old cell
+# could be any shorter, so that's the only time the corridor estimate is lowered
+class BlockerHeuristic:
+    def __init__(self, storage: Storage, selectedBoxID: int, targets: frozenset):
+        self.width = storage.width
+        self.depth = storage.depth
+        self.height = storage.height
+        self.selectedBoxID = selectedBoxID
+        self.targets = targets
+        self.start = storage.get_box_position(selectedBoxID)
+
+        # Every cell with another box in it, when the heuristic was built
+        self.blocked = {
+            box.position: box_id
+            for box_id, box in storage.boxes.items()
+            if box_id != selectedBoxID
+        }
+
+        # Flying above the highest box never helps, so the corridors stop one layer above it
+        # (any route higher up can be flattened down to that layer without getting any longer)
+        self.ceiling = min(
+            self.height,
+            1
+            + max(
+                [position.z + 1 for position in self.blocked]
+                + [self.start.z]
+                + [target.z for target in targets]
+            ),
+        )
+
+        self.origins = {box_id: position for position, box_id in self.blocked.items()}
+
+        # The boxes that have to move before the selected box can, and before the target can be reached
+        # Each chain only holds while every box in it (from the bottom up) is still where it started
+        self.startChain = self.stackAbove(self.start + Direction.Up)
+        self.targetChains = {target: self.stackAbove(target) for target in targets}
+
+        # The corridor distances are found by a Dijkstra search outwards from the targets
+        # It only goes as far as it needs to for each lookup, and carries on from there for the next one
+        self.distances = dict()
+        self.settled = set()
+        self.frontier = []
+        for target in targets:
+            if self.inBounds(target):
+                self.distances[target] = 0
+                heapq.heappush(self.frontier, (0, target))
+
+    # Building the corridors and columns costs a lot more than a lookup, so the most recent
+    # heuristics are kept and shared by any search that starts from the same layout
+    cache = OrderedDict()
+    cacheSize = 16
+
+    @classmethod
+    def forStorage(cls, storage: Storage, selectedBoxID: int, targets: frozenset):
+        key = (
+            storage.zobristHash,
+            storage.zobrist.seed,
+            storage.width,
+            storage.depth,
+            storage.height,
+            selectedBoxID,
+            targets,
+        )
+
+        heuristic = cls.cache.get(key)
+        if heuristic is None:
+            heuristic = cls(storage, selectedBoxID, targets)
+            cls.cache[key] = heuristic
+            if len(cls.cache) > cls.cacheSize:
+                cls.cache.popitem(last=False)
+        else:
+            cls.cache.move_to_end(key)
+
+        return heuristic
+
+    def inBounds(self, position: Position) -> bool:
+        return (
+            0 <= position.x < self.width
+            and 0 <= position.y < self.depth
+            and 0 <= position.z < self.ceiling
+        )
+
+    # The IDs of the boxes stacked upwards from a position, stopping at a gap or the selected box
+    def stackAbove(self, position: Position) -> list:
+        chain = []
+        while position in self.blocked:
+            chain.append(self.blocked[position])
+            position += Direction.Up
+        return chain
+
+    # The fewest moves from a cell to the nearest target, counting a move for each box in the way
+    def corridorDistance(self, position: Position):
+        while position not in self.settled and self.frontier:
+            distance, cell = heapq.heappop(self.frontier)
+            if cell in self.settled:
+                continue
+            self.settled.add(cell)
+
+            # Getting into this cell costs a move, and another one if a box has to be cleared out of it first
+            cost = distance + 1 + (cell in self.blocked)
+            for direction in Direction:
+                neighbour = cell + direction
+                if not self.inBounds(neighbour) or neighbour in self.settled:
+                    continue
+                if cost < self.distances.get(neighbour, cost + 1):
+                    self.distances[neighbour] = cost
+                    heapq.heappush(self.frontier, (cost, neighbour))
+
+        return self.distances.get(position)
+
+    # The boxes at the bottom of a chain that haven't moved
+    @staticmethod
+    def unmoved(chain: list, movers: dict) -> set:
+        stillThere = set()
+        for box_id in chain:
+            if box_id in movers:
+                break
+            stillThere.add(box_id)
+        return stillThere
+
+    def estimate(self, position: Position, movers: dict) -> int:
+        if position in self.targets:
+            return 0
+
+        # Columns
+        # A box can be in both the selected box's chain and a target's, so each box is only counted once
+        startBlockers = set()
+        if position == self.start:
+            startBlockers = self.unmoved(self.startChain, movers)
+        estimate = min(
+            manhattanDistance(position, target)
+            + len(startBlockers | self.unmoved(chain, movers))
+            for target, chain in self.targetChains.items()
+        )
+
+        # Corridors
+        corridor = self.corridorDistance(position)
+        if corridor is not None:
+            # A route that avoids every cell that's been cleared since is at least as long as before
+            # One through a cleared cell has to get to it first, and from there can only save a move
+            # for each of the other cleared cells
+            cleared = [
+                self.origins[box_id] for box_id in movers if box_id in self.origins
+            ]
+            if cleared:
+                viaCleared = min(
+                    manhattanDistance(position, cell) + self.corridorDistance(cell)
+                    for cell in cleared
+                ) - (len(cleared) - 1)
+                corridor = min(corridor, max(corridor - len(cleared), viaCleared))
+            estimate = max(estimate, corridor)
+
+        return estimate
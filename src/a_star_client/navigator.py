@@ -1,17 +1,23 @@
 # Enable Node to include itself in the init method
 from __future__ import annotations
 
-from bisect import bisect_left
+import time
 from collections import deque
 from copy import deepcopy
 from dataclasses import dataclass
+
+from a_star_client.budget import Outcome, SearchBudget, SearchResult
+from a_star_client.closed_set import ClosedSet
+from a_star_client.heuristic import ManhattanHeuristic, manhattanDistance
+from a_star_client.open_list import HeapOpenList
+from a_star_client.relevance import widenings
+from a_star_client.search_stats import SearchStats
 from warehouse_server import error_messages
 from warehouse_server.storage import (
     Direction,
     Position,
     Storage,
     Box,
-    directionUsed,
     movesDictionary,
 )
 from warehouse_server.utils import noCrashing, boxChecks, noChanges
@@ -38,6 +44,22 @@ class Move:
     direction: Direction
 
 
+# Identifies the state a Node represents
+# Lookups compare the Zobrist hashes first, and only compare the movers to confirm a match
+class StateKey:
+    __slots__ = ("hash", "movers")
+
+    def __init__(self, zobrist: int, movers: dict):
+        self.hash = zobrist
+        self.movers = movers
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        return self.hash == other.hash and self.movers == other.movers
+
+
 class Node:
     def __init__(
         self,
@@ -46,11 +68,15 @@ class Node:
         unstableBoxID: int,
         movers: dict,
         availableMoves: movesDictionary,
+        zobrist: int = None,
     ):
         self.parentNode = parentNode
         self.moveUsed = moveUsed
         self.unstableBoxID = unstableBoxID
 
+        # How many moves it takes to reach the Node from the root
+        self.depth = 0 if parentNode is None else parentNode.depth + 1
+
         self.distanceFromStart = 0
         self.distanceToExitApproximate = 0
         self.totalNumBoxesMoved = 0
@@ -61,6 +87,12 @@ class Node:
         self.movers = movers
         self.totalBoxesMoved = set()
 
+        # The Zobrist hash of the layout, updated with an XOR per move
+        self.zobrist = zobrist
+
+        # Lazily calculated by stateKey()
+        self.key = None
+
         self.availableMoves = availableMoves
 
     def boxCurrentPosition(self, box_id: int, storage: Storage) -> Position:
@@ -78,8 +110,19 @@ class Node:
             + self.targetUnsafe * weights[4]
         )
 
+    # A canonical, hashable encoding of the state the Node represents
+    # Two Nodes are the same state if the same boxes have been moved to the same positions
+    def stateKey(self):
+        if self.key is None:
+            # Nodes that were made without a Zobrist hash (like in tests) fall back to hashing the movers
+            if self.zobrist is None:
+                self.key = StateKey(hash(frozenset(self.movers.items())), self.movers)
+            else:
+                self.key = StateKey(self.zobrist, self.movers)
+        return self.key
+
     def __hash__(self):
-        return hash(frozenset(self.movers))
+        return hash(self.stateKey())
 
     def __eq__(self, other):
         return (
@@ -93,10 +136,6 @@ class Node:
         return self.score < other.score
 
 
-def manhattanDistance(aPos: Position, bPos: Position):
-    return abs(aPos.x - bPos.x) + abs(aPos.y - bPos.y) + abs(aPos.z - bPos.z)
-
-
 def calculateUnsafe(
     neighbour: Node, target: Position, storage: Storage, selectedBoxID: int
 ):
@@ -104,21 +143,15 @@ def calculateUnsafe(
     if storage.get_id_at_position(target) == selectedBoxID:
         neighbour.targetUnsafe += 20
 
-    targetPos = target + Direction.Down
+    # Penalise every empty cell below the target, down to the stack (or the ground) supporting it
+    depth = storage.support_depth(target)
+    neighbour.targetUnsafe += 4 * depth
 
-    # Look down from the target position
-    while storage.check_position_in_bound(targetPos):
-        boxID = storage.get_id_at_position(targetPos)
-        # Penalise if there's not a stack supporting it
-        if boxID == 0:
-            neighbour.targetUnsafe += 4
-        elif boxID is selectedBoxID:
-            neighbour.targetUnsafe += 10
-        else:
-            # Otherwise, there's a supporting box, therefore you don't need to check the rest
-            break
-
-        targetPos += Direction.Down
+    # If the selected box is the one on top of that stack, it can't be the support,
+    # so keep looking below it as well
+    supportPos = Position(target.x, target.y, target.z - depth - 1)
+    if supportPos.z >= 0 and storage.get_id_at_position(supportPos) == selectedBoxID:
+        neighbour.targetUnsafe += 10 + 4 * storage.support_depth(supportPos)
 
 
 def calculateClogged(
@@ -141,9 +174,11 @@ def calculateClogged(
         targetPos += Direction.Down
 
 
+# Loads a Node by rebuilding its parent's movers from scratch, without needing the moves in between
+# The navigator itself uses switchNode, which only undoes and applies the moves between two Nodes
 def swapOut(storage: Storage, node: Node):
     restorePoint = dict()
-    restoreAvailableMoves = deepcopy(storage.availableMoves)
+    restoreAvailableMoves = storage.availableMoves.snapshot()
     restoreUnstableBoxID = storage.unstableBoxID
 
     # Check if it's the root
@@ -203,204 +238,1049 @@ def swapBack(storage: Storage, restorePoint: RestorePoint):
     return storage
 
 
+# Moves the storage from one Node's state to another's
+# Moves are undone back to the closest ancestor both Nodes share, then applied down to the new Node,
+# so the cost depends on how far apart the Nodes are in the tree, not how many boxes have moved
+# Returns the Node the storage ends up in, which is toNode's parent if toNode's move turns out to be invalid
+def switchNode(storage: Storage, fromNode: Node, toNode: Node) -> Node:
+    applying = []
+
+    while fromNode.depth > toNode.depth:
+        storage.undo_move()
+        fromNode = fromNode.parentNode
+
+    ancestor = toNode
+    while ancestor.depth > fromNode.depth:
+        applying.append(ancestor)
+        ancestor = ancestor.parentNode
+
+    while fromNode is not ancestor:
+        storage.undo_move()
+        fromNode = fromNode.parentNode
+        applying.append(ancestor)
+        ancestor = ancestor.parentNode
+
+    for node in reversed(applying):
+        message = storage.apply_move(node.moveUsed.box_id, node.moveUsed.direction)
+        if message != error_messages.MOVE_BOX.format(node.moveUsed.box_id):
+            return node.parentNode
+
+    return toNode
+
+
+# Two moves of different boxes are independent if every cell either of them looks at (the cells they move
+# between, and the cells around those) is out of reach of the other, so they can be made in either order
+# and end up in the same state
+def independentMoves(
+    aStart: Position, aEnd: Position, bStart: Position, bEnd: Position
+) -> bool:
+    return all(
+        max(abs(a.x - b.x), abs(a.y - b.y), abs(a.z - b.z)) >= 2
+        for a in (aStart, aEnd)
+        for b in (bStart, bEnd)
+    )
+
+
+# If movable is a set of box IDs, only those boxes are moved
+# With partialOrder on, a move that's independent of the move that reached current_node is only made if
+# its box has the higher ID. The other order reaches the same state, so that one is left to the parent
 def getPossibleNodes(
     storage: Storage,
     current_node: Node,
     onlyMoveThisBox: None or int,
     originalBoxPositions: dict,
+    movable=None,
+    partialOrder=False,
 ):
     output = []
 
-    for startPos, endPositions in storage.getAvailableMoves().items():
+    # Moves can only be swapped around if neither of them leaves a box unstable
+    lastBox = None
+    if (
+        partialOrder
+        and current_node.parentNode is not None
+        and current_node.unstableBoxID is None
+        and current_node.parentNode.unstableBoxID is None
+    ):
+        lastBox = current_node.moveUsed.box_id
+        lastEnd = storage.get_box_position(lastBox)
+        lastStart = lastEnd + current_node.moveUsed.direction.opposite()
+
+    for startPos, direction in storage.getAvailableDirections():
+        endPos = startPos + direction
+
         # Ensure nothing's crashing into each other
         if safeMode:
-            noCrashing(storage, startPos, endPositions)
+            noCrashing(storage, startPos, [endPos])
 
         idOfBox = storage.get_id_at_position(startPos)
         if onlyMoveThisBox is not None and not idOfBox == onlyMoveThisBox:
             continue
+        if movable is not None and idOfBox not in movable:
+            continue
 
-        for endPos in endPositions:
-            direction = directionUsed(startPos, endPos)
+        # Don't bother adding the Node if you're just "reversing" the previous move
+        if current_node.parentNode is not None:
+            if current_node.parentNode.moveUsed.box_id == idOfBox:
+                if current_node.parentNode.moveUsed.direction.opposite() == direction:
+                    continue
 
-            # Don't bother adding the Node if you're just "reversing" the previous move
-            if current_node.parentNode is not None:
-                if current_node.parentNode.moveUsed.box_id == idOfBox:
-                    if (
-                        current_node.parentNode.moveUsed.direction.opposite()
-                        == direction
-                    ):
-                        continue
+        # Calculated when a Node is "opened"
+        newAvailableMoves = None
 
-            # Calculated when a Node is "opened"
-            newAvailableMoves = None
+        # Update the movers
+        newMovers = dict(current_node.movers)
 
-            # Update the movers
-            newMovers = dict(current_node.movers)
+        # Check if the box has moved back to its original position
+        # If so, remove it from the movers
+        if originalBoxPositions[idOfBox].position == endPos:
+            del newMovers[idOfBox]
+        else:
+            newMovers[idOfBox] = endPos
 
-            # Check if the box has moved back to its original position
-            # If so, remove it from the movers
-            if originalBoxPositions[idOfBox].position == endPos:
-                del newMovers[idOfBox]
-            else:
-                newMovers[idOfBox] = endPos
+        # Calculate if the box is unstable
+        if storage.is_position_stable(endPos, ignoreBox=idOfBox):
+            unstable = None
+        else:
+            unstable = idOfBox
 
-            # Calculate if the box is unstable
-            if storage.is_position_stable(endPos, ignoreBox=idOfBox):
-                unstable = None
-            else:
-                unstable = idOfBox
+        if (
+            lastBox is not None
+            and idOfBox < lastBox
+            and unstable is None
+            and independentMoves(lastStart, lastEnd, startPos, endPos)
+        ):
+            continue
 
-            newNode = Node(
-                current_node,
-                Move(idOfBox, direction),
-                unstable,
-                newMovers,
-                newAvailableMoves,
-            )
+        newNode = Node(
+            current_node,
+            Move(idOfBox, direction),
+            unstable,
+            newMovers,
+            newAvailableMoves,
+            current_node.zobrist ^ storage.zobrist.moveKey(idOfBox, startPos, endPos),
+        )
 
-            output.append(newNode)
+        output.append(newNode)
 
     return output
 
 
+# A single target, or any collection of interchangeable targets, as a frozenset of Positions
+def targetSet(target) -> frozenset:
+    if isinstance(target, Position):
+        return frozenset((target,))
+    return frozenset(target)
+
+
+# The target closest to a position (ties go to the smallest Position, so it's always the same one)
+def nearestTarget(position: Position, targets: frozenset) -> Position:
+    return min(targets, key=lambda t: (manhattanDistance(position, t), t))
+
+
+# Follow a Node's parents back to the root, and return the moves it took in order
+def tracePath(node: Node) -> deque:
+    path = deque()
+    while node.parentNode is not None:
+        path.append(node.moveUsed)
+        node = node.parentNode
+    path.reverse()
+    return path
+
+
+# The target box is on a target, and nothing needs stabilising
+def isGoal(node: Node) -> bool:
+    return node.distanceToExitApproximate == 0 and node.unstableBoxID is None
+
+
+# Fill in everything a newly discovered Node's score depends on, and then its score
+# The storage must be in the state of the Node's parent
+# The distance to the target comes from the estimator (a heuristic built for the storage) if there is one
+def scoreNeighbour(
+    neighbour: Node,
+    storage: Storage,
+    selectedBoxID: int,
+    targets: frozenset,
+    weights,
+    estimator=None,
+):
+    # Assign the distanceFromStart value
+    neighbour.distanceFromStart = neighbour.parentNode.distanceFromStart + 1
+
+    current_position = neighbour.boxCurrentPosition(selectedBoxID, storage)
+    target = nearestTarget(current_position, targets)
+
+    # Assign the other values
+    if estimator is None:
+        neighbour.distanceToExitApproximate = manhattanDistance(
+            current_position, target
+        )
+    else:
+        neighbour.distanceToExitApproximate = estimator.estimate(
+            current_position, neighbour.movers
+        )
+
+    # Keep track of the total boxes moved and the total number of boxes moved
+    neighbour.totalBoxesMoved = set(neighbour.parentNode.totalBoxesMoved)
+    neighbour.totalNumBoxesMoved = neighbour.parentNode.totalNumBoxesMoved
+    if neighbour.moveUsed.box_id not in neighbour.totalBoxesMoved:
+        neighbour.totalBoxesMoved.add(neighbour.moveUsed.box_id)
+        neighbour.totalNumBoxesMoved += 1
+
+    neighbour.exitClogged = storage.is_valid_position_occupied(target)
+
+    calculateUnsafe(neighbour, target, storage, selectedBoxID)
+
+    neighbour.calculateScore(weights)
+
+
+# Searches backwards from the targets, moving only the target box and leaving every other box where it is
+# On open floor, a box's moves can always be reversed (a step up or down a ledge included), so reversing a
+# route from a target to some position gives a route from that position to the target
+# The Nodes use the same state encoding as the forward search, so the two can meet in the middle
+class BackwardFrontier:
+    def __init__(self, storage: Storage, selectedBoxID: int, targets: frozenset):
+        # The frontier moves the box around in its own copy of the storage
+        self.storage = deepcopy(storage)
+        self.selectedBoxID = selectedBoxID
+        self.start = storage.get_box_position(selectedBoxID)
+        self.startZobrist = storage.zobristHash
+
+        # Every move costs the same, so a breadth-first search finds the fewest moves to each state
+        self.queue = deque()
+        self.reached = ClosedSet()
+
+        self.storage.remove_box(selectedBoxID, force=True, ignoreMoves=True)
+        for target in targets:
+            if not self.storage.check_position_in_bound(target):
+                continue
+            if self.storage.is_valid_position_occupied(target):
+                continue
+            # The box has to finish stable
+            if not self.storage.is_position_stable(target):
+                continue
+            self.discover(None, None, target, None)
+
+    # Make the Node for the target box being in a position
+    def discover(self, parent, move, position: Position, unstableBoxID):
+        if position == self.start:
+            movers = dict()
+        else:
+            movers = {self.selectedBoxID: position}
+
+        node = Node(
+            parent,
+            move,
+            unstableBoxID,
+            movers,
+            None,
+            self.startZobrist
+            ^ self.storage.zobrist.moveKey(self.selectedBoxID, self.start, position),
+        )
+        node.distanceFromStart = 0 if parent is None else parent.distanceFromStart + 1
+
+        if node not in self.reached:
+            self.reached.add(node)
+            self.queue.append(node)
+
+    # Expand the next Node, and return the ones it discovered
+    def expand(self) -> list:
+        if len(self.queue) == 0:
+            return []
+
+        node = self.queue.popleft()
+        position = node.movers.get(self.selectedBoxID, self.start)
+
+        # Put the box where the Node says it is
+        self.storage.add_box(
+            self.selectedBoxID, Box(position), force=True, ignoreMoves=True
+        )
+        self.storage.unstableBoxID = node.unstableBoxID
+
+        found = len(self.queue)
+        for direction in Direction.getAll():
+            message, unstableBoxID = self.storage.can_move_box(
+                self.selectedBoxID, direction
+            )
+            if message == error_messages.SUCCESS_MESSAGE:
+                self.discover(
+                    node,
+                    Move(self.selectedBoxID, direction),
+                    position + direction,
+                    unstableBoxID,
+                )
+
+        self.storage.remove_box(self.selectedBoxID, force=True, ignoreMoves=True)
+        self.storage.unstableBoxID = None
+
+        return list(self.queue)[found:]
+
+    # The backward Node for the same state as a forward Node, if it's been reached
+    def meet(self, node: Node):
+        # Only states where the target box is the only box that's moved can be in the frontier
+        if len(node.movers) > 1 or (
+            len(node.movers) == 1 and self.selectedBoxID not in node.movers
+        ):
+            return None
+
+        backward = self.reached.get(node)
+        if backward is None or backward.unstableBoxID != node.unstableBoxID:
+            return None
+        return backward
+
+    # The route to a forward Node, followed by the moves from the same state to a target (if it's been reached)
+    def joinRoute(self, node: Node):
+        backward = self.meet(node)
+        if backward is None:
+            return None
+
+        route = tracePath(node)
+        while backward.parentNode is not None:
+            route.append(
+                Move(backward.moveUsed.box_id, backward.moveUsed.direction.opposite())
+            )
+            backward = backward.parentNode
+        return route
+
+
+# Check a route works from the storage's current state, without changing the storage
+def isValidRoute(storage: Storage, route) -> bool:
+    journalLength = len(storage.moveJournal)
+    try:
+        for move in route:
+            message = storage.apply_move(move.box_id, move.direction)
+            if message != error_messages.MOVE_BOX.format(move.box_id):
+                return False
+        return storage.unstableBoxID is None
+    finally:
+        storage.rollback(journalLength)
+
+
 # Attempts to provide a series of moves that results in the target box reaching the exit
 # This will fail (and return None) if the target box cannot reach the exit
+# The target can be a single Position, or a collection of Positions where any of them will do
+# With bidirectional on, a second search works backwards from the targets (only moving the target box),
+# and the route is returned as soon as the two searches meet
+# The heuristic estimates the distance to the target (see heuristic.py)
+# If stats is a SearchStats, what the search did is added to it (see search_stats.py)
+# With withStats on, (route, SearchStats) is returned rather than just the route
+# With relevance set to a radius, only the boxes near the route are moved (see relevance.py), and the
+# radius is doubled each time no route is found, until every box can move
+# movable limits the search to a set of box IDs directly
+# partialOrder skips the orders of independent moves that reach a state some other way (see getPossibleNodes)
+# With workers set, the search is shared out between that many processes instead (see hda_star.py)
+# budget limits how much the search can do before giving up (see budget.py), which by default is 50000 Nodes
+# in the open list or closed set. With workers set, the Node and expansion limits are for each worker
+# If result is a SearchResult, it's filled in with how the search ended and the best state it reached
 def a_star_navigate(
     storage: Storage,
     selectedBoxID: int,
     start: Position,
-    target: Position,
+    target,
     onlyMoveThisBox=None,
     weights=(0.18, 0.65, 0.41, 1.29, 2.81),
+    openList=HeapOpenList,
+    bidirectional=False,
+    heuristic=ManhattanHeuristic,
+    stats=None,
+    relevance=None,
+    movable=None,
+    partialOrder=True,
+    workers=None,
+    withStats=False,
+    budget=None,
+    result=None,
 ) -> deque or None:
+    if withStats:
+        if stats is None:
+            stats = SearchStats()
+        route = a_star_navigate(
+            storage,
+            selectedBoxID,
+            start,
+            target,
+            onlyMoveThisBox,
+            weights,
+            openList,
+            bidirectional,
+            heuristic,
+            stats,
+            relevance,
+            movable,
+            partialOrder,
+            workers,
+            budget=budget,
+            result=result,
+        )
+        return route, stats
+
+    targets = targetSet(target)
+
+    if budget is None:
+        budget = SearchBudget()
+    if result is None:
+        result = SearchResult()
+
     # Check you're not already there
-    if start == target:
+    if start in targets:
+        result.outcome = Outcome.FOUND
         return deque()
 
+    if relevance is not None and movable is None:
+        for relevant in widenings(storage, selectedBoxID, targets, relevance):
+            route = a_star_navigate(
+                storage,
+                selectedBoxID,
+                start,
+                targets,
+                onlyMoveThisBox,
+                weights,
+                openList,
+                bidirectional,
+                heuristic,
+                stats,
+                movable=relevant,
+                partialOrder=partialOrder,
+                workers=workers,
+                budget=budget,
+                result=result,
+            )
+            if route is not None:
+                return route
+            # Only widen if the search ran out of states, rather than running out of budget
+            if result.outcome not in (Outcome.NO_ROUTE, Outcome.ROUTE_LENGTH):
+                return None
+
+    if workers is not None:
+        # hda_star imports this module, so it can only be imported once this one has loaded
+        from a_star_client.hda_star import hda_star_navigate
+
+        route = hda_star_navigate(
+            storage,
+            selectedBoxID,
+            start,
+            targets,
+            onlyMoveThisBox,
+            weights,
+            heuristic,
+            stats,
+            partialOrder,
+            workers,
+            movable,
+            budget=budget,
+            result=result,
+        )
+        return route
+
+    estimator = heuristic.forStorage(storage, selectedBoxID, targets)
+
     # Initialise things
-    start_node = Node(None, Move(None, None), None, dict(), storage.availableMoves)
+    start_node = Node(
+        None,
+        Move(None, None),
+        None,
+        dict(),
+        storage.availableMoves,
+        storage.zobristHash,
+    )
     start_node.distanceFromStart = 0
-    start_node.distanceToExitApproximate = manhattanDistance(start, target)
+    start_node.distanceToExitApproximate = estimator.estimate(start, dict())
     start_node.calculateScore(weights)
 
-    queue = deque([start_node])
+    queue = openList()
+    queue.push(start_node)
 
-    visited = set()
+    visited = ClosedSet()
 
     total = 0
-
-    safe = deepcopy(storage)
+    generated = 0
+    duplicates = 0
+    peakOpen = 1
+    switchTime = 0.0
+    neighbourTime = 0.0
+    scoreTime = 0.0
+    goalHeuristic = None
+    clock = time.perf_counter
+
+    outcome = None
+    # The Node the heuristic puts closest to a target, in case no route is found
+    bestNode = start_node
+    # Set if any Node was left out for going past the longest route allowed
+    maxRouteLength = budget.maxRouteLength
+    tooLong = False
+
+    if safeMode:
+        safe = deepcopy(storage)
 
     originalBoxPositions = deepcopy(storage.boxes)
 
-    # Try and empty the queue
-    while len(queue) > 0:
-        # Pop the best node (the node at the start)
-        current_node = queue.popleft()
-        visited.add(current_node)
+    backward = None
+    if bidirectional and onlyMoveThisBox in (None, selectedBoxID):
+        backward = BackwardFrontier(storage, selectedBoxID, targets)
 
-        # This is very useful when debugging!
-        # print("\n%s. Currently inspecting %s" % (total, current_node.movers))
-        total += 1
+    # The storage is always left in the state of this Node between expansions
+    storageNode = start_node
+    journalLength = len(storage.moveJournal)
 
-        # Temporarily limit nodes visited
-        # Unless the storage is MASSIVE, visited is NEVER higher than this.
-        if len(visited) > 50000:
-            print(error_messages.ROUTING_FULL_VISITED_ERROR_MSG)
-            return None
+    try:
+        # Try and empty the queue
+        while len(queue) > 0:
+            # Pop the best node
+            current_node = queue.pop()
 
-        if len(queue) > 50000:
-            print(error_messages.ROUTING_FULL_QUEUE_ERROR_MSG)
-            return None
+            # The same state may have been queued more than once, so skip it if it's already been reached more cheaply
+            if visited.isWorse(current_node):
+                duplicates += 1
+                continue
+
+            # Load the current node
+            began = clock()
+            storageNode = switchNode(storage, storageNode, current_node)
+            switchTime += clock() - began
+
+            # The move doesn't actually work from the parent's state, so forget about it
+            if storageNode is not current_node:
+                continue
+
+            visited.add(current_node)
+
+            # This is very useful when debugging!
+            # print("\n%s. Currently inspecting %s" % (total, current_node.movers))
+            total += 1
+
+            # Perform some checks
+            if safeMode:
+                boxChecks(safe, storage)
+
+            # Are you at the target?
+            # And are you stable?
+            if isGoal(current_node):
+                # Yay!
+                # Trace back your steps
+                goalHeuristic = current_node.distanceToExitApproximate
+                outcome = Outcome.FOUND
+                bestNode = current_node
+                return tracePath(current_node)
+
+            if (
+                current_node.distanceToExitApproximate
+                < bestNode.distanceToExitApproximate
+            ):
+                bestNode = current_node
+
+            # Give up once any of the budget has run out
+            outcome = budget.exceeded(total, len(queue), len(visited))
+            if outcome is not None:
+                if outcome is Outcome.NODES:
+                    if len(visited) > budget.maxNodes:
+                        print(error_messages.ROUTING_FULL_VISITED_ERROR_MSG)
+                    else:
+                        print(error_messages.ROUTING_FULL_QUEUE_ERROR_MSG)
+                return None
+
+            if backward is not None:
+                # Check if the backward search has already reached this state,
+                # then take a step backwards, and see if that reaches a state the forward search has visited
+                meetings = [current_node]
+                for backwardNode in backward.expand():
+                    forwardNode = visited.get(backwardNode)
+                    if forwardNode is not None:
+                        meetings.append(forwardNode)
+
+                for node in meetings:
+                    route = backward.joinRoute(node)
+                    if route is None:
+                        continue
+
+                    # Check the joined route from the start
+                    storage.rollback(journalLength)
+                    storageNode = start_node
+                    if isValidRoute(storage, route):
+                        outcome = Outcome.FOUND
+                        return route
+
+                storageNode = switchNode(storage, storageNode, current_node)
 
-        # Load the current node
-        storage, restorePoint = swapOut(storage, current_node)
+            if safeMode:
+                safetyCheck = len(storage.availableMoves)
+
+            began = clock()
+            neighbours = getPossibleNodes(
+                storage,
+                current_node,
+                onlyMoveThisBox,
+                originalBoxPositions,
+                movable,
+                partialOrder,
+            )
+            neighbourTime += clock() - began
+
+            if safeMode:
+                if safetyCheck != len(storage.availableMoves):
+                    exit(
+                        "getPossibleNodes changed storage's available moves from %s to %s!"
+                        % (safetyCheck, len(storage.availableMoves))
+                    )
+
+            for neighbour in neighbours:
+                # Ignore neighbours that have already been visited, unless this is a shorter way of reaching them
+                neighbour.distanceFromStart = current_node.distanceFromStart + 1
+                if maxRouteLength is not None and (
+                    neighbour.distanceFromStart > maxRouteLength
+                ):
+                    tooLong = True
+                    continue
+                if visited.isWorse(neighbour):
+                    duplicates += 1
+                    continue
+
+                began = clock()
+                scoreNeighbour(
+                    neighbour, storage, selectedBoxID, targets, weights, estimator
+                )
+                scoreTime += clock() - began
+
+                # Add the child to the queue, replacing a worse Node for the same state if there is one
+                if queue.push(neighbour):
+                    generated += 1
+                else:
+                    duplicates += 1
+
+            peakOpen = max(peakOpen, len(queue))
+
+    finally:
+        # Repair the storage, however the search ended
+        storage.rollback(journalLength)
+
+        if outcome is None:
+            outcome = Outcome.ROUTE_LENGTH if tooLong else Outcome.NO_ROUTE
+        result.outcome = outcome
+        result.bestRoute = tracePath(bestNode)
+        result.bestPosition = bestNode.boxCurrentPosition(selectedBoxID, storage)
+        result.bestEstimate = bestNode.distanceToExitApproximate
+
+        if stats is not None:
+            stats.add(
+                SearchStats(
+                    total,
+                    generated,
+                    duplicates,
+                    peakOpen,
+                    len(visited),
+                    switchTime,
+                    neighbourTime,
+                    scoreTime,
+                    start_node.distanceToExitApproximate,
+                    goalHeuristic,
+                )
+            )
 
         # Perform some checks
         if safeMode:
-            boxChecks(safe, storage)
+            noChanges(safe, storage)
 
-        # Are you at the target?
-        # And are you stable?
-        if (
-            current_node.distanceToExitApproximate == 0
-            and current_node.unstableBoxID is None
-        ):
-            # Yay!
-            # Trace back your steps
-            path = deque()
-            while current_node.parentNode is not None:
-                path.append(current_node.moveUsed)
-                current_node = current_node.parentNode
-            path.reverse()
 
-            # Repair the storage
-            storage = swapBack(storage, restorePoint)
+# Like a_star_navigate, but always gives back a SearchResult saying how the search ended
+# Any other keyword arguments are passed to a_star_navigate
+def a_star_search(
+    storage: Storage,
+    selectedBoxID: int,
+    start: Position,
+    target,
+    budget=None,
+    **options,
+) -> SearchResult:
+    result = SearchResult()
+    result.route = a_star_navigate(
+        storage, selectedBoxID, start, target, budget=budget, result=result, **options
+    )
+    return result
+
+
+# Iterative-deepening A*: a depth-first search that gives up on any Node scoring over a threshold,
+# repeated with the threshold raised to the smallest score that went over it, until a route is found
+# Only the current route (and each Node's siblings) is kept in memory, rather than every Node found,
+# so it can solve dense warehouses that fill up a_star_navigate's queue
+# The storage is moved along with the search using apply_move and undo_move
+# transpositionSize limits how many states are remembered (per iteration) to avoid searching them twice
+# The budget (its deadline and token included) is checked before every expansion, where the Nodes held are
+# the current route and the remembered states, and the expansions are counted across every iteration
+# If result is a SearchResult, it's filled in with how the search ended, like in a_star_navigate
+def ida_star_navigate(
+    storage: Storage,
+    selectedBoxID: int,
+    start: Position,
+    target,
+    onlyMoveThisBox=None,
+    weights=(0.18, 0.65, 0.41, 1.29, 2.81),
+    transpositionSize=10000,
+    budget=None,
+    result=None,
+) -> deque or None:
+    targets = targetSet(target)
 
-            return path
+    if budget is None:
+        budget = SearchBudget()
+    if result is None:
+        result = SearchResult()
 
-        if safeMode:
-            safetyCheck = len(storage.availableMoves)
+    # Check you're not already there
+    if start in targets:
+        result.outcome = Outcome.FOUND
+        return deque()
 
-        neighbours = getPossibleNodes(
-            storage, current_node, onlyMoveThisBox, originalBoxPositions
-        )
+    start_node = Node(
+        None,
+        Move(None, None),
+        None,
+        dict(),
+        storage.availableMoves,
+        storage.zobristHash,
+    )
+    start_node.distanceFromStart = 0
+    start_node.distanceToExitApproximate = manhattanDistance(
+        start, nearestTarget(start, targets)
+    )
+    start_node.calculateScore(weights)
 
-        if safeMode:
-            if safetyCheck != len(storage.availableMoves):
-                exit(
-                    "getPossibleNodes changed storage's available moves from %s to %s!"
-                    % (safetyCheck, len(storage.availableMoves))
-                )
+    if safeMode:
+        safe = deepcopy(storage)
+
+    originalBoxPositions = deepcopy(storage.boxes)
+    journalLength = len(storage.moveJournal)
+
+    # The states on the current route, so the search never goes round in a loop
+    onRoute = {start_node.stateKey()}
+
+    # Expansions are counted across every iteration
+    expanded = 0
+    outcome = None
+    # The Node the heuristic puts closest to a target, in case no route is found
+    bestNode = start_node
+    # Set if any Node was left out for going past the longest route allowed
+    maxRouteLength = budget.maxRouteLength
+    tooLong = False
+
+    # Returns the goal Node if one is found, None if the budget ran out,
+    # otherwise the smallest score over the threshold
+    def search(node: Node, threshold: float, transpositions: dict):
+        nonlocal expanded, outcome, bestNode, tooLong
+
+        if node.score > threshold:
+            return node.score
+
+        if isGoal(node):
+            return node
+
+        # Give up once any of the budget has run out
+        outcome = budget.exceeded(expanded, len(onRoute), len(transpositions))
+        if outcome is not None:
+            return None
+        expanded += 1
+
+        if node.distanceToExitApproximate < bestNode.distanceToExitApproximate:
+            bestNode = node
 
+        neighbours = []
+        for neighbour in getPossibleNodes(
+            storage, node, onlyMoveThisBox, originalBoxPositions
+        ):
+            if maxRouteLength is not None and (
+                node.distanceFromStart + 1 > maxRouteLength
+            ):
+                tooLong = True
+                continue
+            scoreNeighbour(neighbour, storage, selectedBoxID, targets, weights)
+            neighbours.append(neighbour)
+
+        # Try the most promising moves first
+        neighbours.sort(key=lambda n: n.score)
+
+        smallest = float("inf")
         for neighbour in neighbours:
-            # Ignore neighbours that have already been visited
-            # The "any" operator is used, as it's marginally faster than the standard "in"
-            # This is because it stops searching as soon as a match is found
-            if any(visitedNode == neighbour for visitedNode in visited):
+            key = neighbour.stateKey()
+            if key in onRoute:
                 continue
 
-            # Assign the distanceFromStart value
-            neighbour.distanceFromStart = current_node.distanceFromStart + 1
+            # Skip states that have already been searched this iteration from closer to the start
+            seen = transpositions.get(key)
+            if seen is not None and seen <= neighbour.distanceFromStart:
+                continue
+            if seen is not None or len(transpositions) < transpositionSize:
+                transpositions[key] = neighbour.distanceFromStart
 
-            # Find the first Node in the queue (from the back) that has a better/smaller distanceFromStart
-            for i in range(len(queue) - 1, -1, -1):
-                if queue[i].distanceFromStart < neighbour.distanceFromStart:
-                    break
-            else:
-                i = -1
+            message = storage.apply_move(
+                neighbour.moveUsed.box_id, neighbour.moveUsed.direction
+            )
+            # The move doesn't actually work from this state, so forget about it
+            if message != error_messages.MOVE_BOX.format(neighbour.moveUsed.box_id):
+                continue
 
-            # Search the sub-queue to check if there are any "better" Nodes in it than the neighbour
-            for j in range(len(queue) - 1, i, -1):
-                if queue[j] == neighbour:
-                    if queue[j].distanceFromStart < neighbour.distanceFromStart:
-                        continue
+            onRoute.add(key)
+            found = search(neighbour, threshold, transpositions)
+            onRoute.discard(key)
+            storage.undo_move()
 
-            current_position = neighbour.boxCurrentPosition(selectedBoxID, storage)
+            if found is None or isinstance(found, Node):
+                return found
+            smallest = min(smallest, found)
 
-            # Assign the other values
-            neighbour.distanceToExitApproximate = manhattanDistance(
-                current_position, target
-            )
+        return smallest
+
+    try:
+        threshold = start_node.score
+        while True:
+            found = search(start_node, threshold, dict())
+
+            if found is None:
+                return None
+
+            if isinstance(found, Node):
+                outcome = Outcome.FOUND
+                bestNode = found
+                return tracePath(found)
+
+            # Nothing went over the threshold, so everything reachable has been searched
+            if found == float("inf"):
+                return None
+
+            threshold = found
+
+    finally:
+        # Repair the storage, however the search ended
+        storage.rollback(journalLength)
+
+        if outcome is None:
+            outcome = Outcome.ROUTE_LENGTH if tooLong else Outcome.NO_ROUTE
+        result.outcome = outcome
+        result.bestRoute = tracePath(bestNode)
+        result.bestPosition = bestNode.boxCurrentPosition(selectedBoxID, storage)
+        result.bestEstimate = bestNode.distanceToExitApproximate
 
-            # Keep track of the total boxes moved and the total number of boxes moved
-            neighbour.totalBoxesMoved = set(neighbour.parentNode.totalBoxesMoved)
-            neighbour.totalNumBoxesMoved = neighbour.parentNode.totalNumBoxesMoved
-            if neighbour.moveUsed.box_id not in neighbour.totalBoxesMoved:
-                neighbour.totalBoxesMoved.add(neighbour.moveUsed.box_id)
-                neighbour.totalNumBoxesMoved += 1
+        # Perform some checks
+        if safeMode:
+            noChanges(safe, storage)
+
+
+# Anytime Repairing A* (ARA*): a generator that yields a first route quickly, then better ones as it goes
+# Nodes are scored distanceFromStart + inflation * distanceToExitApproximate. The calibrated penalties are
+# left out, because the heuristic must never overestimate the moves left (both heuristics in heuristic.py
+# are fine), and that's what makes the bound work. Every route yielded is at most bound times longer than
+# the shortest route
+# Each time a route is found, the inflation is lowered by inflationStep (down to 1), and the search carries on
+# from where it was, only going back over the states whose distanceFromStart has improved since
+# The first inflation comes from the calibrated weights, so the first route is found about as quickly as usual
+# The bound is relative to the moves getPossibleNodes offers, so a route that's only reachable through a
+# different order of moves (which can change the storage's available moves) isn't counted
+# Yields (route, bound) every time the route or the bound improves, and stops once the route is the shortest
+# possible (bound 1), there's nothing left to search, or the budget runs out (which includes its deadline
+# passing or its token being cancelled, checked between expansions)
+# The storage is back in its original state whenever a route is yielded
+# If result is a SearchResult, it's filled in once the generator stops: route is the best route yielded, and
+# outcome is FOUND if the search stopped because it couldn't do any better, or else why it stopped
+def ara_star_navigate(
+    storage: Storage,
+    selectedBoxID: int,
+    start: Position,
+    target,
+    onlyMoveThisBox=None,
+    weights=(0.18, 0.65, 0.41, 1.29, 2.81),
+    inflation=None,
+    inflationStep=0.5,
+    heuristic=ManhattanHeuristic,
+    budget=None,
+    result=None,
+):
+    targets = targetSet(target)
+
+    if budget is None:
+        budget = SearchBudget()
+    if result is None:
+        result = SearchResult()
 
-            neighbour.exitClogged = storage.is_valid_position_occupied(target)
+    # Check you're not already there
+    if start in targets:
+        result.route = deque()
+        result.outcome = Outcome.FOUND
+        yield deque(), 1.0
+        return
+
+    if inflation is None:
+        inflation = max(1.0, weights[1] / weights[0])
+
+    estimator = heuristic.forStorage(storage, selectedBoxID, targets)
+
+    def score(node: Node):
+        node.score = node.distanceFromStart + inflation * node.distanceToExitApproximate
+
+    start_node = Node(
+        None,
+        Move(None, None),
+        None,
+        dict(),
+        storage.availableMoves,
+        storage.zobristHash,
+    )
+    start_node.distanceFromStart = 0
+    start_node.distanceToExitApproximate = estimator.estimate(start, dict())
+    score(start_node)
+
+    queue = HeapOpenList()
+    queue.push(start_node)
+
+    # The best Node found so far for every state (its distanceFromStart is the state's g-value)
+    best = ClosedSet()
+    best.add(start_node)
+    # States expanded since the inflation was last lowered
+    closed = set()
+    # Nodes that improved after their state had already been expanded (they're searched again next time)
+    inconsistent = []
+
+    goal = None
+    bestLength = None
+    bestBound = None
+
+    expanded = 0
+    outcome = None
+    # The Node the heuristic puts closest to a target, in case no route is found
+    bestNode = start_node
+    # Set if any Node was left out for going past the longest route allowed
+    maxRouteLength = budget.maxRouteLength
+    tooLong = False
+
+    if safeMode:
+        safe = deepcopy(storage)
+
+    originalBoxPositions = deepcopy(storage.boxes)
+
+    storageNode = start_node
+    journalLength = len(storage.moveJournal)
 
-            calculateUnsafe(neighbour, target, storage, selectedBoxID)
+    try:
+        while True:
+            # Expand Nodes until none of them could lead to a shorter route than the one already found
+            while len(queue) > 0:
+                if goal is not None and goal.distanceFromStart <= queue.peek().score:
+                    break
 
-            neighbour.calculateScore(weights)
+                # Give up once any of the budget has run out
+                outcome = budget.exceeded(expanded, len(queue), len(best))
+                if outcome is not None:
+                    return
+
+                current_node = queue.pop()
+
+                # A better Node for the state has turned up since this one was queued
+                if best.get(current_node) is not current_node:
+                    continue
+
+                storageNode = switchNode(storage, storageNode, current_node)
+                # The move doesn't actually work from the parent's state, so forget about it
+                if storageNode is not current_node:
+                    best.remove(current_node)
+                    continue
+
+                closed.add(current_node.stateKey())
+                expanded += 1
+
+                if safeMode:
+                    boxChecks(safe, storage)
+
+                if (
+                    result.route is None
+                    and current_node.distanceToExitApproximate
+                    < bestNode.distanceToExitApproximate
+                ):
+                    bestNode = current_node
+
+                for neighbour in getPossibleNodes(
+                    storage, current_node, onlyMoveThisBox, originalBoxPositions
+                ):
+                    neighbour.distanceFromStart = current_node.distanceFromStart + 1
+                    if maxRouteLength is not None and (
+                        neighbour.distanceFromStart > maxRouteLength
+                    ):
+                        tooLong = True
+                        continue
+                    if best.isWorse(neighbour):
+                        continue
 
-            # Add the child to the queue in the right place
-            queue.insert(bisect_left(queue, neighbour), neighbour)
+                    neighbour.distanceToExitApproximate = estimator.estimate(
+                        neighbour.boxCurrentPosition(selectedBoxID, storage),
+                        neighbour.movers,
+                    )
+                    score(neighbour)
+                    best.add(neighbour)
 
-        storage = swapBack(storage, restorePoint)
+                    if isGoal(neighbour) and (
+                        goal is None
+                        or neighbour.distanceFromStart < goal.distanceFromStart
+                    ):
+                        goal = neighbour
+
+                    if neighbour.stateKey() in closed:
+                        inconsistent.append(neighbour)
+                    else:
+                        queue.push(neighbour)
+
+            if goal is None:
+                # There's nothing left to search
+                return
+
+            # Nothing still waiting can reach a target in fewer moves than this bound allows for
+            waiting = [
+                node.distanceFromStart + node.distanceToExitApproximate
+                for node in list(queue) + inconsistent
+                if best.get(node) is node
+            ]
+            bound = inflation
+            if waiting:
+                bound = min(bound, goal.distanceFromStart / min(waiting))
+            bound = max(bound, 1.0)
+
+            if (
+                bestLength is None
+                or goal.distanceFromStart < bestLength
+                or bound < bestBound
+            ):
+                bestLength = goal.distanceFromStart
+                bestBound = bound
+
+                # Give the caller the storage back in its original state
+                storage.rollback(journalLength)
+                storageNode = start_node
+                result.route = tracePath(goal)
+                bestNode = goal
+                yield tracePath(goal), bound
+
+            if bound <= 1.0 or inflation <= 1.0:
+                return
+
+            # Tighten the inflation, and requeue everything that's waiting with the new scores
+            inflation = max(1.0, inflation - inflationStep)
+            waitingNodes = [
+                node for node in list(queue) + inconsistent if best.get(node) is node
+            ]
+            queue = HeapOpenList()
+            for node in waitingNodes:
+                score(node)
+                queue.push(node)
+            inconsistent = []
+            closed = set()
+
+    finally:
+        # Repair the storage, however the search ended
+        storage.rollback(journalLength)
+
+        if outcome is None:
+            if result.route is not None:
+                outcome = Outcome.FOUND
+            else:
+                outcome = Outcome.ROUTE_LENGTH if tooLong else Outcome.NO_ROUTE
+        result.outcome = outcome
+        result.bestRoute = tracePath(bestNode)
+        result.bestPosition = bestNode.boxCurrentPosition(selectedBoxID, storage)
+        result.bestEstimate = bestNode.distanceToExitApproximate
 
         # Perform some checks
         if safeMode:
@@ -0,0 +1,98 @@
+import heapq
+from bisect import bisect_left
+from collections import deque
+from itertools import count
+
+# The open list holds every Node that has been discovered, but not expanded yet
+# Any backend needs push(), pop(), peek(), decreaseKey(), len() and iteration, and always pops the Node with the smallest score
+
+
+# The original backend - a deque that's kept sorted by inserting each Node in the right place
+# Every push is O(n), so it's only kept around to compare against
+class SortedOpenList:
+    def __init__(self):
+        self.queue = deque()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def push(self, node) -> bool:
+        self.queue.insert(bisect_left(self.queue, node), node)
+        return True
+
+    # Duplicates are left in the queue, the closed set ignores the worse one when it's popped
+    def decreaseKey(self, node) -> bool:
+        return self.push(node)
+
+    def pop(self):
+        return self.queue.popleft()
+
+    def peek(self):
+        return self.queue[0]
+
+    # Every Node in the queue, in no particular order
+    def __iter__(self):
+        return iter(self.queue)
+
+
+# A binary heap, so pushing and popping is O(log n)
+# Each state only has one "live" entry in the heap. When a better Node for a state turns up,
+# the old entry is marked as removed and left in the heap, then skipped when it's popped (lazy deletion)
+class HeapOpenList:
+    def __init__(self):
+        # Entries are [score, order, node], and node is None once the entry is removed
+        self.heap = []
+        # State key -> the live entry for that state
+        self.entries = dict()
+        # Ties are broken by insertion order. The newest Node wins, which is what the sorted deque did
+        self.counter = count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Add a Node, unless a Node with the same state and a better score is already waiting
+    # On a tie the newer Node replaces the older one, just like the tie-break when popping
+    def push(self, node) -> bool:
+        entry = self.entries.get(node.stateKey())
+        if entry is not None and entry[0] < node.score:
+            return False
+
+        return self.decreaseKey(node)
+
+    # Replace the waiting Node for a state with a better one (or just add it if there isn't one)
+    def decreaseKey(self, node) -> bool:
+        key = node.stateKey()
+
+        oldEntry = self.entries.get(key)
+        if oldEntry is not None:
+            oldEntry[2] = None
+
+        entry = [node.score, -next(self.counter), node]
+        self.entries[key] = entry
+        heapq.heappush(self.heap, entry)
+
+        return True
+
+    def pop(self):
+        while self.heap:
+            node = heapq.heappop(self.heap)[2]
+            # Skip entries that were replaced by a better Node
+            if node is not None:
+                del self.entries[node.stateKey()]
+                return node
+
+        raise IndexError("pop from an empty open list")
+
+    # The Node pop() would return, without removing it
+    def peek(self):
+        while self.heap:
+            node = self.heap[0][2]
+            if node is not None:
+                return node
+            heapq.heappop(self.heap)
+
+        raise IndexError("peek at an empty open list")
+
+    # Every Node in the queue, in no particular order
+    def __iter__(self):
+        return (entry[2] for entry in self.entries.values())
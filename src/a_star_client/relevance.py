@@ -0,0 +1,67 @@
+from warehouse_server.storage import Direction, Position, Storage
+
+# Most boxes in a big warehouse have nothing to do with getting the selected box to its target,
+# but every one of them that can move adds more Nodes to the search
+# Relevance pruning only lets the boxes near the route (and the columns it depends on) move,
+# and the search is tried again with a wider radius if that turns out not to be enough
+
+
+# How far a position is from the inside of a cuboid (0 if it's inside)
+def distanceToRegion(position: Position, low: Position, high: Position) -> int:
+    return (
+        max(low.x - position.x, 0, position.x - high.x)
+        + max(low.y - position.y, 0, position.y - high.y)
+        + max(low.z - position.z, 0, position.z - high.z)
+    )
+
+
+# The IDs of the boxes that could matter for moving the selected box to one of the targets:
+#  - The corridor: every shortest route from the box to a target stays inside the cuboid between them,
+#    so any box within radius moves of one of those cuboids
+#  - The support columns: every box in the selected box's column and the targets' columns
+#  - Anything stacked on top of those boxes, since they can't move until it has
+def relevantBoxes(
+    storage: Storage, selectedBoxID: int, targets: frozenset, radius: int
+) -> set:
+    start = storage.get_box_position(selectedBoxID)
+
+    regions = []
+    for target in targets:
+        low = Position(min(start.x, target.x), min(start.y, target.y), 0)
+        high = Position(
+            max(start.x, target.x), max(start.y, target.y), max(start.z, target.z)
+        )
+        regions.append((low, high))
+
+    columns = {(start.x, start.y)} | {(target.x, target.y) for target in targets}
+
+    relevant = {selectedBoxID}
+    for box_id, box in storage.boxes.items():
+        position = box.position
+        if (position.x, position.y) in columns or any(
+            distanceToRegion(position, low, high) <= radius for low, high in regions
+        ):
+            relevant.add(box_id)
+
+    # Add the boxes stacked on top of relevant ones
+    for box_id in list(relevant):
+        above = storage.get_box_position(box_id) + Direction.Up
+        while storage.is_valid_and_occupied(above):
+            relevant.add(storage.get_id_at_position(above))
+            above += Direction.Up
+
+    return relevant
+
+
+# The relevant boxes for each radius in turn, doubling each time, until every box in the storage is included
+# A radius that doesn't add any boxes is skipped
+def widenings(storage: Storage, selectedBoxID: int, targets: frozenset, radius: int):
+    previous = None
+    while True:
+        relevant = relevantBoxes(storage, selectedBoxID, targets, radius)
+        if len(relevant) >= len(storage.boxes):
+            return
+        if relevant != previous:
+            yield relevant
+        previous = relevant
+        radius = max(1, 2 * radius)
@@ -0,0 +1,196 @@
+from collections import deque
+
+from a_star_client.move_compression import is_compatible
+from a_star_client.navigator import Move, a_star_navigate, targetSet
+from a_star_client.search_stats import SearchStats
+from warehouse_server import error_messages
+from warehouse_server.storage import ALL_DIRECTIONS, Direction, Storage
+
+# Keeps a route up to date while it's being carried out, even if other clients change the storage part way
+# The replanner watches the storage, and only looks at the route again once something else has changed it:
+#  - If what's left of the route still works, it's kept as it is, which only costs replaying it
+#  - Otherwise, whatever is now in the way of the first move that no longer works is moved aside
+#    (by one or two moves) just before it, if that's enough to get the rest of the route working again
+#  - A fresh search from where the storage is now is the last resort
+# The search's states are whole layouts, so any change makes every state in the old search a different one,
+# and a D* Lite style repair of the old search's costs doesn't carry over. Patching the route where it broke
+# does, and starting the search again from that point tends to do worse than a fresh search, as the old
+# route often led straight into whatever got in the way
+
+
+class Replanner:
+    # Any keyword arguments are passed to a_star_navigate for every search
+    def __init__(self, storage: Storage, selectedBoxID: int, target, **searchOptions):
+        self.storage = storage
+        self.selectedBoxID = selectedBoxID
+        self.targets = targetSet(target)
+        self.searchOptions = searchOptions
+
+        # What every search so far has done
+        self.stats = SearchStats()
+        # How many times a change broke the route, and how many of those needed a fresh search
+        self.repairs = 0
+        self.replans = 0
+
+        self.changed = False
+        self.moving = False
+        storage.changeListeners.append(self.storageChanged)
+
+        self.route = self.search()
+
+    def storageChanged(self, storage: Storage):
+        # The replanner's own moves don't count
+        if not self.moving:
+            self.changed = True
+
+    def close(self):
+        if self.storageChanged in self.storage.changeListeners:
+            self.storage.changeListeners.remove(self.storageChanged)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    # Search for a route from the storage's current state
+    def search(self) -> deque or None:
+        return a_star_navigate(
+            self.storage,
+            self.selectedBoxID,
+            self.storage.get_box_position(self.selectedBoxID),
+            self.targets,
+            stats=self.stats,
+            **self.searchOptions,
+        )
+
+    # Play what's left of the route through (the storage is left as it was)
+    # Returns how many moves from the front still work, and if they get the selected box to a target
+    def replay(self) -> (int, bool):
+        journalLength = len(self.storage.moveJournal)
+        try:
+            for index, move in enumerate(self.route):
+                message = self.storage.apply_move(move.box_id, move.direction)
+                if message != error_messages.MOVE_BOX.format(move.box_id):
+                    return index, False
+            return len(self.route), (
+                self.storage.unstableBoxID is None
+                and self.storage.get_box_position(self.selectedBoxID) in self.targets
+            )
+        finally:
+            self.storage.rollback(journalLength)
+
+    # The boxes that can stop a move: the one in the cell it moves into, and the one stacked on the box
+    def blockers(self, move: Move) -> list:
+        position = self.storage.get_box_position(move.box_id)
+        found = []
+        for cell in (position + move.direction, position + Direction.Up):
+            if self.storage.is_valid_and_occupied(cell):
+                found.append(self.storage.get_id_at_position(cell))
+        return found
+
+    # Try to get what's left of the route working again by moving whatever's now in the way of the first move
+    # that no longer works (by one or two moves) just before it
+    # Returns the repaired route, or None if moving a blocker out of the way isn't enough
+    def detour(self, prefix: int) -> deque or None:
+        kept = [self.route[index] for index in range(prefix)]
+        rest = [self.route[index] for index in range(prefix, len(self.route))]
+
+        journalLength = len(self.storage.moveJournal)
+        try:
+            for move in kept:
+                self.storage.apply_move(move.box_id, move.direction)
+            repairPoint = len(self.storage.moveJournal)
+
+            for blocker in self.blockers(rest[0]):
+                detours = [[Move(blocker, d)] for d in ALL_DIRECTIONS]
+                detours += [
+                    first + [Move(blocker, d)]
+                    for first in detours
+                    for d in ALL_DIRECTIONS
+                    if d is not first[0].direction.opposite()
+                ]
+                for moves in detours:
+                    if self.works(moves + rest):
+                        return deque(kept + moves + rest)
+                    self.storage.rollback(repairPoint)
+        finally:
+            self.storage.rollback(journalLength)
+
+        return None
+
+    # Make each move in turn, and check the selected box ends up stable on a target
+    # The moves are left made, so the caller has to roll them back
+    def works(self, moves: list) -> bool:
+        for move in moves:
+            message = self.storage.apply_move(move.box_id, move.direction)
+            if message != error_messages.MOVE_BOX.format(move.box_id):
+                return False
+        return (
+            self.storage.unstableBoxID is None
+            and self.storage.get_box_position(self.selectedBoxID) in self.targets
+        )
+
+    # Bring the route up to date with any changes to the storage, and return what's left of it
+    # Returns None if there's no longer any route
+    def replan(self) -> deque or None:
+        if not self.changed:
+            return self.route
+        self.changed = False
+
+        if self.route is not None:
+            prefix, reached = self.replay()
+            if reached:
+                return self.route
+
+            self.repairs += 1
+            if prefix < len(self.route):
+                route = self.detour(prefix)
+                if route is not None:
+                    self.route = route
+                    return self.route
+
+        self.replans += 1
+        self.route = self.search()
+        return self.route
+
+    @property
+    def done(self) -> bool:
+        return self.route is not None and len(self.route) == 0
+
+    # The moves from the front of the route that can be made together
+    def nextGroup(self) -> list:
+        group = []
+        for move in self.route:
+            if not is_compatible(group, move, self.storage):
+                break
+            group.append(move)
+        return group
+
+    # Bring the route up to date, then make the next group of moves that can be made together
+    # (the same groups compress_moves makes) with move_multiple_boxes
+    # Returns the moves made, or None if there's no longer any route
+    def step(self) -> list or None:
+        if self.replan() is None:
+            return None
+
+        group = self.nextGroup()
+        if len(group) == 0 and len(self.route) > 0:
+            # The moves a storage offers can depend on the order boxes were moved in,
+            # so the route can stop working even if nothing else has changed the storage
+            self.changed = True
+            if self.replan() is None:
+                return None
+            group = self.nextGroup()
+
+        self.moving = True
+        try:
+            message = self.storage.move_multiple_boxes(group)
+        finally:
+            self.moving = False
+        if message != error_messages.SUCCESS_MESSAGE:
+            raise ValueError(message)
+
+        for _ in group:
+            self.route.popleft()
+        return group
@@ -0,0 +1,196 @@
+import os
+import pickle
+from collections import OrderedDict, deque
+
+from a_star_client.budget import Outcome, SearchResult
+from a_star_client.navigator import Move, a_star_navigate, targetSet
+from a_star_client.search_stats import SearchStats
+from warehouse_server import error_messages
+from warehouse_server.storage import ALL_DIRECTIONS, Storage
+
+# Remembers the routes a_star_navigate has found, so asking for the same route again doesn't search again
+# A route is looked up by a fingerprint of the storage (its size, the Zobrist hash of every box's position and
+# the unstable box), the box, the targets, and the options given to the search
+# The least recently used routes are dropped once there are too many, and the cache can be saved to a file
+# A storage the cache watches tells it whenever add_box, remove_box or move_box changes it, and every route
+# found for the storage as it was is dropped
+# Only a route that was found, or a search that ran out of states, is remembered. A search that ran out of
+# budget (or was cancelled) says nothing about the storage, so the next lookup searches again
+
+
+# Everything about a storage a route depends on
+def fingerprint(storage: Storage) -> tuple:
+    return (
+        storage.width,
+        storage.depth,
+        storage.height,
+        storage.zobrist.seed,
+        storage.zobristHash,
+        storage.unstableBoxID,
+    )
+
+
+class RouteCache:
+    # validate replays each remembered route before giving it back (see isValid)
+    # Turning it off makes a lookup a few microseconds rather than a replay of every move
+    def __init__(self, maxSize=256, path=None, validate=True):
+        self.maxSize = maxSize
+        self.path = path
+        self.validate = validate
+
+        # Key -> the route as (box ID, direction index) pairs, or None if there's no route
+        self.routes = OrderedDict()
+        # Storage fingerprint -> the keys of the routes found for it
+        self.keysByFingerprint = dict()
+
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.routes)
+
+    # Drop every route whenever the storage changes
+    def watch(self, storage: Storage):
+        if self.invalidate not in storage.changeListeners:
+            storage.changeListeners.append(self.invalidate)
+
+    def unwatch(self, storage: Storage):
+        if self.invalidate in storage.changeListeners:
+            storage.changeListeners.remove(self.invalidate)
+
+    # Drop every route found for the storage as it is now
+    def invalidate(self, storage: Storage):
+        for key in self.keysByFingerprint.pop(fingerprint(storage), ()):
+            self.routes.pop(key, None)
+
+    # Only the options that change which route is found are part of the key
+    # (stats, budget and result don't, and navigate deals with withStats itself)
+    def key(self, storage: Storage, selectedBoxID: int, target, searchOptions: dict):
+        options = tuple(
+            sorted(
+                (name, frozenset(value) if isinstance(value, set) else value)
+                for name, value in searchOptions.items()
+                if name != "stats"
+            )
+        )
+        return fingerprint(storage), selectedBoxID, targetSet(target), options
+
+    def store(self, key, route):
+        if route is not None:
+            route = tuple((move.box_id, move.direction.index) for move in route)
+        self.remember(key, route)
+
+    def remember(self, key, route):
+        self.routes[key] = route
+        self.routes.move_to_end(key)
+        self.keysByFingerprint.setdefault(key[0], set()).add(key)
+
+        while len(self.routes) > self.maxSize:
+            oldKey, _ = self.routes.popitem(last=False)
+            keys = self.keysByFingerprint.get(oldKey[0])
+            keys.discard(oldKey)
+            if not keys:
+                del self.keysByFingerprint[oldKey[0]]
+
+    # Check a remembered route still gets the box to a target from the storage as it is now
+    # The moves a storage offers can depend on the order its boxes were moved in, not just where they are,
+    # so a route found for the same layout isn't always valid
+    @staticmethod
+    def isValid(storage: Storage, selectedBoxID: int, targets: frozenset, route):
+        journalLength = len(storage.moveJournal)
+        try:
+            for box_id, direction in route:
+                message = storage.apply_move(box_id, ALL_DIRECTIONS[direction])
+                if message != error_messages.MOVE_BOX.format(box_id):
+                    return False
+            return (
+                storage.get_box_position(selectedBoxID) in targets
+                and storage.unstableBoxID is None
+            )
+        finally:
+            storage.rollback(journalLength)
+
+    # Like a_star_navigate, but a route that's been found before is given straight back
+    # Any other keyword arguments are passed to a_star_navigate, and have to be hashable (apart from stats)
+    # budget and result are passed straight to the search. On a hit, result only gets the route and outcome,
+    # and with withStats on, the stats given back are untouched
+    def navigate(
+        self,
+        storage: Storage,
+        selectedBoxID: int,
+        target,
+        budget=None,
+        result=None,
+        withStats=False,
+        **searchOptions,
+    ):
+        if result is None:
+            result = SearchResult()
+        if withStats and searchOptions.get("stats") is None:
+            searchOptions["stats"] = SearchStats()
+
+        route = self.find(storage, selectedBoxID, target, budget, result, searchOptions)
+        if withStats:
+            return route, searchOptions["stats"]
+        return route
+
+    def find(
+        self,
+        storage: Storage,
+        selectedBoxID: int,
+        target,
+        budget,
+        result: SearchResult,
+        searchOptions: dict,
+    ) -> deque or None:
+        key = self.key(storage, selectedBoxID, target, searchOptions)
+
+        if key in self.routes:
+            route = self.routes[key]
+            if (
+                route is None
+                or not self.validate
+                or self.isValid(storage, selectedBoxID, key[2], route)
+            ):
+                self.hits += 1
+                self.routes.move_to_end(key)
+                if route is None:
+                    result.outcome = Outcome.NO_ROUTE
+                    return None
+                result.outcome = Outcome.FOUND
+                result.route = deque(
+                    Move(box_id, ALL_DIRECTIONS[direction])
+                    for box_id, direction in route
+                )
+                return result.route
+
+        self.misses += 1
+        route = a_star_navigate(
+            storage,
+            selectedBoxID,
+            storage.get_box_position(selectedBoxID),
+            target,
+            budget=budget,
+            result=result,
+            **searchOptions,
+        )
+        result.route = route
+        if result.outcome in (Outcome.FOUND, Outcome.NO_ROUTE):
+            self.store(key, route)
+        return route
+
+    def save(self, path=None):
+        path = path or self.path
+        # Write to a temporary file first, so a crash never leaves half a cache behind
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as file:
+            pickle.dump(list(self.routes.items()), file)
+        os.replace(temporary, path)
+
+    def load(self, path=None):
+        with open(path or self.path, "rb") as file:
+            for key, route in pickle.load(file):
+                self.remember(key, route)
@@ -0,0 +1,186 @@
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from a_star_client.budget import Outcome, SearchBudget, SearchResult
+from a_star_client.navigator import a_star_navigate
+from warehouse_server.grid import GRID_BACKENDS
+from warehouse_server.storage import Box, Position, Storage, movesDictionary
+
+# Routes lots of (box, target) jobs at once, by sharing them out between a pool of worker processes
+# Every job is routed against the same snapshot of the storage, which is packed into a flat array of ints,
+# put in shared memory once, and unpacked by each worker when it starts (rather than being sent with every job)
+
+BACKENDS = list(GRID_BACKENDS)
+
+
+# The outcome of a job. route is None if there's no route, and error is set if the job failed or timed out
+@dataclass
+class RouteResult:
+    box_id: int
+    target: Position
+    route: object = None
+    error: Exception = None
+
+
+# Pack everything a search depends on into a flat array of 64-bit ints:
+#   width, depth, height, backend, Zobrist seed, unstable box (0 if there isn't one),
+#   the number of boxes, unlocked moves and locked moves, then
+#   (ID, x, y, z) for each box, and (x, y, z, mask) for each unlocked, then each locked move
+# The boxes and moves are kept in the same order, so the search expands Nodes in the same order too
+def encodeSnapshot(storage: Storage) -> bytes:
+    moves = storage.availableMoves
+    values = array(
+        "q",
+        [
+            storage.width,
+            storage.depth,
+            storage.height,
+            BACKENDS.index(storage.backend),
+            storage.zobrist.seed,
+            storage.unstableBoxID or 0,
+            len(storage.boxes),
+            len(moves.unlockedMasks),
+            len(moves.lockedMasks),
+        ],
+    )
+
+    for box_id, box in storage.boxes.items():
+        values.extend((box_id, box.position.x, box.position.y, box.position.z))
+    for masks in (moves.unlockedMasks, moves.lockedMasks):
+        for startPos, mask in masks.items():
+            values.extend((startPos.x, startPos.y, startPos.z, mask))
+
+    return values.tobytes()
+
+
+def decodeSnapshot(data: bytes) -> Storage:
+    values = array("q")
+    values.frombytes(data)
+
+    width, depth, height, backend, seed, unstable = values[:6]
+    boxCount, unlockedCount, lockedCount = values[6:9]
+
+    storage = Storage(width, depth, height, backend=BACKENDS[backend])
+    storage.zobrist.seed = seed
+
+    index = 9
+    for _ in range(boxCount):
+        box_id, x, y, z = values[index : index + 4]
+        storage.add_box(box_id, Box(Position(x, y, z)), force=True, ignoreMoves=True)
+        index += 4
+    storage.unstableBoxID = unstable or None
+
+    # The moves are copied as they were, rather than worked out again
+    storage.availableMoves = movesDictionary()
+    for count, masks in (
+        (unlockedCount, storage.availableMoves.unlockedMasks),
+        (lockedCount, storage.availableMoves.lockedMasks),
+    ):
+        for _ in range(count):
+            x, y, z, mask = values[index : index + 4]
+            masks[Position(x, y, z)] = mask
+            index += 4
+
+    return storage
+
+
+# Each worker process keeps the storage unpacked from the snapshot
+workerStorage = None
+
+
+def loadSnapshot(memoryName, size: int, data: bytes):
+    global workerStorage
+
+    if memoryName is not None:
+        memory = shared_memory.SharedMemory(name=memoryName)
+        data = bytes(memory.buf[:size])
+        memory.close()
+
+    workerStorage = decodeSnapshot(data)
+
+
+def routeJob(box_id: int, target, timeout, searchOptions: dict):
+    storage = workerStorage
+    args = (storage, box_id, storage.get_box_position(box_id), target)
+    if timeout is None:
+        return a_star_navigate(*args, **searchOptions)
+
+    # The search stops itself at the deadline and puts the storage back, so the next job can use it straight away
+    budget = searchOptions.get("budget") or SearchBudget()
+    options = dict(
+        searchOptions, budget=replace(budget, deadline=time.monotonic() + timeout)
+    )
+    result = SearchResult()
+    route = a_star_navigate(*args, result=result, **options)
+    if result.outcome is Outcome.DEADLINE:
+        raise TimeoutError("Routing exceeded allowed runtime")
+    return route
+
+
+# Routes jobs against a read-only snapshot of a storage, in parallel
+# The storage can change once the service has been made, the jobs will still see it as it was
+# Use it as a context manager (or call close()) to stop the workers and free the shared memory
+# Any other keyword arguments are passed to a_star_navigate for every job
+class RoutingService:
+    def __init__(self, storage: Storage, workers=None, timeout=None, **searchOptions):
+        self.timeout = timeout
+        self.searchOptions = searchOptions
+
+        snapshot = encodeSnapshot(storage)
+
+        # Without shared memory, the snapshot is sent to each worker when it starts instead
+        self.memory = None
+        if shared_memory is not None:
+            self.memory = shared_memory.SharedMemory(create=True, size=len(snapshot))
+            self.memory.buf[: len(snapshot)] = snapshot
+            initargs = (self.memory.name, len(snapshot), None)
+        else:
+            initargs = (None, len(snapshot), snapshot)
+
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers, initializer=loadSnapshot, initargs=initargs
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    # Start routing a box to a target (or to any of a collection of targets), and return its Future
+    # The timeout (in seconds) starts when a worker picks the job up, not when it's submitted
+    def submit(self, box_id: int, target, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        return self.executor.submit(
+            routeJob, box_id, target, timeout, self.searchOptions
+        )
+
+    # Route every (box_id, target) job, and yield a RouteResult for each one as soon as it's done
+    def routeAll(self, jobs, timeout=None):
+        futures = {
+            self.submit(box_id, target, timeout): (box_id, target)
+            for box_id, target in jobs
+        }
+
+        for future in as_completed(futures):
+            box_id, target = futures[future]
+            error = future.exception()
+            if error is not None:
+                yield RouteResult(box_id, target, error=error)
+            else:
+                yield RouteResult(box_id, target, route=future.result())
+
+    def close(self):
+        self.executor.shutdown()
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
@@ -0,0 +1,55 @@
+import json
+from dataclasses import asdict, dataclass
+
+# What a search did, and where its time went
+# Pass one to a_star_navigate as stats (or ask for one back with withStats) and it's added to as the search runs,
+# so the same SearchStats can keep a running total over several searches
+
+
+@dataclass
+class SearchStats:
+    # Nodes taken off the open list and expanded, and Nodes added to it
+    expanded: int = 0
+    generated: int = 0
+    # Nodes dropped because their state had already been reached at least as cheaply
+    duplicates: int = 0
+
+    # The most Nodes held in the open list and the closed set at once
+    peakOpen: int = 0
+    peakVisited: int = 0
+
+    # Seconds spent moving the storage between Nodes (what swapOut and swapBack used to do),
+    # finding each Node's neighbours, and scoring them (which is where the heuristic is worked out)
+    switchTime: float = 0.0
+    neighbourTime: float = 0.0
+    scoreTime: float = 0.0
+
+    # The heuristic's estimate at the start and at the goal that was found (None if there wasn't one)
+    startHeuristic: float = None
+    goalHeuristic: float = None
+
+    # Add another search's counts to this one
+    # Peaks are the largest of either, as the searches didn't hold their Nodes at the same time
+    def add(self, other):
+        self.expanded += other.expanded
+        self.generated += other.generated
+        self.duplicates += other.duplicates
+        self.peakOpen = max(self.peakOpen, other.peakOpen)
+        self.peakVisited = max(self.peakVisited, other.peakVisited)
+        self.switchTime += other.switchTime
+        self.neighbourTime += other.neighbourTime
+        self.scoreTime += other.scoreTime
+        if self.startHeuristic is None:
+            self.startHeuristic = other.startHeuristic
+        if other.goalHeuristic is not None:
+            self.goalHeuristic = other.goalHeuristic
+
+    def toDict(self) -> dict:
+        return asdict(self)
+
+    def toJSON(self) -> str:
+        return json.dumps(self.toDict())
+
+    @classmethod
+    def fromJSON(cls, text: str):
+        return cls(**json.loads(text))
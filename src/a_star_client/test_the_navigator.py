@@ -1,13 +1,35 @@
+import threading
+import time
 from collections import deque
+from copy import deepcopy
 
 import pytest
 
-from warehouse_server import utils
+from warehouse_server import error_messages, utils
 from warehouse_server.storage import Position, Box, Direction, movesDictionary
 from warehouse_server.warehouse import Warehouse
 from . import navigator
-from .navigator import Node, Move
+from .navigator import Node, Move, StateKey
 from a_star_client.move_compression import compress_moves
+from a_star_client.budget import (
+    CancellationToken,
+    Outcome,
+    SearchBudget,
+    SearchResult,
+)
+from a_star_client.closed_set import ClosedSet
+from a_star_client.cooperative import cooperative_navigate
+from a_star_client.heuristic import BlockerHeuristic, ManhattanHeuristic
+from a_star_client.open_list import HeapOpenList, SortedOpenList
+from a_star_client.relevance import relevantBoxes, widenings
+from a_star_client.replanner import Replanner
+from a_star_client.route_cache import RouteCache
+from a_star_client.routing_service import (
+    RoutingService,
+    decodeSnapshot,
+    encodeSnapshot,
+)
+from a_star_client.search_stats import SearchStats
 
 Test_Box_id = 1
 
@@ -279,6 +301,184 @@ def test_set_comparing():
     assert len(theSet) == 2
 
 
+# Test Nodes that moved the same box to different places aren't treated as the same state
+def test_state_key_includes_positions():
+    node1 = Node(None, None, None, {1: Position(1, 0, 0)}, None)
+    node2 = Node(None, None, None, {1: Position(0, 1, 0)}, None)
+    node3 = Node(None, None, None, {1: Position(1, 0, 0)}, None)
+
+    assert node1.stateKey() != node2.stateKey()
+    assert node1.stateKey() == node3.stateKey()
+    assert hash(node1) == hash(node3)
+
+
+# Test the closed set only lets a state back in if it's been reached more cheaply
+def test_closed_set_keeps_best_distance():
+    visited = ClosedSet()
+
+    node = Node(None, None, None, {1: Position(1, 1, 0)}, None)
+    node.distanceFromStart = 5
+    visited.add(node)
+
+    same = Node(None, None, None, {1: Position(1, 1, 0)}, None)
+    same.distanceFromStart = 5
+    better = Node(None, None, None, {1: Position(1, 1, 0)}, None)
+    better.distanceFromStart = 3
+    other = Node(None, None, None, {1: Position(2, 1, 0)}, None)
+    other.distanceFromStart = 9
+
+    assert same in visited
+    assert visited.isWorse(same)
+    assert not visited.isWorse(better)
+    assert not visited.isWorse(other)
+
+    visited.add(better)
+
+    assert len(visited) == 1
+    assert visited.get(node) is better
+
+
+# Test state keys with the same hash still have their movers compared, so collisions aren't merged
+def test_state_key_confirms_collisions():
+    movers1 = {1: Position(1, 0, 0)}
+    movers2 = {1: Position(0, 1, 0)}
+
+    assert StateKey(1234, movers1) == StateKey(1234, dict(movers1))
+    assert StateKey(1234, movers1) != StateKey(1234, movers2)
+    assert StateKey(1234, movers1) != StateKey(4321, movers1)
+
+    keys = {StateKey(1234, movers1), StateKey(1234, movers2)}
+    assert len(keys) == 2
+
+
+# Test Nodes reaching the same layout by different routes get the same Zobrist hash
+def test_node_zobrist_matches_storage():
+    warehouse_test = Warehouse(4, 4, 2)
+    warehouse_test.add_box(1, Box(Position(0, 0, 0)))
+    warehouse_test.add_box(2, Box(Position(3, 3, 0)))
+
+    root = Node(None, None, None, dict(), None, warehouse_test.zobristHash)
+    nodes = navigator.getPossibleNodes(
+        warehouse_test,
+        root,
+        None,
+        {1: Box(Position(0, 0, 0)), 2: Box(Position(3, 3, 0))},
+    )
+
+    for node in nodes:
+        expected = warehouse_test.zobristHash ^ warehouse_test.zobrist.moveKey(
+            node.moveUsed.box_id,
+            warehouse_test.get_box_position(node.moveUsed.box_id),
+            node.movers[node.moveUsed.box_id],
+        )
+        assert node.zobrist == expected
+
+    warehouse_test.move_box(1, Direction.North)
+    warehouse_test.move_box(1, Direction.East)
+    northEast = warehouse_test.zobristHash
+    warehouse_test.move_box(1, Direction.West)
+    warehouse_test.move_box(1, Direction.South)
+    warehouse_test.move_box(1, Direction.East)
+    warehouse_test.move_box(1, Direction.North)
+
+    assert warehouse_test.zobristHash == northEast
+
+
+# Test the target is penalised for every empty cell below it, and for the selected box holding it up
+def test_calculate_unsafe():
+    warehouse_test = Warehouse(4, 4, 5)
+    warehouse_test.add_box(1, Box(Position(0, 0, 0)))
+    warehouse_test.add_box(2, Box(Position(1, 0, 0)))
+
+    node = Node(None, None, None, dict(), None)
+    navigator.calculateUnsafe(node, Position(2, 0, 2), warehouse_test, 1)
+    assert node.targetUnsafe == 8
+
+    node = Node(None, None, None, dict(), None)
+    navigator.calculateUnsafe(node, Position(1, 0, 2), warehouse_test, 1)
+    assert node.targetUnsafe == 4
+
+    # The selected box can't support itself
+    node = Node(None, None, None, dict(), None)
+    navigator.calculateUnsafe(node, Position(1, 0, 2), warehouse_test, 2)
+    assert node.targetUnsafe == 14
+
+    node = Node(None, None, None, dict(), None)
+    navigator.calculateUnsafe(node, Position(0, 0, 0), warehouse_test, 1)
+    assert node.targetUnsafe == 20
+
+
+def scored_node(movers, score, distanceFromStart=0):
+    node = Node(None, None, None, movers, None)
+    node.score = score
+    node.distanceFromStart = distanceFromStart
+    return node
+
+
+# Test the heap pops the best score first, and breaks ties in favour of the newest Node
+def test_heap_open_list_order():
+    openList = HeapOpenList()
+
+    first = scored_node({1: Position(1, 0, 0)}, 2)
+    second = scored_node({1: Position(2, 0, 0)}, 1)
+    third = scored_node({1: Position(3, 0, 0)}, 2)
+
+    for node in (first, second, third):
+        openList.push(node)
+
+    assert len(openList) == 3
+    assert openList.pop() is second
+    assert openList.pop() is third
+    assert openList.pop() is first
+    assert len(openList) == 0
+
+    with pytest.raises(IndexError):
+        openList.pop()
+
+
+# Test a better Node for the same state replaces the waiting one, and a worse one is ignored
+def test_heap_open_list_duplicates():
+    openList = HeapOpenList()
+
+    original = scored_node({1: Position(1, 0, 0)}, 5, 4)
+    worse = scored_node({1: Position(1, 0, 0)}, 7, 6)
+    better = scored_node({1: Position(1, 0, 0)}, 3, 2)
+    other = scored_node({2: Position(1, 0, 0)}, 4, 3)
+
+    assert openList.push(original)
+    assert not openList.push(worse)
+    assert openList.push(other)
+    assert openList.push(better)
+
+    # The replaced entry is still in the heap, but shouldn't count or be popped
+    assert len(openList) == 2
+    assert openList.pop() is better
+    assert openList.pop() is other
+    assert len(openList) == 0
+
+
+# Test both open list backends find the same route
+def test_open_list_backends_agree():
+    routes = []
+    for backend in (HeapOpenList, SortedOpenList):
+        warehouse_test = Warehouse(3, 4, 1)
+        warehouse_test.fillAreaWithBoxes(Position(0, 2, 0), Position(2, 3, 0), 2)
+        warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+
+        routes.append(
+            navigator.a_star_navigate(
+                warehouse_test,
+                Test_Box_id,
+                Position(0, 0, 0),
+                Position(0, 3, 0),
+                openList=backend,
+            )
+        )
+
+    assert routes[0] is not None
+    assert len(routes[0]) == len(routes[1])
+
+
 # Test swapOut and swapBack works as intended
 def test_swap_out_and_swap_back():
     warehouse_test = Warehouse(6, 6, 2)
@@ -403,6 +603,69 @@ def test_swap_out_and_swap_back():
     assert reconstructedStorage.get_box_position(4) == Position(3, 2, 0)
 
 
+# Test switching between sibling Nodes only undoes and applies the moves between them
+def test_switch_node():
+    warehouse_test = Warehouse(5, 5, 2)
+    warehouse_test.add_box(1, Box(Position(0, 0, 0)))
+    warehouse_test.add_box(2, Box(Position(4, 4, 0)))
+
+    root = Node(None, None, None, dict(), None)
+    a = Node(root, Move(1, Direction.North), None, {1: Position(0, 1, 0)}, None)
+    aa = Node(
+        a,
+        Move(2, Direction.West),
+        None,
+        {1: Position(0, 1, 0), 2: Position(3, 4, 0)},
+        None,
+    )
+    b = Node(root, Move(1, Direction.East), None, {1: Position(1, 0, 0)}, None)
+    bb = Node(
+        b,
+        Move(2, Direction.South),
+        None,
+        {1: Position(1, 0, 0), 2: Position(4, 3, 0)},
+        None,
+    )
+
+    assert navigator.switchNode(warehouse_test, root, aa) is aa
+    assert warehouse_test.get_box_position(1) == Position(0, 1, 0)
+    assert warehouse_test.get_box_position(2) == Position(3, 4, 0)
+    assert len(warehouse_test.moveJournal) == 2
+
+    assert navigator.switchNode(warehouse_test, aa, bb) is bb
+    assert warehouse_test.get_box_position(1) == Position(1, 0, 0)
+    assert warehouse_test.get_box_position(2) == Position(4, 3, 0)
+    assert len(warehouse_test.moveJournal) == 2
+
+    assert navigator.switchNode(warehouse_test, bb, root) is root
+    assert warehouse_test.get_box_position(1) == Position(0, 0, 0)
+    assert warehouse_test.get_box_position(2) == Position(4, 4, 0)
+    assert len(warehouse_test.moveJournal) == 0
+
+    # A move that can't be made leaves the storage in the parent's state
+    blocked = Node(a, Move(1, Direction.Down), None, {1: Position(0, 1, -1)}, None)
+    assert navigator.switchNode(warehouse_test, root, blocked) is a
+    assert warehouse_test.get_box_position(1) == Position(0, 1, 0)
+
+
+# Test the navigator leaves the storage exactly how it found it
+def test_navigate_restores_storage():
+    warehouse_test = Warehouse(4, 4, 4)
+    warehouse_test.add_box(1, Box(Position(0, 0, 0)))
+    warehouse_test.add_box(2, Box(Position(0, 0, 1)))
+    warehouse_test.add_box(3, Box(Position(0, 1, 0)))
+
+    safe = deepcopy(warehouse_test)
+
+    route = navigator.a_star_navigate(
+        warehouse_test, 1, Position(0, 0, 0), Position(3, 3, 0)
+    )
+
+    assert route is not None
+    assert len(warehouse_test.moveJournal) == 0
+    utils.noChanges(safe, warehouse_test)
+
+
 # Test the algorithm doesn't allow a box to end in an unstable position
 def test_cannot_end_unstable():
     warehouse_test = Warehouse(4, 4, 4)
@@ -562,3 +825,922 @@ def test_simple_compress():
         [Move(1, Direction.North)],
         [Move(1, Direction.North)],
     ]
+
+
+# Test the navigator heads for the closest of several targets
+def test_multiple_targets():
+    warehouse_test = Warehouse(10, 10, 1)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+
+    route = navigator.a_star_navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        {Position(9, 9, 0), Position(0, 3, 0)},
+    )
+
+    assert len(route) == 3
+    for move in route:
+        warehouse_test.move_box(move.box_id, move.direction)
+    assert warehouse_test.get_box_position(Test_Box_id) == Position(0, 3, 0)
+
+    # Already being on one of the targets is fine
+    assert (
+        len(
+            navigator.a_star_navigate(
+                warehouse_test,
+                Test_Box_id,
+                Position(0, 3, 0),
+                [Position(9, 9, 0), Position(0, 3, 0)],
+            )
+        )
+        == 0
+    )
+
+
+# Test the bidirectional search finds the same routes, and they work
+@pytest.mark.parametrize("onlyMoveThisBox", [None, Test_Box_id])
+def test_bidirectional(onlyMoveThisBox):
+    warehouse_test = Warehouse(6, 6, 1)
+    mazeStencil = [
+        [0, 1, 0, 0, 0, 0],
+        [0, 1, 0, 1, 1, 0],
+        [0, 1, 0, 1, 1, 0],
+        [0, 1, 0, 0, 1, 0],
+        [0, 1, 1, 0, 1, 0],
+        [0, 0, 0, 0, 1, 0],
+    ]
+    warehouse_test.stencilLayer(mazeStencil, 5)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+    safe = deepcopy(warehouse_test)
+
+    route = navigator.a_star_navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        Position(5, 5, 0),
+        onlyMoveThisBox=onlyMoveThisBox,
+        bidirectional=True,
+    )
+
+    utils.noChanges(safe, warehouse_test)
+
+    if onlyMoveThisBox is not None:
+        assert len(route) == 22
+    assert navigator.isValidRoute(warehouse_test, route)
+    for move in route:
+        warehouse_test.move_box(move.box_id, move.direction)
+    assert warehouse_test.get_box_position(Test_Box_id) == Position(5, 5, 0)
+
+
+# Test the backward search can step down off a ledge (which is a step up when it's reversed)
+def test_bidirectional_ledge():
+    warehouse_test = Warehouse(6, 3, 3)
+    warehouse_test.add_box(2, Box(Position(2, 0, 0)))
+    warehouse_test.add_box(3, Box(Position(3, 0, 0)))
+    warehouse_test.add_box(4, Box(Position(3, 0, 1)))
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+
+    route = navigator.a_star_navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        Position(3, 0, 2),
+        bidirectional=True,
+    )
+
+    assert route is not None
+    assert navigator.isValidRoute(warehouse_test, route)
+
+
+# Test IDA* finds the only route through a maze, and leaves the storage as it was
+def test_ida_star_maze():
+    warehouse_test = Warehouse(6, 6, 1)
+    mazeStencil = [
+        [0, 1, 0, 0, 0, 0],
+        [0, 1, 0, 1, 1, 0],
+        [0, 1, 0, 1, 1, 0],
+        [0, 1, 0, 0, 1, 0],
+        [0, 1, 1, 0, 1, 0],
+        [0, 0, 0, 0, 1, 0],
+    ]
+    warehouse_test.stencilLayer(mazeStencil, 5)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+    safe = deepcopy(warehouse_test)
+
+    route = navigator.ida_star_navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        Position(5, 5, 0),
+        onlyMoveThisBox=Test_Box_id,
+    )
+
+    utils.noChanges(safe, warehouse_test)
+    assert len(route) == 22
+    assert navigator.isValidRoute(warehouse_test, route)
+
+
+# Test IDA* can move other boxes out of the way, and climb
+def test_ida_star_legup():
+    warehouse_test = Warehouse(6, 3, 3)
+    warehouse_test.add_box(Test_Box_id, Box(Position(2, 0, 0)))
+    warehouse_test.add_box(2, Box(Position(0, 0, 0)))
+
+    route = navigator.ida_star_navigate(
+        warehouse_test, Test_Box_id, Position(2, 0, 0), Position(5, 0, 1)
+    )
+
+    assert route is not None
+    assert navigator.isValidRoute(warehouse_test, route)
+    for move in route:
+        warehouse_test.move_box(move.box_id, move.direction)
+    assert warehouse_test.get_box_position(Test_Box_id) == Position(5, 0, 1)
+
+
+# Test IDA* gives up once there's nowhere left to search
+def test_ida_star_no_route():
+    warehouse_test = Warehouse(3, 1, 1)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+    warehouse_test.add_box(2, Box(Position(1, 0, 0)))
+
+    assert (
+        navigator.ida_star_navigate(
+            warehouse_test, Test_Box_id, Position(0, 0, 0), Position(2, 0, 0)
+        )
+        is None
+    )
+
+
+# Test ARA* keeps improving the route until it's the shortest, and gives the storage back each time
+def test_ara_star_improves():
+    warehouse_test = Warehouse(6, 6, 1)
+    mazeStencil = [
+        [0, 0, 0, 0, 0, 0],
+        [0, 1, 1, 1, 1, 0],
+        [0, 0, 0, 0, 1, 0],
+        [1, 1, 1, 0, 1, 0],
+        [0, 0, 0, 0, 1, 0],
+        [0, 1, 1, 1, 1, 0],
+    ]
+    warehouse_test.stencilLayer(mazeStencil, 5)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+    safe = deepcopy(warehouse_test)
+
+    results = []
+    for route, bound in navigator.ara_star_navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        Position(5, 0, 0),
+        onlyMoveThisBox=Test_Box_id,
+        inflation=5,
+    ):
+        utils.noChanges(safe, warehouse_test)
+        assert navigator.isValidRoute(warehouse_test, route)
+        results.append((len(route), bound))
+
+    lengths = [length for length, _ in results]
+    bounds = [bound for _, bound in results]
+    assert lengths == sorted(lengths, reverse=True)
+    assert bounds == sorted(bounds, reverse=True)
+    assert bounds[-1] == 1.0
+    assert lengths[-1] == len(
+        navigator.a_star_navigate(
+            warehouse_test,
+            Test_Box_id,
+            Position(0, 0, 0),
+            Position(5, 0, 0),
+            onlyMoveThisBox=Test_Box_id,
+        )
+    )
+
+
+# Test ARA* stops once it runs out of time, and still leaves the storage as it was
+def test_ara_star_time_limit():
+    warehouse_test = Warehouse(20, 20, 1)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+    safe = deepcopy(warehouse_test)
+
+    result = SearchResult()
+    results = list(
+        navigator.ara_star_navigate(
+            warehouse_test,
+            Test_Box_id,
+            Position(0, 0, 0),
+            Position(19, 19, 0),
+            budget=SearchBudget.within(0),
+            result=result,
+        )
+    )
+
+    assert results == []
+    assert result.outcome is Outcome.DEADLINE
+    assert result.route is None
+    assert result.bestRoute == deque()
+    utils.noChanges(safe, warehouse_test)
+
+
+# Test IDA* and ARA* stop with the part of the budget that ran out, rather than searching on
+@pytest.mark.parametrize("mode", ["ida", "ara"])
+@pytest.mark.parametrize(
+    "budget, expected",
+    [
+        (SearchBudget(maxExpansions=5), Outcome.EXPANSIONS),
+        (SearchBudget(maxNodes=5), Outcome.NODES),
+        (SearchBudget(maxRouteLength=2), Outcome.ROUTE_LENGTH),
+    ],
+)
+def test_ida_ara_budget(mode, budget, expected):
+    warehouse_test = shimmyWarehouse()
+    safe = deepcopy(warehouse_test)
+    result = SearchResult()
+
+    if mode == "ida":
+        route = navigator.ida_star_navigate(
+            warehouse_test,
+            Test_Box_id,
+            Position(0, 0, 0),
+            Position(0, 3, 0),
+            budget=budget,
+            result=result,
+        )
+    else:
+        routes = list(
+            navigator.ara_star_navigate(
+                warehouse_test,
+                Test_Box_id,
+                Position(0, 0, 0),
+                Position(0, 3, 0),
+                budget=budget,
+                result=result,
+            )
+        )
+        route = routes[-1][0] if routes else None
+
+    assert route is None
+    assert result.outcome is expected
+    assert result.route is None
+    assert navigator.isValidRoute(warehouse_test, result.bestRoute)
+    utils.noChanges(safe, warehouse_test)
+
+
+def shimmyWarehouse() -> Warehouse:
+    warehouse_test = Warehouse(3, 4, 1)
+    warehouse_test.fillAreaWithBoxes(Position(0, 2, 0), Position(2, 3, 0), 2)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+    return warehouse_test
+
+
+# Test the blocker heuristic counts the boxes in the way, without going over the shortest route
+@pytest.mark.parametrize(
+    "heuristic, expected", [(ManhattanHeuristic, 3), (BlockerHeuristic, 5)]
+)
+def test_blocker_heuristic_admissible(heuristic, expected):
+    warehouse_test = shimmyWarehouse()
+    targets = frozenset((Position(0, 3, 0),))
+
+    estimator = heuristic.forStorage(warehouse_test, Test_Box_id, targets)
+    assert estimator.estimate(Position(0, 0, 0), dict()) == expected
+    assert estimator.estimate(Position(0, 3, 0), dict()) == 0
+
+    # Clearing a box out of the way can only bring the estimate down
+    assert estimator.estimate(Position(0, 0, 0), {2: Position(1, 1, 0)}) <= expected
+
+    *_, (route, bound) = navigator.ara_star_navigate(
+        warehouse_test, Test_Box_id, Position(0, 0, 0), targets, heuristic=heuristic
+    )
+    assert bound == 1.0
+    assert len(route) >= expected
+
+
+# Test the blocker heuristic is only built once for the same layout
+def test_blocker_heuristic_cached():
+    warehouse_test = shimmyWarehouse()
+    targets = frozenset((Position(0, 3, 0),))
+
+    first = BlockerHeuristic.forStorage(warehouse_test, Test_Box_id, targets)
+    assert BlockerHeuristic.forStorage(warehouse_test, Test_Box_id, targets) is first
+    assert BlockerHeuristic.forStorage(shimmyWarehouse(), Test_Box_id, targets) is first
+
+    warehouse_test.move_box(Test_Box_id, Direction.East)
+    assert (
+        BlockerHeuristic.forStorage(warehouse_test, Test_Box_id, targets) is not first
+    )
+
+
+# Test the blocker heuristic finds an equally short route, while expanding fewer Nodes
+def test_blocker_heuristic_fewer_nodes():
+    results = []
+    for heuristic in (ManhattanHeuristic, BlockerHeuristic):
+        warehouse_test = shimmyWarehouse()
+        stats = SearchStats()
+        route = navigator.a_star_navigate(
+            warehouse_test,
+            Test_Box_id,
+            Position(0, 0, 0),
+            Position(0, 3, 0),
+            heuristic=heuristic,
+            stats=stats,
+        )
+        assert navigator.isValidRoute(warehouse_test, route)
+        results.append((len(route), stats.expanded))
+
+    (manhattanLength, manhattanExpanded), (blockerLength, blockerExpanded) = results
+    assert blockerLength == manhattanLength
+    assert blockerExpanded < manhattanExpanded
+
+
+# Test only the boxes near the route, in the support columns, or stacked on those are relevant
+def test_relevant_boxes():
+    warehouse_test = Warehouse(10, 10, 5)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+    # Next to the route
+    warehouse_test.add_box(2, Box(Position(4, 1, 0)))
+    # Stacked on that one
+    warehouse_test.add_box(3, Box(Position(4, 1, 1)))
+    # In the target's column
+    warehouse_test.add_box(4, Box(Position(9, 0, 0)))
+    # Nowhere near
+    warehouse_test.add_box(5, Box(Position(5, 9, 0)))
+    warehouse_test.add_box(6, Box(Position(0, 5, 0)))
+
+    targets = frozenset((Position(9, 0, 1),))
+
+    assert relevantBoxes(warehouse_test, Test_Box_id, targets, 0) == {
+        Test_Box_id,
+        4,
+    }
+    assert relevantBoxes(warehouse_test, Test_Box_id, targets, 1) == {
+        Test_Box_id,
+        2,
+        3,
+        4,
+    }
+    assert [
+        len(relevant) for relevant in widenings(warehouse_test, Test_Box_id, targets, 1)
+    ] == [4, 5]
+
+
+# Test the search widens until it finds a box that's far away from the route, but needed to climb
+def test_relevance_widens():
+    warehouse_test = Warehouse(10, 3, 3)
+    warehouse_test.add_box(Test_Box_id, Box(Position(5, 0, 0)))
+    warehouse_test.add_box(2, Box(Position(0, 0, 0)))
+
+    stats = SearchStats()
+    route = navigator.a_star_navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(5, 0, 0),
+        Position(9, 0, 1),
+        relevance=1,
+        stats=stats,
+    )
+
+    assert route is not None
+    assert navigator.isValidRoute(warehouse_test, route)
+    assert any(move.box_id == 2 for move in route)
+    assert stats.expanded > 0
+
+
+# Test moves are only independent when neither can affect the cells the other looks at
+def test_independent_moves():
+    assert navigator.independentMoves(
+        Position(0, 0, 0), Position(1, 0, 0), Position(3, 0, 0), Position(4, 0, 0)
+    )
+    # Diagonally next to each other, so one could be holding the other up from the side
+    assert not navigator.independentMoves(
+        Position(0, 0, 0), Position(1, 0, 0), Position(2, 1, 1), Position(2, 1, 0)
+    )
+    # Moving into the cell the other one just left
+    assert not navigator.independentMoves(
+        Position(0, 0, 0), Position(1, 0, 0), Position(1, 0, 0), Position(2, 0, 0)
+    )
+
+
+# Test the partial-order reduction finds an equally short route, while generating fewer Nodes
+def test_partial_order_reduction():
+    results = []
+    for partialOrder in (False, True):
+        warehouse_test = Warehouse(10, 10, 10)
+        warehouse_test.add_box(Test_Box_id, Box(Position(5, 0, 0)))
+        warehouse_test.add_box(2, Box(Position(0, 0, 0)))
+
+        stats = SearchStats()
+        route = navigator.a_star_navigate(
+            warehouse_test,
+            Test_Box_id,
+            Position(5, 0, 0),
+            Position(9, 0, 1),
+            partialOrder=partialOrder,
+            stats=stats,
+        )
+        assert navigator.isValidRoute(warehouse_test, route)
+        results.append((len(route), stats.generated))
+
+    (fullLength, fullGenerated), (reducedLength, reducedGenerated) = results
+    assert reducedLength == fullLength
+    assert reducedGenerated < fullGenerated
+
+
+# Test a storage comes back out of a snapshot exactly as it went in, available moves included
+def test_snapshot_round_trip():
+    warehouse_test = shimmyWarehouse()
+    warehouse_test.move_box(Test_Box_id, Direction.East)
+
+    copy = decodeSnapshot(encodeSnapshot(warehouse_test))
+
+    utils.noChanges(warehouse_test, copy)
+    assert copy.zobristHash == warehouse_test.zobristHash
+    assert list(copy.getAvailableDirections()) == list(
+        warehouse_test.getAvailableDirections()
+    )
+
+
+# Test the routing service finds the same routes as routing one at a time, and reports timeouts
+def test_routing_service():
+    warehouse_test = shimmyWarehouse()
+    warehouse_test.add_box(12, Box(Position(2, 0, 0)))
+    jobs = [(Test_Box_id, Position(0, 3, 0)), (12, Position(2, 3, 0))]
+
+    with RoutingService(warehouse_test, workers=2) as service:
+        # Changing the storage afterwards doesn't affect the jobs
+        warehouse_test.remove_box(12)
+        results = {result.box_id: result for result in service.routeAll(jobs)}
+
+        assert results.keys() == {Test_Box_id, 12}
+        assert all(result.error is None for result in results.values())
+
+        timedOut = list(service.routeAll(jobs[:1], timeout=0))
+        assert isinstance(timedOut[0].error, TimeoutError)
+        assert timedOut[0].route is None
+
+    warehouse_test.add_box(12, Box(Position(2, 0, 0)))
+    for box_id, target in jobs:
+        expected = navigator.a_star_navigate(
+            warehouse_test,
+            box_id,
+            warehouse_test.get_box_position(box_id),
+            target,
+        )
+        assert list(results[box_id].route) == list(expected)
+
+
+# Test several boxes can be routed at once, and their moves made together in fewer steps
+def test_cooperative_navigate():
+    warehouse_test = Warehouse(8, 6, 3)
+    for lane in range(4):
+        warehouse_test.add_box(lane + 1, Box(Position(2 * lane, 0, 0)))
+    # Something in the way of the first box, and something stacked on the last
+    warehouse_test.add_box(5, Box(Position(0, 3, 0)))
+    warehouse_test.add_box(6, Box(Position(6, 0, 1)))
+
+    jobs = [(lane + 1, Position(2 * lane, 5, 0)) for lane in range(4)]
+    schedule = cooperative_navigate(warehouse_test, jobs)
+
+    # The storage is left as it was
+    assert warehouse_test.get_box_position(1) == Position(0, 0, 0)
+    assert len(warehouse_test.moveJournal) == 0
+
+    assert all(route is not None for route in schedule.routes.values())
+    assert schedule.serialLength == sum(
+        len(route) for route in schedule.routes.values()
+    )
+    assert schedule.makespan < schedule.serialLength
+
+    for group in schedule.groups:
+        assert (
+            warehouse_test.move_multiple_boxes(group) == error_messages.SUCCESS_MESSAGE
+        )
+    for box_id, target in jobs:
+        assert warehouse_test.get_box_position(box_id) == target
+    assert warehouse_test.unstableBoxID is None
+
+
+# Test asking for the same route again is answered from the cache, until the storage changes
+def test_route_cache(tmp_path):
+    warehouse_test = shimmyWarehouse()
+    cache = RouteCache(maxSize=2, path=str(tmp_path / "routes.pickle"))
+    cache.watch(warehouse_test)
+
+    expected = navigator.a_star_navigate(
+        warehouse_test, Test_Box_id, Position(0, 0, 0), Position(0, 3, 0)
+    )
+    route = cache.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0))
+    assert list(route) == list(expected)
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # The stats don't change which route is found
+    stats = SearchStats()
+    again = cache.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0), stats=stats)
+    assert list(again) == list(expected)
+    assert stats == SearchStats()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Other options are routed separately
+    cache.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0), partialOrder=False)
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # It's saved, and can be loaded into a new cache
+    cache.save()
+    loaded = RouteCache(path=cache.path)
+    assert len(loaded) == 2
+    assert list(
+        loaded.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0))
+    ) == list(expected)
+    assert loaded.hits == 1
+
+    # The least recently used route is dropped
+    cache.navigate(warehouse_test, Test_Box_id, Position(1, 3, 0))
+    assert len(cache) == 2
+    cache.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0))
+    assert cache.misses == 4
+
+    # Changing the storage drops everything found for it
+    warehouse_test.move_box(Test_Box_id, Direction.East)
+    assert len(cache) == 0
+    cache.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0))
+    assert cache.misses == 5
+
+    # A route that no longer works isn't given back
+    warehouse_test.move_box(Test_Box_id, Direction.West)
+    cache.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0))
+    assert len(cache) == 1
+    for key in cache.routes:
+        cache.routes[key] = ((Test_Box_id, Direction.Up.index),)
+    route = cache.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0))
+    assert list(route) == list(expected)
+    assert cache.misses == 7
+
+
+# Test a search that runs out of budget isn't remembered as there being no route
+def test_route_cache_budget():
+    warehouse_test = shimmyWarehouse()
+    cache = RouteCache()
+
+    result = SearchResult()
+    route = cache.navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 3, 0),
+        budget=SearchBudget(maxExpansions=1),
+        result=result,
+    )
+    assert route is None
+    assert result.outcome is Outcome.EXPANSIONS
+    assert len(cache) == 0
+
+    # So the next lookup searches again, and finds the route
+    route = cache.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0))
+    assert navigator.isValidRoute(warehouse_test, route)
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    # Proving there's no route is remembered
+    warehouse_test = Warehouse(3, 1, 1)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+    warehouse_test.add_box(2, Box(Position(1, 0, 0)))
+    for _ in range(2):
+        result = SearchResult()
+        assert (
+            cache.navigate(
+                warehouse_test, Test_Box_id, Position(2, 0, 0), result=result
+            )
+            is None
+        )
+        assert result.outcome is Outcome.NO_ROUTE
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+# Test the options that only control how a search runs don't split up the cache
+def test_route_cache_options():
+    warehouse_test = shimmyWarehouse()
+    cache = RouteCache()
+    route = cache.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0))
+
+    # A deadline is a different time on every call, but it's the same route
+    assert list(
+        cache.navigate(
+            warehouse_test,
+            Test_Box_id,
+            Position(0, 3, 0),
+            budget=SearchBudget.within(10),
+        )
+    ) == list(route)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # A result is filled in on a hit as well
+    result = SearchResult()
+    cache.navigate(warehouse_test, Test_Box_id, Position(0, 3, 0), result=result)
+    assert result.found
+    assert list(result.route) == list(route)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    # withStats gives back the route and stats, like a_star_navigate
+    again, stats = cache.navigate(
+        warehouse_test, Test_Box_id, Position(0, 3, 0), withStats=True
+    )
+    assert list(again) == list(route)
+    assert stats == SearchStats()
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # A set of movable boxes can still be part of the key
+    _, stats = cache.navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(2, 3, 0),
+        withStats=True,
+        movable={Test_Box_id, 2},
+    )
+    assert stats.expanded > 0
+    assert len(cache) == 2
+
+
+# Test a route being carried out is patched up when another client gets in its way, rather than searched for again
+def test_replanner():
+    warehouse_test = Warehouse(8, 3, 3)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 1, 0)))
+    warehouse_test.add_box(2, Box(Position(7, 0, 0)))
+
+    with Replanner(warehouse_test, Test_Box_id, Position(7, 1, 0)) as replanner:
+        assert len(replanner.route) == 7
+        searched = replanner.stats.expanded
+
+        assert len(replanner.step()) == 1
+        assert len(replanner.route) == 6
+
+        # A change that doesn't get in the way leaves the route alone
+        warehouse_test.move_box(2, Direction.East)
+        warehouse_test.move_box(2, Direction.West)
+        replanner.step()
+        assert (replanner.repairs, replanner.replans) == (0, 0)
+
+        # A box dropped in the way is moved aside
+        warehouse_test.add_box(3, Box(Position(4, 1, 0)))
+        while not replanner.done:
+            assert replanner.step() is not None
+
+        assert (replanner.repairs, replanner.replans) == (1, 0)
+        assert replanner.stats.expanded == searched
+
+    assert warehouse_test.get_box_position(Test_Box_id) == Position(7, 1, 0)
+    assert warehouse_test.changeListeners == []
+
+
+# Test the search reports what it did, and the report survives being turned into JSON
+def test_search_stats():
+    warehouse_test = shimmyWarehouse()
+
+    route, stats = navigator.a_star_navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        Position(0, 3, 0),
+        heuristic=BlockerHeuristic,
+        withStats=True,
+    )
+    assert list(route) == list(
+        navigator.a_star_navigate(
+            warehouse_test,
+            Test_Box_id,
+            Position(0, 0, 0),
+            Position(0, 3, 0),
+            heuristic=BlockerHeuristic,
+        )
+    )
+
+    assert stats.expanded > 0
+    assert stats.generated >= stats.expanded - 1
+    assert stats.peakOpen > 0
+    assert stats.peakVisited == stats.expanded
+    assert min(stats.switchTime, stats.neighbourTime, stats.scoreTime) >= 0
+    assert 0 < stats.startHeuristic <= len(route)
+    assert stats.goalHeuristic == 0
+
+    assert SearchStats.fromJSON(stats.toJSON()) == stats
+
+    # Searching again with the same stats adds to them
+    expanded = stats.expanded
+    navigator.a_star_navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        Position(0, 3, 0),
+        heuristic=BlockerHeuristic,
+        stats=stats,
+    )
+    assert stats.expanded == 2 * expanded
+
+
+# Test the search gives up when any of its budget runs out, and says which one it was
+def test_search_budget():
+    warehouse_test = shimmyWarehouse()
+
+    def search(**limits):
+        stats = SearchStats()
+        result = navigator.a_star_search(
+            warehouse_test,
+            Test_Box_id,
+            Position(0, 0, 0),
+            Position(0, 3, 0),
+            SearchBudget(**limits),
+            stats=stats,
+        )
+        return result, stats
+
+    result, stats = search()
+    assert result.found
+    shortest = len(result.route)
+    assert result.bestPosition == Position(0, 3, 0)
+    assert list(result.bestRoute) == list(result.route)
+
+    result, stats = search(maxExpansions=3)
+    assert result.outcome is Outcome.EXPANSIONS
+    assert result.route is None
+    assert stats.expanded == 3
+    # The best state reached is given back, with a route that gets there
+    assert result.bestEstimate <= stats.startHeuristic
+    assert navigator.isValidRoute(warehouse_test, result.bestRoute)
+    assert len(result.bestRoute) < 3
+
+    assert search(maxNodes=5)[0].outcome is Outcome.NODES
+    assert search(maxMemory=SearchBudget.nodeBytes)[0].outcome is Outcome.MEMORY
+    assert search(deadline=time.monotonic())[0].outcome is Outcome.DEADLINE
+
+    assert search(maxRouteLength=2)[0].outcome is Outcome.ROUTE_LENGTH
+    assert len(search(maxRouteLength=shortest)[0].route) == shortest
+
+    # Relevance pruning doesn't widen once the budget has run out
+    result = navigator.a_star_search(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        Position(0, 3, 0),
+        SearchBudget.within(0),
+        relevance=0,
+    )
+    assert result.outcome is Outcome.DEADLINE
+
+
+# Test a search can be cancelled from another thread, and puts the storage back as it was when it stops
+def test_cancellation():
+    warehouse_test = shimmyWarehouse()
+    boxes = warehouse_test.serialize_box_positions()
+    zobristHash = warehouse_test.zobristHash
+    unlocked = warehouse_test.availableMoves.unlocked
+    locked = warehouse_test.availableMoves.locked
+
+    # Searching every route up to a move short of the shortest one takes a few seconds
+    token = CancellationToken()
+    timer = threading.Timer(0.05, token.cancel)
+    timer.start()
+    began = time.monotonic()
+    result = navigator.a_star_search(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        Position(0, 3, 0),
+        SearchBudget(maxRouteLength=8, token=token),
+    )
+    timer.join()
+
+    assert result.outcome is Outcome.CANCELLED
+    assert result.route is None
+    assert time.monotonic() - began < 1
+
+    assert warehouse_test.serialize_box_positions() == boxes
+    assert warehouse_test.zobristHash == zobristHash
+    assert warehouse_test.availableMoves.unlocked == unlocked
+    assert warehouse_test.availableMoves.locked == locked
+    assert warehouse_test.moveJournal == []
+    assert warehouse_test.unstableBoxID is None
+
+    # A token's deadline is shared by every search given it, including ones split between processes
+    token = CancellationToken.after(0)
+    assert token.cancelled
+    for workers in (None, 1):
+        result = navigator.a_star_search(
+            warehouse_test,
+            Test_Box_id,
+            Position(0, 0, 0),
+            Position(0, 3, 0),
+            SearchBudget(token=token),
+            workers=workers,
+        )
+        assert result.outcome is Outcome.DEADLINE
+
+
+# Test IDA* and ARA* stop soon after being cancelled from another thread, and put the storage back
+@pytest.mark.parametrize("mode", ["ida", "ara"])
+def test_ida_ara_cancellation(mode):
+    warehouse_test = shimmyWarehouse()
+    boxes = warehouse_test.serialize_box_positions()
+    zobristHash = warehouse_test.zobristHash
+    unlocked = warehouse_test.availableMoves.unlocked
+    locked = warehouse_test.availableMoves.locked
+
+    # Either search takes several seconds to search every route up to this length
+    token = CancellationToken()
+    budget = SearchBudget(maxRouteLength=8, token=token)
+    result = SearchResult()
+    timer = threading.Timer(0.05, token.cancel)
+    timer.start()
+    began = time.monotonic()
+    if mode == "ida":
+        route = navigator.ida_star_navigate(
+            warehouse_test,
+            Test_Box_id,
+            Position(0, 0, 0),
+            Position(0, 3, 0),
+            budget=budget,
+            result=result,
+        )
+    else:
+        routes = list(
+            navigator.ara_star_navigate(
+                warehouse_test,
+                Test_Box_id,
+                Position(0, 0, 0),
+                Position(0, 3, 0),
+                budget=budget,
+                result=result,
+            )
+        )
+        route = routes[-1][0] if routes else None
+    timer.join()
+
+    assert route is None
+    assert result.outcome is Outcome.CANCELLED
+    assert time.monotonic() - began < 1
+
+    assert warehouse_test.serialize_box_positions() == boxes
+    assert warehouse_test.zobristHash == zobristHash
+    assert warehouse_test.availableMoves.unlocked == unlocked
+    assert warehouse_test.availableMoves.locked == locked
+    assert warehouse_test.moveJournal == []
+    assert warehouse_test.unstableBoxID is None
+
+
+# Test the search can be shared out between processes, and still finds a route
+@pytest.mark.parametrize("workers", [1, 3])
+def test_hda_star(workers):
+    warehouse_test = shimmyWarehouse()
+
+    stats = SearchStats()
+    route = navigator.a_star_navigate(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        Position(0, 3, 0),
+        stats=stats,
+        workers=workers,
+    )
+
+    assert navigator.isValidRoute(warehouse_test, route)
+    assert stats.expanded > 0
+    assert stats.generated >= stats.expanded - 1
+
+
+# Test the workers all agree there's nothing left to search when there's no route
+def test_hda_star_no_route():
+    warehouse_test = Warehouse(3, 1, 1)
+    warehouse_test.add_box(Test_Box_id, Box(Position(0, 0, 0)))
+    warehouse_test.add_box(2, Box(Position(1, 0, 0)))
+
+    assert (
+        navigator.a_star_navigate(
+            warehouse_test, Test_Box_id, Position(0, 0, 0), Position(2, 0, 0), workers=2
+        )
+        is None
+    )
+
+
+# Test the workers say which part of the budget ran out, and what the best state they reached was
+@pytest.mark.parametrize(
+    "budget, expected",
+    [
+        (SearchBudget(maxExpansions=2), Outcome.EXPANSIONS),
+        (SearchBudget(maxNodes=2), Outcome.NODES),
+        (SearchBudget(maxRouteLength=2), Outcome.ROUTE_LENGTH),
+        (SearchBudget(), Outcome.FOUND),
+    ],
+)
+def test_hda_star_budget(budget, expected):
+    warehouse_test = shimmyWarehouse()
+
+    result = navigator.a_star_search(
+        warehouse_test,
+        Test_Box_id,
+        Position(0, 0, 0),
+        Position(0, 3, 0),
+        budget,
+        workers=2,
+    )
+
+    assert result.outcome is expected
+    assert navigator.isValidRoute(warehouse_test, result.bestRoute)
+    if result.found:
+        assert result.bestRoute == result.route
+        assert result.bestPosition == Position(0, 3, 0)
+    else:
+        assert result.route is None
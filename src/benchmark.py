@@ -1,8 +1,15 @@
 import cProfile
 import io
 import pstats
+import random
+import time
 
 from a_star_client import navigator
+from a_star_client.closed_set import ClosedSet
+from a_star_client.cooperative import cooperative_navigate
+from a_star_client.heuristic import BlockerHeuristic, ManhattanHeuristic
+from a_star_client.routing_service import RoutingService
+from a_star_client.search_stats import SearchStats
 from warehouse_server import utils
 from warehouse_server import warehouse
 from warehouse_server.storage import Position, Box
@@ -119,14 +126,192 @@ def benchmarkMoreAndMore(strength) -> Warehouse:
     return testWarehouse, Position(0, 0, 0), Position(10, 0, 0)
 
 
-def benchmarkTestFunction(testWarehouse, Test_Box_id, startingPosition, endPosition):
+def benchmarkTestFunction(
+    testWarehouse,
+    Test_Box_id,
+    startingPosition,
+    endPosition,
+    heuristic=ManhattanHeuristic,
+    stats=None,
+):
     route = navigator.a_star_navigate(
-        testWarehouse, Test_Box_id, startingPosition, endPosition
+        testWarehouse,
+        Test_Box_id,
+        startingPosition,
+        endPosition,
+        heuristic=heuristic,
+        stats=stats,
     )
 
     return route
 
 
+# Compares how many Nodes each heuristic expands (and how long the route is) in each scenario
+def benchmarkHeuristics(heuristics=(ManhattanHeuristic, BlockerHeuristic)):
+    scenarios = [
+        benchmarkMaze,
+        benchmarkDash,
+        benchmarkShimmy,
+        benchmarkSliding,
+        benchmarkUnderTheExit,
+    ]
+
+    print("Scenario              | Heuristic          | Nodes expanded | Route length")
+    for scenario in scenarios:
+        for heuristic in heuristics:
+            storage, start, end = scenario()
+            stats = SearchStats()
+            route = benchmarkTestFunction(storage, 1, start, end, heuristic, stats)
+            print(
+                "%-21s | %-18s | %-14s | %s"
+                % (
+                    scenario.__name__,
+                    heuristic.__name__,
+                    stats.expanded,
+                    None if route is None else len(route),
+                )
+            )
+
+
+# Measures how many expansions per second the visited check allows as the number of visited Nodes grows
+# Each "expansion" checks 6 neighbours against the visited Nodes, like a box in open space would
+def benchmarkClosedSet(sizes=(1000, 5000, 10000, 25000, 50000), expansions=2000):
+    random.seed(0)
+
+    def randomNode():
+        movers = {
+            box_id: Position(
+                random.randrange(0, 20), random.randrange(0, 20), random.randrange(0, 5)
+            )
+            for box_id in random.sample(range(1, 50), 3)
+        }
+        node = navigator.Node(None, None, None, movers, None)
+        node.distanceFromStart = random.randrange(0, 100)
+        return node
+
+    visited = ClosedSet()
+    oldVisited = set()
+    neighbours = [randomNode() for _ in range(6 * expansions)]
+
+    # Nodes cache their key, so work them out beforehand to keep the first row fair
+    for neighbour in neighbours:
+        neighbour.stateKey()
+
+    print("Visited  | Indexed (expansions/s) | Linear scan (expansions/s)")
+    for size in sizes:
+        while len(visited) < size:
+            node = randomNode()
+            visited.add(node)
+            oldVisited.add(node)
+
+        start = time.perf_counter()
+        for neighbour in neighbours:
+            visited.isWorse(neighbour)
+        indexedRate = expansions / (time.perf_counter() - start)
+
+        # The linear scan is far slower, so only time a handful of expansions
+        linearExpansions = 10
+        start = time.perf_counter()
+        for neighbour in neighbours[: 6 * linearExpansions]:
+            any(visitedNode == neighbour for visitedNode in oldVisited)
+        linearRate = linearExpansions / (time.perf_counter() - start)
+
+        print("%-8s | %-22s | %s" % (size, round(indexedRate), round(linearRate)))
+
+
+# Compares how many Nodes are generated with and without relevance pruning, as more boxes are added
+def benchmarkRelevance(strengths=(2, 100, 300, 600, 1100), radius=2):
+    print(
+        "Boxes | Generated (all boxes) | Generated (radius %s) | Route length" % radius
+    )
+    for strength in strengths:
+        row = [strength]
+        for relevance in (None, radius):
+            storage, start, end = benchmarkMoreAndMore(strength)
+            stats = SearchStats()
+            route = navigator.a_star_navigate(
+                storage, 1, start, end, stats=stats, relevance=relevance
+            )
+            row.append(stats.generated)
+        row.append(None if route is None else len(route))
+        print("%-5s | %-21s | %-19s | %s" % tuple(row))
+
+
+# Compares routing a batch of jobs one after the other against sharing them out between worker processes
+def benchmarkRoutingService(jobs=16, workers=None):
+    storage, start, end = benchmarkShimmy()
+
+    began = time.perf_counter()
+    for _ in range(jobs):
+        benchmarkTestFunction(storage, 1, start, end)
+    serial = time.perf_counter() - began
+
+    with RoutingService(storage, workers=workers) as service:
+        began = time.perf_counter()
+        results = list(service.routeAll([(1, end)] * jobs))
+        parallel = time.perf_counter() - began
+
+    if any(result.route is None for result in results):
+        exit("Test failed - no route found!")
+
+    print("Jobs | Serial (s) | Routing service (s)")
+    print("%-4s | %-10s | %s" % (jobs, round(serial, 3), round(parallel, 3)))
+
+
+# Compares a single search against sharing it out between more and more worker processes
+def benchmarkParallelSearch(workerCounts=(1, 2, 4, 8, 16)):
+    storage, start, end = benchmarkSliding()
+
+    print("Workers | Time (s) | Nodes expanded | Route length")
+    for workers in workerCounts:
+        stats = SearchStats()
+        began = time.perf_counter()
+        route = navigator.a_star_navigate(
+            storage, 1, start, end, stats=stats, workers=workers
+        )
+        print(
+            "%-7s | %-8s | %-14s | %s"
+            % (
+                workers,
+                round(time.perf_counter() - began, 3),
+                stats.expanded,
+                None if route is None else len(route),
+            )
+        )
+
+
+# Compares making several routes one after the other with a cooperative schedule of moves made at the same time
+def benchmarkCooperative(lanes=5, length=9):
+    storage = Warehouse(2 * lanes, length + 1, 3)
+    for lane in range(lanes):
+        storage.add_box(lane + 1, Box(Position(2 * lane, 0, 0)))
+        # A box in each lane, that has to be moved out of the way
+        storage.add_box(lanes + lane + 1, Box(Position(2 * lane, length // 2, 0)))
+
+    jobs = [(lane + 1, Position(2 * lane, length, 0)) for lane in range(lanes)]
+
+    began = time.perf_counter()
+    schedule = cooperative_navigate(storage, jobs)
+    taken = time.perf_counter() - began
+
+    if any(route is None for route in schedule.routes.values()):
+        exit("Test failed - no route found!")
+
+    print("Boxes | Serial moves | Makespan | Time (s)")
+    print(
+        "%-5s | %-12s | %-8s | %s"
+        % (lanes, schedule.serialLength, schedule.makespan, round(taken, 3))
+    )
+
+
+# Prints what each search did as JSON, one line per suite
+def benchmarkSearchStats():
+    for storage, start, end in tests:
+        stats = SearchStats()
+        benchmarkTestFunction(storage, 1, start, end, stats=stats)
+        print(stats.toJSON())
+
+
 # Initialise the storage outside the test
 tests = [
     benchmarkMaze(),
@@ -136,7 +321,7 @@ tests = [
     # benchmarkSeaOfNothing(),
     benchmarkUnderTheExit(),
     benchmarkMoreAndMore(2),
-    # benchmarkMoreAndMore(1100),
+    benchmarkMoreAndMore(1100),
 ]
 
 
@@ -146,8 +331,9 @@ def runSuites():
         print("Starting test")
         storage.__class__ = warehouse.Warehouse
         storage.prettyPrintLayer(0)
-        testOutputs.append(benchmarkTestFunction(storage, 1, start, end))
-        print("Test passed")
+        stats = SearchStats()
+        testOutputs.append(benchmarkTestFunction(storage, 1, start, end, stats=stats))
+        print("Test passed (%s nodes expanded)" % stats.expanded)
     return testOutputs
 
 
@@ -161,7 +347,28 @@ thoroughness = "InvalidInput!"
 import sys
 
 args = sys.argv[1:]
-if len(args) == 0:
+if args == ["closed"]:
+    benchmarkClosedSet()
+    exit(0)
+elif args == ["heuristics"]:
+    benchmarkHeuristics()
+    exit(0)
+elif args == ["relevance"]:
+    benchmarkRelevance()
+    exit(0)
+elif args == ["service"]:
+    benchmarkRoutingService()
+    exit(0)
+elif args == ["parallel"]:
+    benchmarkParallelSearch()
+    exit(0)
+elif args == ["cooperative"]:
+    benchmarkCooperative()
+    exit(0)
+elif args == ["stats"]:
+    benchmarkSearchStats()
+    exit(0)
+elif len(args) == 0:
     thoroughness = 0
 elif len(args) == 1:
     try:
@@ -79,7 +79,8 @@ def small_random_number():
 # stress testing
 
 if __name__ == "__main__":
-    warehouse = Storage(100, 100, 100)
+    # Box IDs only go up to 90, so almost all of the storage stays empty
+    warehouse = Storage(100, 100, 100, backend="chunked")
 
     for i in range(0, 100000):
         print(random_check_box_existence(warehouse))
@@ -0,0 +1,274 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The occupancy grid holds the ID of the box in every cell of the storage (or 0 if it's empty)
+# Every backend gives exactly the same answers, they just store the cells differently
+
+
+# Nested lists, indexed [x][y][z]
+# Reading and writing a single cell is as fast as it gets, but whole-grid operations are Python loops
+class ListGrid:
+    def __init__(self, width: int, depth: int, height: int):
+        self.width = width
+        self.depth = depth
+        self.height = height
+
+        self.cells = [[[0] * height for _ in range(depth)] for _ in range(width)]
+
+    def get(self, x: int, y: int, z: int) -> int:
+        return self.cells[x][y][z]
+
+    def set(self, x: int, y: int, z: int, value: int):
+        self.cells[x][y][z] = value
+
+    def clear(self):
+        for column in (column for plane in self.cells for column in plane):
+            column[:] = [0] * self.height
+
+    def snapshot(self):
+        copy = ListGrid.__new__(ListGrid)
+        copy.width, copy.depth, copy.height = self.width, self.depth, self.height
+        copy.cells = [[column.copy() for column in plane] for plane in self.cells]
+        return copy
+
+    def equals(self, other) -> bool:
+        return self.serialize() == other.serialize()
+
+    # The IDs in a horizontal layer, indexed [x][y]
+    def layer(self, z: int) -> list:
+        return [[column[z] for column in plane] for plane in self.cells]
+
+    # How many cells are taken up to (and including) the highest box in a column
+    def columnHeight(self, x: int, y: int) -> int:
+        column = self.cells[x][y]
+        for z in range(self.height - 1, -1, -1):
+            if column[z] != 0:
+                return z + 1
+        return 0
+
+    # The columnHeight of every column, indexed [x][y]
+    def heightMap(self) -> list:
+        return [
+            [self.columnHeight(x, y) for y in range(self.depth)]
+            for x in range(self.width)
+        ]
+
+    # Every box ID in the grid (duplicates included)
+    def occupied(self) -> list:
+        return [
+            value
+            for plane in self.cells
+            for column in plane
+            for value in column
+            if value != 0
+        ]
+
+    def maxID(self) -> int:
+        return max((max(column) for plane in self.cells for column in plane), default=0)
+
+    def isEmpty(self) -> bool:
+        return not any(any(column) for plane in self.cells for column in plane)
+
+    # The grid as nested lists, indexed [x][y][z]
+    def serialize(self) -> list:
+        return [[column.copy() for column in plane] for plane in self.cells]
+
+
+# A single int32 numpy array, indexed [x, y, z]
+# Reading a single cell is slower than a list, but clearing, copying, comparing, slicing and
+# serialising the whole grid are vectorised, and each cell takes 4 bytes rather than a Python object
+class NumpyGrid:
+    def __init__(self, width: int, depth: int, height: int):
+        if np is None:
+            raise ImportError("The numpy grid backend needs numpy to be installed")
+
+        self.width = width
+        self.depth = depth
+        self.height = height
+
+        self.cells = np.zeros((width, depth, height), dtype=np.int32)
+
+    def get(self, x: int, y: int, z: int) -> int:
+        return self.cells.item(x, y, z)
+
+    def set(self, x: int, y: int, z: int, value: int):
+        self.cells[x, y, z] = value
+
+    def clear(self):
+        self.cells.fill(0)
+
+    def snapshot(self):
+        copy = NumpyGrid.__new__(NumpyGrid)
+        copy.width, copy.depth, copy.height = self.width, self.depth, self.height
+        copy.cells = self.cells.copy()
+        return copy
+
+    def equals(self, other) -> bool:
+        if isinstance(other, NumpyGrid):
+            return np.array_equal(self.cells, other.cells)
+        return np.array_equal(self.cells, np.asarray(other.serialize()))
+
+    def layer(self, z: int) -> list:
+        return self.cells[:, :, z].tolist()
+
+    def columnHeight(self, x: int, y: int) -> int:
+        occupied = np.flatnonzero(self.cells[x, y, :])
+        return int(occupied[-1]) + 1 if len(occupied) > 0 else 0
+
+    def heightMap(self) -> list:
+        occupied = self.cells != 0
+        # Find the highest occupied cell by looking for the first one from the top
+        highest = self.height - np.argmax(occupied[:, :, ::-1], axis=2)
+        return np.where(occupied.any(axis=2), highest, 0).tolist()
+
+    def occupied(self) -> list:
+        return self.cells[self.cells != 0].tolist()
+
+    def maxID(self) -> int:
+        return int(self.cells.max()) if self.cells.size > 0 else 0
+
+    def isEmpty(self) -> bool:
+        return not self.cells.any()
+
+    def serialize(self) -> list:
+        return self.cells.tolist()
+
+
+# Only the 8x8x8 chunks that hold at least one box are stored, in a dictionary keyed by chunk coordinate
+# Memory grows with the number of boxes rather than the size of the storage, and reading or writing a cell
+# is still a dictionary lookup and an index. Chunks are dropped again as soon as they're empty
+class ChunkedGrid:
+    # The chunk size is a power of 2, so the chunk and the cell within it come from shifts and masks
+    CHUNK_BITS = 3
+    CHUNK_SIZE = 1 << CHUNK_BITS
+    CHUNK_MASK = CHUNK_SIZE - 1
+
+    def __init__(self, width: int, depth: int, height: int):
+        self.width = width
+        self.depth = depth
+        self.height = height
+
+        # Chunk coordinate -> the cells in that chunk, as a flat list indexed x + 8 * (y + 8 * z)
+        self.cells = dict()
+        # Chunk coordinate -> how many boxes are in that chunk
+        self.counts = dict()
+
+    @staticmethod
+    def locate(x: int, y: int, z: int):
+        bits, mask = ChunkedGrid.CHUNK_BITS, ChunkedGrid.CHUNK_MASK
+        chunk = (x >> bits, y >> bits, z >> bits)
+        index = (x & mask) | ((y & mask) << bits) | ((z & mask) << (2 * bits))
+        return chunk, index
+
+    def get(self, x: int, y: int, z: int) -> int:
+        chunk, index = self.locate(x, y, z)
+        cells = self.cells.get(chunk)
+        return 0 if cells is None else cells[index]
+
+    def set(self, x: int, y: int, z: int, value: int):
+        chunk, index = self.locate(x, y, z)
+        cells = self.cells.get(chunk)
+
+        if cells is None:
+            if value == 0:
+                return
+            cells = [0] * (self.CHUNK_SIZE**3)
+            self.cells[chunk] = cells
+            self.counts[chunk] = 0
+
+        self.counts[chunk] += (value != 0) - (cells[index] != 0)
+        cells[index] = value
+
+        if self.counts[chunk] == 0:
+            del self.cells[chunk]
+            del self.counts[chunk]
+
+    def clear(self):
+        self.cells.clear()
+        self.counts.clear()
+
+    def snapshot(self):
+        copy = ChunkedGrid(self.width, self.depth, self.height)
+        copy.cells = {chunk: cells.copy() for chunk, cells in self.cells.items()}
+        copy.counts = self.counts.copy()
+        return copy
+
+    def equals(self, other) -> bool:
+        # Empty chunks are never kept, so two chunked grids with the same boxes have the same chunks
+        if isinstance(other, ChunkedGrid):
+            return self.cells == other.cells
+        return self.serialize() == other.serialize()
+
+    # Every occupied cell, as ((x, y, z), box ID)
+    def items(self):
+        bits, mask = self.CHUNK_BITS, self.CHUNK_MASK
+        for (cx, cy, cz), cells in self.cells.items():
+            for index, value in enumerate(cells):
+                if value != 0:
+                    yield (
+                        (cx << bits) | (index & mask),
+                        (cy << bits) | ((index >> bits) & mask),
+                        (cz << bits) | (index >> (2 * bits)),
+                    ), value
+
+    def layer(self, z: int) -> list:
+        cells = [[0] * self.depth for _ in range(self.width)]
+        for (x, y, cellZ), value in self.items():
+            if cellZ == z:
+                cells[x][y] = value
+        return cells
+
+    def columnHeight(self, x: int, y: int) -> int:
+        bits, mask = self.CHUNK_BITS, self.CHUNK_MASK
+        column = (x & mask) | ((y & mask) << bits)
+
+        # Work down the chunks in the column, skipping over any that aren't stored
+        for cz in range((self.height - 1) >> bits, -1, -1):
+            cells = self.cells.get((x >> bits, y >> bits, cz))
+            if cells is None:
+                continue
+            for z in range(self.CHUNK_SIZE - 1, -1, -1):
+                if cells[column | (z << (2 * bits))] != 0:
+                    return (cz << bits) + z + 1
+        return 0
+
+    def heightMap(self) -> list:
+        heights = [[0] * self.depth for _ in range(self.width)]
+        for (x, y, z), _ in self.items():
+            heights[x][y] = max(heights[x][y], z + 1)
+        return heights
+
+    def occupied(self) -> list:
+        return [value for _, value in self.items()]
+
+    def maxID(self) -> int:
+        return max(self.occupied(), default=0)
+
+    def isEmpty(self) -> bool:
+        return len(self.cells) == 0
+
+    def serialize(self) -> list:
+        cells = [
+            [[0] * self.height for _ in range(self.depth)] for _ in range(self.width)
+        ]
+        for (x, y, z), value in self.items():
+            cells[x][y][z] = value
+        return cells
+
+
+GRID_BACKENDS = {
+    "list": ListGrid,
+    "numpy": NumpyGrid,
+    "chunked": ChunkedGrid,
+}
+
+
+def makeGrid(backend: str, width: int, depth: int, height: int):
+    if backend not in GRID_BACKENDS:
+        raise ValueError(
+            "Unknown grid backend %s, it must be one of %s"
+            % (backend, ", ".join(GRID_BACKENDS))
+        )
+    return GRID_BACKENDS[backend](width, depth, height)
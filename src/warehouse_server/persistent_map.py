@@ -0,0 +1,87 @@
+# A dictionary that can be copied in (almost) constant time
+# The keys are split between a fixed number of buckets by their hash, and each bucket is a normal dict
+# Copying only copies the list of buckets, so the copy shares every bucket with the original.
+# A bucket is only copied the first time either of them changes it (copy-on-write),
+# so a copy that only changes a few entries only costs those few buckets
+class PersistentMap:
+    BUCKET_BITS = 5
+    BUCKET_COUNT = 1 << BUCKET_BITS
+    BUCKET_MASK = BUCKET_COUNT - 1
+
+    def __init__(self, items=None):
+        self.buckets = [dict() for _ in range(self.BUCKET_COUNT)]
+        # Bit i is set if bucket i isn't shared with any other map, so it can be changed in place
+        self.owned = (1 << self.BUCKET_COUNT) - 1
+        self.size = 0
+
+        if items is not None:
+            for key, value in dict(items).items():
+                self[key] = value
+
+    def bucket(self, key) -> dict:
+        return self.buckets[hash(key) & self.BUCKET_MASK]
+
+    # The bucket for a key, copied first if it's shared, so it's safe to change
+    def writableBucket(self, key) -> dict:
+        index = hash(key) & self.BUCKET_MASK
+        if not self.owned >> index & 1:
+            self.buckets[index] = dict(self.buckets[index])
+            self.owned |= 1 << index
+        return self.buckets[index]
+
+    def copy(self):
+        copy = PersistentMap.__new__(PersistentMap)
+        copy.buckets = self.buckets.copy()
+        copy.size = self.size
+        # Every bucket is now shared, so neither map can change them in place
+        copy.owned = 0
+        self.owned = 0
+        return copy
+
+    def get(self, key, default=None):
+        return self.bucket(key).get(key, default)
+
+    def __getitem__(self, key):
+        return self.bucket(key)[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self.bucket(key)
+
+    def __setitem__(self, key, value):
+        bucket = self.writableBucket(key)
+        if key not in bucket:
+            self.size += 1
+        bucket[key] = value
+
+    def __delitem__(self, key):
+        del self.writableBucket(key)[key]
+        self.size -= 1
+
+    def pop(self, key, *default):
+        if key not in self.bucket(key):
+            if default:
+                return default[0]
+            raise KeyError(key)
+
+        self.size -= 1
+        return self.writableBucket(key).pop(key)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __iter__(self):
+        for bucket in self.buckets:
+            yield from bucket
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for bucket in self.buckets:
+            yield from bucket.items()
+
+    def __eq__(self, other) -> bool:
+        return dict(self.items()) == dict(other.items())
+
+    def __repr__(self) -> str:
+        return "PersistentMap(%s)" % dict(self.items())
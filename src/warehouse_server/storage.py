@@ -1,8 +1,11 @@
 from copy import deepcopy
 from dataclasses import dataclass
 from enum import Enum
-from typing import Dict
+from typing import Dict, NamedTuple
 from . import error_messages
+from .grid import makeGrid
+from .persistent_map import PersistentMap
+from .zobrist import ZobristTable
 
 
 class Direction(Enum):
@@ -15,6 +18,13 @@ class Direction(Enum):
     Up = (2, 1)
     Down = (2, -1)
 
+    def __init__(self, axis: int, sign: int):
+        # How far a step in this Direction moves along each axis
+        # Looking these up is much quicker than unpacking Enum.value every time a Position moves
+        self.dx = sign if axis == 0 else 0
+        self.dy = sign if axis == 1 else 0
+        self.dz = sign if axis == 2 else 0
+
     @staticmethod
     def from_str(string: str):
         string = string.lower()
@@ -51,54 +61,57 @@ class Direction(Enum):
 
     @staticmethod
     def getAll():
-        return [
-            Direction.North,
-            Direction.East,
-            Direction.South,
-            Direction.West,
-            Direction.Up,
-            Direction.Down,
-        ]
+        return ALL_DIRECTIONS
 
     @staticmethod
     def getAllCardinal():
-        return [
-            Direction.North,
-            Direction.East,
-            Direction.South,
-            Direction.West,
-        ]
+        return CARDINAL_DIRECTIONS
 
     @staticmethod
     def getAllNotDown():
-        return [
-            Direction.North,
-            Direction.East,
-            Direction.South,
-            Direction.West,
-            Direction.Up,
-        ]
+        return NOT_DOWN_DIRECTIONS
 
     def opposite(self):
-        return Direction((self.value[0], self.value[1] * -1))
+        return self.oppositeDirection
 
 
-@dataclass
-class Position:
+# The groups of Directions are only made once, as tuples so nothing can change them
+ALL_DIRECTIONS = (
+    Direction.North,
+    Direction.East,
+    Direction.South,
+    Direction.West,
+    Direction.Up,
+    Direction.Down,
+)
+CARDINAL_DIRECTIONS = ALL_DIRECTIONS[:4]
+NOT_DOWN_DIRECTIONS = ALL_DIRECTIONS[:5]
+
+# Direction -> the Direction pointing the other way
+OPPOSITE_DIRECTIONS = {d: Direction((d.value[0], -d.value[1])) for d in ALL_DIRECTIONS}
+
+# (dx, dy, dz) -> the Direction that moves that far
+DIRECTION_BY_OFFSET = {(d.dx, d.dy, d.dz): d for d in ALL_DIRECTIONS}
+
+# These are needed for every move, so they're stored on the Directions themselves
+# An attribute lookup is quicker than hashing an Enum member into a dictionary
+for index, direction in enumerate(ALL_DIRECTIONS):
+    # Where the Direction is in ALL_DIRECTIONS (and in every neighbour table)
+    direction.index = index
+    direction.oppositeDirection = OPPOSITE_DIRECTIONS[direction]
+
+
+# Positions are immutable tuples, so they're cheap to create, hash and compare, and have no __dict__
+class Position(NamedTuple):
     x: int
     y: int
     z: int
 
     def __add__(self, direction: Direction):
-        if direction.value[0] == 0:
-            return Position(self.x + direction.value[1], self.y, self.z)
-        elif direction.value[0] == 1:
-            return Position(self.x, self.y + direction.value[1], self.z)
-        elif direction.value[0] == 2:
-            return Position(self.x, self.y, self.z + direction.value[1])
-
-    def __hash__(self):
-        return hash((self.x, self.y, self.z))
+        return tuple.__new__(
+            Position,
+            (self.x + direction.dx, self.y + direction.dy, self.z + direction.dz),
+        )
 
     def toString(self):
         return "(" + str(self.x) + ", " + str(self.y) + ", " + str(self.z) + ")"
@@ -106,14 +119,19 @@ class Position:
 
 # This assumes the position and destination are reachable by exactly one direction
 def directionUsed(position, destination):
-    if position.x - destination.x in (-1, 1):
-        return Direction((0, -1 if position.x > destination.x else 1))
-    elif position.y - destination.y in (-1, 1):
-        return Direction((1, -1 if position.y > destination.y else 1))
-    elif position.z - destination.z in (-1, 1):
-        return Direction((2, -1 if position.z > destination.z else 1))
-    else:
-        exit("%s and %s are not reachable by only one Direction")
+    direction = DIRECTION_BY_OFFSET.get(
+        (
+            destination.x - position.x,
+            destination.y - position.y,
+            destination.z - position.z,
+        )
+    )
+    if direction is None:
+        exit(
+            "%s and %s are not reachable by only one Direction"
+            % (position, destination)
+        )
+    return direction
 
 
 @dataclass
@@ -124,88 +142,197 @@ class Box:
         return hash(self.position)
 
 
-class movesDictionary:
-    # Boxes that can't move due to another box being on-top of it
-    locked: dict
-    # Boxes that can move
-    unlocked: dict
+# Everything needed to undo a move made with Storage.apply_move
+@dataclass
+class JournalEntry:
+    box_id: int
+    # Where the box was before the move
+    position: Position
+    unstableBoxID: int
+    # The availableMoves entries the move changed, and what they were before
+    changedMoves: dict
 
+
+# Every box's moves are stored as a 6-bit mask, with a bit for each Direction (bit d.index)
+# A box can only ever move into one of the 6 cells next to it, so the boxes that can move into a cell
+# are found by checking the matching bit of its 6 neighbours. That reverse lookup is O(1) and never
+# needs keeping up to date, so adding or removing a box only touches its own neighbourhood
+# The masks are kept in PersistentMaps, so a snapshot shares everything with the original
+# apart from the entries that change afterwards
+class movesDictionary:
     def __init__(self, locked=None, unlocked=None):
-        if unlocked is None:
-            unlocked = dict()
-        if locked is None:
-            locked = dict()
-        self.locked = locked
-        self.unlocked = unlocked
+        # Boxes that can't move due to another box being on-top of it
+        # Start position -> mask of Directions
+        self.lockedMasks = PersistentMap()
+        # Boxes that can move
+        self.unlockedMasks = PersistentMap()
 
-    def is_locked(self, pos: Position):
-        return pos in self.locked
+        if locked is not None:
+            self.locked = locked
+        if unlocked is not None:
+            self.unlocked = unlocked
 
-    def removeEndPos(self, pos: Position):
-        self.locked = {
-            key: [v for v in value if v != pos] for key, value in self.locked.items()
+        # When this is a dictionary, every change is recorded so it can be undone
+        # Start position -> (locked mask, unlocked mask) before the first change
+        self.undoLog = None
+
+    @staticmethod
+    def toMask(startPos: Position, endPositions) -> int:
+        mask = 0
+        for endPos in endPositions:
+            mask |= 1 << directionUsed(startPos, endPos).index
+        return mask
+
+    @staticmethod
+    def toDestinations(startPos: Position, mask: int) -> list:
+        return [startPos + d for d in ALL_DIRECTIONS if mask >> d.index & 1]
+
+    # The moves as start position -> list of destinations, like they used to be stored
+    # These are built when they're asked for, so they're for looking at rather than changing
+    @property
+    def locked(self) -> dict:
+        return {
+            startPos: self.toDestinations(startPos, mask)
+            for startPos, mask in self.lockedMasks.items()
         }
-        self.unlocked = {
-            key: [v for v in value if v != pos] for key, value in self.unlocked.items()
+
+    @locked.setter
+    def locked(self, moves: dict):
+        self.lockedMasks = PersistentMap(
+            (startPos, self.toMask(startPos, endPositions))
+            for startPos, endPositions in moves.items()
+        )
+
+    @property
+    def unlocked(self) -> dict:
+        return {
+            startPos: self.toDestinations(startPos, mask)
+            for startPos, mask in self.unlockedMasks.items()
         }
 
+    @unlocked.setter
+    def unlocked(self, moves: dict):
+        self.unlockedMasks = PersistentMap(
+            (startPos, self.toMask(startPos, endPositions))
+            for startPos, endPositions in moves.items()
+        )
+
+    # Every move the unlocked boxes can make, as (start position, Direction)
+    def unlockedMoves(self):
+        for startPos, mask in self.unlockedMasks.items():
+            for d in ALL_DIRECTIONS:
+                if mask >> d.index & 1:
+                    yield startPos, d
+
+    # The boxes that can move into a position, as (start position, Direction, is locked)
+    def movesInto(self, pos: Position):
+        for d in ALL_DIRECTIONS:
+            startPos = pos + d
+            # Moving from the neighbour back into pos is the opposite Direction
+            bit = 1 << d.oppositeDirection.index
+            if self.lockedMasks.get(startPos, 0) & bit:
+                yield startPos, d.oppositeDirection, True
+            elif self.unlockedMasks.get(startPos, 0) & bit:
+                yield startPos, d.oppositeDirection, False
+
+    def is_locked(self, pos: Position):
+        return pos in self.lockedMasks
+
+    # Remember what an entry looked like before it's changed (if the changes are being recorded)
+    def remember(self, startPos):
+        if self.undoLog is None or startPos in self.undoLog:
+            return
+
+        self.undoLog[startPos] = (
+            self.lockedMasks.get(startPos),
+            self.unlockedMasks.get(startPos),
+        )
+
+    # Put back every entry recorded in an undo log
+    def restore(self, undoLog: dict):
+        for startPos, (locked, unlocked) in undoLog.items():
+            if locked is None:
+                self.lockedMasks.pop(startPos, None)
+            else:
+                self.lockedMasks[startPos] = locked
+
+            if unlocked is None:
+                self.unlockedMasks.pop(startPos, None)
+            else:
+                self.unlockedMasks[startPos] = unlocked
+
+    def removeEndPos(self, pos: Position):
+        for startPos, direction, isLocked in list(self.movesInto(pos)):
+            self.remember(startPos)
+            masks = self.lockedMasks if isLocked else self.unlockedMasks
+            masks[startPos] &= ~(1 << direction.index)
+
     def update(self, startPos: Position, endPositions, isLocked):
+        self.remember(startPos)
         if isLocked:
-            self.locked.update({startPos: endPositions})
+            self.lockedMasks[startPos] = self.toMask(startPos, endPositions)
         else:
-            self.unlocked.update({startPos: endPositions})
+            self.unlockedMasks[startPos] = self.toMask(startPos, endPositions)
 
     def addMove(self, startPos, endPos):
-        if startPos in self.locked:
-            self.locked[startPos].append(endPos)
-        elif startPos in self.unlocked:
-            self.unlocked[startPos].append(endPos)
+        self.remember(startPos)
+        bit = 1 << directionUsed(startPos, endPos).index
+        if startPos in self.lockedMasks:
+            self.lockedMasks[startPos] |= bit
+        elif startPos in self.unlockedMasks:
+            self.unlockedMasks[startPos] |= bit
         else:
             exit(
                 "Attempted to add move starting in %s, but it's not in the dictionary"
-                % startPos
+                % (startPos,)
             )
 
     def hasMoveset(self, startPos):
-        return startPos in self.locked or startPos in self.unlocked
+        return startPos in self.lockedMasks or startPos in self.unlockedMasks
 
     def deleteMoveset(self, startPos):
-        if startPos in self.locked:
-            self.locked[startPos] = []
-        elif startPos in self.unlocked:
-            self.unlocked[startPos] = []
+        self.remember(startPos)
+        if startPos in self.lockedMasks:
+            self.lockedMasks[startPos] = 0
+        elif startPos in self.unlockedMasks:
+            self.unlockedMasks[startPos] = 0
         else:
             exit(
                 "Attempted to delete moveset for Position %s, but no moveset exists"
-                % startPos
+                % (startPos,)
             )
 
     def deleteEntry(self, startPos):
-        if startPos in self.locked:
-            del self.locked[startPos]
-        elif startPos in self.unlocked:
-            del self.unlocked[startPos]
+        self.remember(startPos)
+        if startPos in self.lockedMasks:
+            del self.lockedMasks[startPos]
+        elif startPos in self.unlockedMasks:
+            del self.unlockedMasks[startPos]
         else:
             exit(
-                "Attempted to delete entry Position %s, but no entry exists" % startPos
+                "Attempted to delete entry Position %s, but no entry exists"
+                % (startPos,)
             )
 
     def getDestinations(self, startPos):
-        if startPos in self.locked:
-            return self.locked[startPos]
-        elif startPos in self.unlocked:
-            return self.unlocked[startPos]
+        if startPos in self.lockedMasks:
+            return self.toDestinations(startPos, self.lockedMasks[startPos])
+        elif startPos in self.unlockedMasks:
+            return self.toDestinations(startPos, self.unlockedMasks[startPos])
         else:
             exit(
                 "Attempted to get destinations for Position %s, but no moveset exists"
-                % startPos
+                % (startPos,)
             )
 
+    # Removing a destination that isn't there does nothing
     def removeDestination(self, startPos, endPos):
-        if startPos in self.locked:
-            self.locked[startPos].remove(endPos)
-        elif startPos in self.unlocked:
-            self.unlocked[startPos].remove(endPos)
+        self.remember(startPos)
+        bit = 1 << directionUsed(startPos, endPos).index
+        if startPos in self.lockedMasks:
+            self.lockedMasks[startPos] &= ~bit
+        elif startPos in self.unlockedMasks:
+            self.unlockedMasks[startPos] &= ~bit
         else:
             exit(
                 "Attempted to remove destination %s for Position %s, but no destination exists"
@@ -213,45 +340,48 @@ class movesDictionary:
             )
 
     def transferToLocked(self, startPos):
-        if startPos in self.unlocked:
-            endPositions = self.unlocked[startPos].copy()
-            del self.unlocked[startPos]
-            self.locked.update({startPos: endPositions})
+        self.remember(startPos)
+        if startPos in self.unlockedMasks:
+            self.lockedMasks[startPos] = self.unlockedMasks.pop(startPos)
         else:
             exit(
                 "Attempted to transfer %s to locked status, but no key exists in unlocked"
-                % startPos
+                % (startPos,)
             )
 
     def transferToUnlocked(self, startPos):
-        if startPos in self.locked:
-            endPositions = self.locked[startPos].copy()
-            del self.locked[startPos]
-            self.unlocked.update({startPos: endPositions})
+        self.remember(startPos)
+        if startPos in self.lockedMasks:
+            self.unlockedMasks[startPos] = self.lockedMasks.pop(startPos)
         else:
             exit(
                 "Attempted to transfer %s to unlocked status, but no key exists in unlocked"
-                % startPos
+                % (startPos,)
             )
 
     def __len__(self):
-        return len(self.locked) + len(self.unlocked)
+        return len(self.lockedMasks) + len(self.unlockedMasks)
 
-    def __deepcopy__(self, memodict=None):
-        newLocked = {key: value.copy() for key, value in self.locked.items()}
-        newUnlocked = {key: value.copy() for key, value in self.unlocked.items()}
+    # An independent copy of the moves, made without copying any of the entries
+    # Changing either one afterwards doesn't affect the other
+    def snapshot(self):
+        copy = movesDictionary()
+        copy.lockedMasks = self.lockedMasks.copy()
+        copy.unlockedMasks = self.unlockedMasks.copy()
+        return copy
 
-        return movesDictionary(newLocked, newUnlocked)
+    def __deepcopy__(self, memodict=None):
+        return self.snapshot()
 
 
 class Storage:
     # Initialise the storage with its dimensions
-    def __init__(self, width: int, depth: int, height: int) -> None:
+    # The backend picks how the occupancy grid is stored ("list", "numpy" or "chunked")
+    def __init__(self, width: int, depth: int, height: int, backend="list") -> None:
         self.boxes: Dict[int, Box] = {}
-        # Make the list an element larger than we want, so it won't return IndexError: list index out of range
-        self.matrix = [
-            [[0 for _ in range(height)] for _ in range(depth)] for _ in range(width)
-        ]
+
+        self.backend = backend
+        self.grid = makeGrid(backend, width, depth, height)
 
         self.width = width
         self.depth = depth
@@ -264,6 +394,159 @@ class Storage:
 
         self.availableMoves = movesDictionary()
 
+        # Zobrist keys for every (box, cell), and the hash of the current layout
+        self.zobrist = ZobristTable(width, depth, height)
+        self.zobristHash = 0
+
+        # Moves made with apply_move, so they can be undone in reverse order
+        self.moveJournal = []
+
+        # Called with the storage just before add_box, remove_box or move_box change it
+        # The changes a search makes and undoes (with ignoreMoves or apply_move) aren't passed on
+        self.changeListeners = []
+
+        # Every cell also has a packed index, x + width * (y + depth * z)
+        # Stepping in a Direction is then just adding that Direction's offset
+        # The move checks (can_move_box, reassessAvailableMoves) stay on Positions through neighbours(), as each
+        # Position is only made once and its neighbours are cached, so looking them up is no slower than by
+        # index. The grid is read by (x, y, z) whatever the backend, so indexes would only pay off with a
+        # second, index-keyed copy of the grid to keep in step with it
+        self.cellOffsets = {d: d.dx + width * (d.dy + depth * d.dz) for d in Direction}
+        # Cell index -> Position, so each Position is only made once
+        self.positions = dict()
+
+        # The neighbours of each cell, in the order of ALL_DIRECTIONS
+        # They're only worked out for cells that get looked at, so huge, empty storages cost nothing
+        # Cell index -> the neighbouring cell indexes (-1 past the edge of the storage)
+        self.neighbourCells = dict()
+        # Position -> the neighbouring Positions (None past the edge of the storage)
+        self.neighbourPositions = dict()
+
+        # (x, y) -> how many cells are taken up to (and including) the highest box in that column
+        self.columnHeights = dict()
+        # (x, y) -> how many boxes are in that column
+        # If it's the same as the height, the column is solid and there are no gaps to look for
+        self.columnCounts = dict()
+
+    # A copy starts with no change listeners, so copying a watched storage doesn't copy whatever is watching it
+    # (the copies searches and checks make would otherwise each take a copy of a whole RouteCache)
+    def __deepcopy__(self, memodict=None):
+        if memodict is None:
+            memodict = {}
+        copy = type(self).__new__(type(self))
+        memodict[id(self)] = copy
+        for name, value in self.__dict__.items():
+            if name != "changeListeners":
+                setattr(copy, name, deepcopy(value, memodict))
+        copy.changeListeners = []
+        return copy
+
+    # A copy of the cells as nested lists indexed [x][y][z], the same whatever the backend
+    # Only kept for older callers, as it copies every cell - read and write cells through grid instead
+    @property
+    def matrix(self) -> list:
+        return self.grid.serialize()
+
+    # The packed index of a position
+    def cellIndex(self, position: Position) -> int:
+        return position.x + self.width * (position.y + self.depth * position.z)
+
+    # The Position of a packed index
+    def positionOf(self, cell: int) -> Position:
+        position = self.positions.get(cell)
+        if position is None:
+            rest, x = divmod(cell, self.width)
+            z, y = divmod(rest, self.depth)
+            position = Position(x, y, z)
+            self.positions[cell] = position
+        return position
+
+    # The cell indexes next to a cell, in the order of ALL_DIRECTIONS (-1 if it's past the edge)
+    def neighbourIndexes(self, cell: int) -> tuple:
+        neighbours = self.neighbourCells.get(cell)
+        if neighbours is None:
+            position = self.positionOf(cell)
+            neighbours = tuple(
+                (
+                    cell + self.cellOffsets[d]
+                    if self.check_position_in_bound(position + d)
+                    else -1
+                )
+                for d in ALL_DIRECTIONS
+            )
+            self.neighbourCells[cell] = neighbours
+        return neighbours
+
+    # The Positions next to a position, in the order of ALL_DIRECTIONS (None if it's past the edge)
+    def neighbours(self, position: Position) -> tuple:
+        neighbours = self.neighbourPositions.get(position)
+        if neighbours is None:
+            neighbours = tuple(
+                self.positionOf(cell) if cell != -1 else None
+                for cell in self.neighbourIndexes(self.cellIndex(position))
+            )
+            self.neighbourPositions[position] = neighbours
+        return neighbours
+
+    # Put a box ID (or 0 to empty it) into a cell, keeping the column heights up to date
+    # Every change to the grid goes through here
+    def setCell(self, position: Position, boxID: int):
+        column = (position.x, position.y)
+        previous = self.grid.get(position.x, position.y, position.z)
+        self.grid.set(position.x, position.y, position.z, boxID)
+
+        if previous == 0 and boxID != 0:
+            self.columnCounts[column] = self.columnCounts.get(column, 0) + 1
+            if position.z >= self.columnHeights.get(column, 0):
+                self.columnHeights[column] = position.z + 1
+
+        elif previous != 0 and boxID == 0:
+            count = self.columnCounts[column] - 1
+            if count == 0:
+                del self.columnCounts[column]
+                del self.columnHeights[column]
+                return
+
+            self.columnCounts[column] = count
+            # If the top box left, look down for the next one
+            if position.z + 1 == self.columnHeights[column]:
+                z = position.z - 1
+                while self.grid.get(position.x, position.y, z) == 0:
+                    z -= 1
+                self.columnHeights[column] = z + 1
+
+    # How many cells are taken up to (and including) the highest box in a column
+    def column_height(self, x: int, y: int) -> int:
+        return self.columnHeights.get((x, y), 0)
+
+    # The ID of the highest box in a column (or 0 if the column is empty)
+    def column_top(self, x: int, y: int) -> int:
+        height = self.columnHeights.get((x, y), 0)
+        if height == 0:
+            return 0
+        return self.grid.get(x, y, height - 1)
+
+    # How many empty cells there are directly below a position, before reaching a box or the ground
+    def support_depth(self, position: Position) -> int:
+        column = (position.x, position.y)
+        height = self.columnHeights.get(column, 0)
+
+        # Above the highest box
+        if position.z >= height:
+            return position.z - height
+
+        # Inside a solid column, so there's always a box (or the ground) right below
+        if self.columnCounts[column] == height:
+            return 0
+
+        # Only a column with a gap in it (from an unstable box) needs looking through
+        depth = 0
+        z = position.z - 1
+        while z >= 0 and self.grid.get(position.x, position.y, z) == 0:
+            depth += 1
+            z -= 1
+        return depth
+
     # Check if a box exists
     def check_box_existence(self, box_id: int) -> bool:
         return box_id in self.boxes
@@ -316,9 +599,13 @@ class Storage:
             if not self.is_position_stable(newbox.position):
                 self.unstableBoxID = boxid
 
+        if not ignoreMoves and self.changeListeners:
+            self.notifyChange()
+
         # Assign the position to the box
         self.boxes[boxid] = newbox
-        self.matrix[newbox.position.x][newbox.position.y][newbox.position.z] = boxid
+        self.setCell(newbox.position, boxid)
+        self.zobristHash ^= self.zobrist.key(boxid, newbox.position)
 
         # Check if you're stabilizing the unstable box
         if (
@@ -373,10 +660,14 @@ class Storage:
             if message is not True:
                 return message
 
+        if not ignoreMoves and self.changeListeners:
+            self.notifyChange()
+
         pos = self.get_box_position(boxid)
 
-        self.matrix[pos.x][pos.y][pos.z] = 0
+        self.setCell(pos, 0)
         del self.boxes[boxid]
+        self.zobristHash ^= self.zobrist.key(boxid, pos)
 
         # Check if you're deleting the unstable box
         if self.unstableBoxID == boxid:
@@ -393,7 +684,7 @@ class Storage:
 
     # Get the box_id at a specific position
     def get_id_at_position(self, position: Position):
-        return self.matrix[position.x][position.y][position.z]
+        return self.grid.get(position.x, position.y, position.z)
 
     # Check if a VALID position is occupied, assuming it exists
     def is_valid_position_occupied(self, position: Position) -> bool:
@@ -416,10 +707,11 @@ class Storage:
         if not self.check_box_existence(box_id):
             return error_messages.MOVE_A_NOT_EXIST_BOX_ERROR_MSG, "Llama"
 
-        next_position = current_position + direction
+        neighbours = self.neighbours(current_position)
+        next_position = neighbours[direction.index]
 
         # Check you're not going out of bounds
-        if not self.check_position_in_bound(next_position):
+        if next_position is None:
             return error_messages.OUT_OF_BOUNDS_ERROR_MSG, "Llama"
 
         # Check you're not "crashing" into another box
@@ -427,7 +719,8 @@ class Storage:
             return error_messages.BLOCKED_ERROR_MSG, "Llama"
 
         # Check the box is NOT supporting another box
-        if self.is_valid_and_occupied(current_position + Direction.Up):
+        above = neighbours[Direction.Up.index]
+        if above is not None and self.is_valid_position_occupied(above):
             return error_messages.MOVE_SUPPORTING_BOX_CAUSES_FLOATING_ERROR_MSG, "Llama"
 
         # If you're not moving the unstable box, you must! Return an error
@@ -451,8 +744,8 @@ class Storage:
         if direction == Direction.Up:
             if not (
                 any(
-                    self.is_valid_and_occupied(current_position + d)
-                    for d in Direction.getAllCardinal()
+                    side is not None and self.is_valid_position_occupied(side)
+                    for side in neighbours[:4]
                 )
             ):
                 return (
@@ -504,11 +797,18 @@ class Storage:
         if message is not error_messages.SUCCESS_MESSAGE:
             return message
 
+        if (
+            not ignoreMoves
+            and self.changeListeners
+            and self.availableMoves.undoLog is None
+        ):
+            self.notifyChange()
+
         current_position = self.get_box_position(box_id)
         next_position = current_position + direction
 
         # Remove the box from its current position
-        self.matrix[current_position.x][current_position.y][current_position.z] = 0
+        self.setCell(current_position, 0)
 
         if self.unstableBoxID is not None:
             # Update the unstable box
@@ -523,13 +823,62 @@ class Storage:
 
         # Add the box to its new position
         self.boxes[box_id].position = next_position
-        self.matrix[next_position.x][next_position.y][next_position.z] = box_id
+        self.setCell(next_position, box_id)
+        self.zobristHash ^= self.zobrist.moveKey(
+            box_id, current_position, next_position
+        )
 
         if not ignoreMoves:
             self.recalculateAvailableMoves(0, box_id, next_position)
 
         return error_messages.MOVE_BOX.format(box_id)
 
+    # Move a box like move_box, but remember exactly what changed, so undo_move can put it back
+    # The grid, box position, unstable box and availableMoves are all restored without rebuilding anything
+    def apply_move(self, box_id: int, direction: Direction):
+        # move_box doesn't change anything until it knows the move is valid
+        if not self.check_box_existence(box_id):
+            return error_messages.MOVE_A_NOT_EXIST_BOX_ERROR_MSG
+
+        position = self.get_box_position(box_id)
+        unstableBoxID = self.unstableBoxID
+
+        self.availableMoves.undoLog = dict()
+        message = self.move_box(box_id, direction)
+        changedMoves = self.availableMoves.undoLog
+        self.availableMoves.undoLog = None
+
+        if message == error_messages.MOVE_BOX.format(box_id):
+            self.moveJournal.append(
+                JournalEntry(box_id, position, unstableBoxID, changedMoves)
+            )
+
+        return message
+
+    # Undo the last move made with apply_move
+    def undo_move(self):
+        entry = self.moveJournal.pop()
+
+        current_position = self.get_box_position(entry.box_id)
+        self.setCell(current_position, 0)
+        self.setCell(entry.position, entry.box_id)
+        self.boxes[entry.box_id].position = entry.position
+        self.zobristHash ^= self.zobrist.moveKey(
+            entry.box_id, current_position, entry.position
+        )
+
+        self.unstableBoxID = entry.unstableBoxID
+        self.availableMoves.restore(entry.changedMoves)
+
+    # Undo moves until only journalLength moves are left in the journal
+    def rollback(self, journalLength=0):
+        while len(self.moveJournal) > journalLength:
+            self.undo_move()
+
+    def notifyChange(self):
+        for listener in self.changeListeners:
+            listener(self)
+
     # Determines if the position in the storage has a box below it or is on the ground, hence stable
     def is_position_stable(self, position: Position, ignoreBox=None) -> bool:
         # Is it NOT on the ground?
@@ -556,7 +905,10 @@ class Storage:
         return boxes
 
     def clear_storage(self):
-        self.__init__(self.width, self.depth, self.height)
+        listeners = self.changeListeners
+        self.notifyChange()
+        self.__init__(self.width, self.depth, self.height, self.backend)
+        self.changeListeners = listeners
         return "All boxes have been cleared!"
 
     # Recalculate available moves based on the action performed, and returns the modified dictionary
@@ -569,6 +921,8 @@ class Storage:
         posAttribute: Position,
         movesDict: movesDictionary,
     ):
+        up, down = Direction.Up.index, Direction.Down.index
+
         # Add
         if action == 0:
             # Remove moves that end in the box's position
@@ -579,55 +933,60 @@ class Storage:
             if not self.is_position_stable(posAttribute):
                 self.unstableBoxID = boxID
 
+            neighbours = self.neighbours(posAttribute)
+            above = neighbours[up]
+
             # Add destinations that the new box can move to
             goodDestinations = [
-                posAttribute + d
-                for d in Direction.getAll()
+                neighbours[d.index]
+                for d in ALL_DIRECTIONS
                 if self.can_move_box(boxID, d)[1] != "Llama"
             ]
             # Check if the box is locked (is there a box above it)
-            isLocked = self.check_position_in_bound(
-                posAttribute + Direction.Up
-            ) and self.is_valid_position_occupied(posAttribute + Direction.Up)
+            isLocked = above is not None and self.is_valid_position_occupied(above)
             movesDict.update(posAttribute, goodDestinations, isLocked)
 
             # Add moves if neighbours can "climb" up the added box
-            climbingNeighbours = [
-                (posAttribute + d, posAttribute + d + Direction.Up)
-                for d in Direction.getAllCardinal()
-                if self.is_valid_and_occupied(posAttribute + d)
-                and self.check_position_in_bound(posAttribute + d + Direction.Up)
-                and not self.is_valid_position_occupied(posAttribute + d + Direction.Up)
-            ]
-            for item in climbingNeighbours:
-                movesDict.addMove(item[0], item[1])
+            for side in neighbours[:4]:
+                if side is None or not self.is_valid_position_occupied(side):
+                    continue
+                sideAbove = self.neighbours(side)[up]
+                if sideAbove is not None and not self.is_valid_position_occupied(
+                    sideAbove
+                ):
+                    movesDict.addMove(side, sideAbove)
 
             # Add moves that allow floating boxes to stabilize themselves on
             # Used in swapOut
-            gutterClingers = [
-                (posAttribute + Direction.Up + d, posAttribute + Direction.Up)
-                for d in Direction.getAllNotDown()
-                if self.is_valid_and_occupied(posAttribute + Direction.Up + d)
-                and not self.is_position_stable(posAttribute + Direction.Up + d)
-            ]
-            for item in gutterClingers:
-                movesDict.addMove(item[0], item[1])
+            if above is not None:
+                for clinger in self.neighbours(above)[:5]:
+                    if (
+                        clinger is not None
+                        and self.is_valid_position_occupied(clinger)
+                        and not self.is_position_stable(clinger)
+                    ):
+                        movesDict.addMove(clinger, above)
 
             # If there's a box below, lock it down!
-            if self.is_valid_and_occupied(posAttribute + Direction.Down):
-                movesDict.transferToLocked(posAttribute + Direction.Down)
+            below = neighbours[down]
+            if below is not None and self.is_valid_position_occupied(below):
+                movesDict.transferToLocked(below)
 
         # Remove
         elif action == 1:
             # Remove the deleted box's moves
             movesDict.deleteEntry(posAttribute)
 
+            neighbours = self.neighbours(posAttribute)
+
             # TODO maybe use Direction.getAllNotDown()
             # Add destinations that other boxes can move to
-            for d in Direction.getAll():
-                checkPosition = posAttribute + d
+            for d in ALL_DIRECTIONS:
+                checkPosition = neighbours[d.index]
                 # Check the position is valid
-                if self.is_valid_and_occupied(checkPosition):
+                if checkPosition is not None and self.is_valid_position_occupied(
+                    checkPosition
+                ):
                     # Completely update the moves for the box below
                     # Since it's now free to move
                     if d == Direction.Down:
@@ -654,29 +1013,29 @@ class Storage:
                     # TODO Pretty sure this can be simplified
                     if (
                         not self.can_move_box(
-                            self.get_id_at_position(checkPosition), d.opposite()
+                            self.get_id_at_position(checkPosition),
+                            d.oppositeDirection,
                         )[1]
                         == "Llama"
                     ):
                         movesDict.addMove(checkPosition, posAttribute)
 
             # Remove moves allowed by neighbours "climbing" the deleted box
-            for d in Direction.getAllCardinal():
-                nPosition = posAttribute + d
+            for nPosition in neighbours[:4]:
+                if nPosition is None or not self.is_valid_position_occupied(nPosition):
+                    continue
+                nNeighbours = self.neighbours(nPosition)
+                nAbove = nNeighbours[up]
                 # If the neighbouring box could climb up
-                if (
-                    self.is_valid_and_occupied(nPosition)
-                    and self.check_position_in_bound(nPosition + Direction.Up)
-                    and not self.is_valid_position_occupied(nPosition + Direction.Up)
-                ):
+                if nAbove is not None and not self.is_valid_position_occupied(nAbove):
                     # If it can't climb anymore
                     if not any(
-                        self.is_valid_and_occupied(nPosition + look)
-                        for look in Direction.getAllCardinal()
+                        look is not None and self.is_valid_position_occupied(look)
+                        for look in nNeighbours[:4]
                     ):
                         # Remove it from the availableMoves dictionary (if it exists)
                         # This can occur if it's currently unstable
-                        movesDict.removeDestination(nPosition, nPosition + Direction.Up)
+                        movesDict.removeDestination(nPosition, nAbove)
 
         return movesDict
 
@@ -696,25 +1055,45 @@ class Storage:
 
         else:
             unstablePosition = self.get_box_position(self.unstableBoxID)
-            return {unstablePosition: self.availableMoves.unlocked[unstablePosition]}
+            return {
+                unstablePosition: self.availableMoves.toDestinations(
+                    unstablePosition,
+                    self.availableMoves.unlockedMasks[unstablePosition],
+                )
+            }
+
+    # The same moves as getAvailableMoves, but as (start position, Direction)
+    def getAvailableDirections(self):
+        if self.unstableBoxID is None:
+            return self.availableMoves.unlockedMoves()
+
+        else:
+            unstablePosition = self.get_box_position(self.unstableBoxID)
+            mask = self.availableMoves.unlockedMasks[unstablePosition]
+            return [
+                (unstablePosition, d) for d in ALL_DIRECTIONS if mask >> d.index & 1
+            ]
 
     # Modifies an existing availableMoves dictionary with a move, and returns it
     def modifyMoves(self, dictionary, boxID: int, direction: Direction):
         # Save your own dictionary
         temp = self.availableMoves
 
-        # Set the moves dictionary
-        self.availableMoves = dictionary
+        # Work on a snapshot, so the dictionary passed in is never changed
+        self.availableMoves = dictionary.snapshot()
+        # The box is moved straight back, so nothing watching the storage needs to know
+        listeners, self.changeListeners = self.changeListeners, []
 
         # Move the box
         self.move_box(boxID, direction)
 
         # Save the outcome
-        returning = deepcopy(self.availableMoves)
+        returning = self.availableMoves
 
-        # Revert the changes
-        self.move_box(boxID, direction.opposite())
+        # Revert the changes (the snapshot is kept, so there's no need to update the moves)
+        self.move_box(boxID, direction.opposite(), ignoreMoves=True)
         self.availableMoves = temp
+        self.changeListeners = listeners
 
         return returning
 
@@ -1,12 +1,19 @@
+from copy import deepcopy
+
+import pytest
+
 from . import error_messages
+from . import utils
 from .storage import (
     Position,
     Box,
     Storage,
     Direction,
     movesDictionary,
+    directionUsed,
 )
 from a_star_client.navigator import Move, swapOut, Node
+from a_star_client.route_cache import RouteCache
 
 Test_Box_id = 1
 
@@ -103,6 +110,66 @@ def test_opposite():
     assert Direction.Down.opposite() == Direction.Up
 
 
+# Test Positions can't be changed, and moving one makes a new Position
+def test_position_is_immutable():
+    position = Position(1, 2, 3)
+
+    with pytest.raises(AttributeError):
+        position.x = 5
+
+    assert position + Direction.East == Position(2, 2, 3)
+    assert position + Direction.Down == Position(1, 2, 2)
+    assert position == Position(1, 2, 3)
+    assert len({position, Position(1, 2, 3)}) == 1
+
+
+# Test packed cell indexes match Positions, and stepping by an offset matches stepping by a Direction
+def test_cell_index():
+    storage_test = Storage(4, 5, 6)
+
+    cell = storage_test.cellIndex(Position(3, 2, 1))
+    assert cell == 3 + 4 * (2 + 5 * 1)
+    assert storage_test.positionOf(cell) == Position(3, 2, 1)
+    assert storage_test.positionOf(cell) is storage_test.positionOf(cell)
+
+    for direction in Direction.getAll():
+        moved = Position(2, 2, 2) + direction
+        assert storage_test.cellIndex(Position(2, 2, 2)) + storage_test.cellOffsets[
+            direction
+        ] == storage_test.cellIndex(moved)
+
+
+# Test the Direction found between two neighbouring positions
+def test_direction_used():
+    for direction in Direction.getAll():
+        assert (
+            directionUsed(Position(2, 2, 2), Position(2, 2, 2) + direction) == direction
+        )
+
+    with pytest.raises(SystemExit):
+        directionUsed(Position(2, 2, 2), Position(3, 3, 2))
+
+
+# Test the neighbour tables line up with the Directions, and stop at the edges
+def test_neighbours():
+    storage_test = Storage(3, 3, 3)
+
+    neighbours = storage_test.neighbours(Position(1, 1, 1))
+    for direction in Direction.getAll():
+        assert neighbours[direction.index] == Position(1, 1, 1) + direction
+
+    corner = storage_test.neighbours(Position(0, 0, 0))
+    assert corner[Direction.West.index] is None
+    assert corner[Direction.South.index] is None
+    assert corner[Direction.Down.index] is None
+    assert corner[Direction.North.index] == Position(0, 1, 0)
+
+    cells = storage_test.neighbourIndexes(storage_test.cellIndex(Position(2, 2, 2)))
+    assert cells[Direction.East.index] == -1
+    assert cells[Direction.Up.index] == -1
+    assert storage_test.positionOf(cells[Direction.West.index]) == Position(1, 2, 2)
+
+
 # Test adding a valid box to a valid position works
 def test_add_box():
     storage_test = Storage(10, 10, 10)
@@ -943,3 +1010,347 @@ def test_available_moves_oddly_specific():
             ],
         },
     )
+
+
+# Test the running Zobrist hash always matches the hash calculated from scratch
+def test_zobrist_hash_is_incremental():
+    storage_test = Storage(5, 5, 5)
+    assert storage_test.zobristHash == 0
+
+    storage_test.add_box(1, Box(Position(0, 0, 0)))
+    storage_test.add_box(2, Box(Position(1, 0, 0)))
+    storage_test.add_box(3, Box(Position(1, 0, 1)))
+    storage_test.move_box(1, Direction.North)
+    storage_test.move_box(3, Direction.West)
+    storage_test.remove_box(2)
+
+    assert storage_test.zobristHash == storage_test.zobrist.hashBoxes(
+        storage_test.boxes
+    )
+
+
+# Test the hash only depends on the layout, not how it was reached
+def test_zobrist_hash_path_independent():
+    storage_test1 = Storage(5, 5, 5)
+    storage_test1.add_box(1, Box(Position(0, 0, 0)))
+    storage_test1.add_box(2, Box(Position(3, 3, 0)))
+    storage_test1.move_box(1, Direction.North)
+    storage_test1.move_box(1, Direction.East)
+
+    storage_test2 = Storage(5, 5, 5)
+    storage_test2.add_box(2, Box(Position(3, 3, 0)))
+    storage_test2.add_box(1, Box(Position(0, 0, 0)))
+    storage_test2.move_box(1, Direction.East)
+    storage_test2.move_box(1, Direction.North)
+
+    assert storage_test1.zobristHash == storage_test2.zobristHash
+
+    # Swapping which box is where is a different layout
+    storage_test3 = Storage(5, 5, 5)
+    storage_test3.add_box(2, Box(Position(1, 1, 0)))
+    storage_test3.add_box(1, Box(Position(3, 3, 0)))
+
+    assert storage_test1.zobristHash != storage_test3.zobristHash
+
+
+# Test undoing moves made with apply_move puts everything back exactly how it was
+def test_apply_and_undo_moves():
+    storage_test = Storage(5, 5, 5)
+    storage_test.add_box(1, Box(Position(0, 0, 0)))
+    storage_test.add_box(2, Box(Position(1, 0, 0)))
+    storage_test.add_box(3, Box(Position(1, 0, 1)))
+    storage_test.add_box(4, Box(Position(0, 1, 0)))
+
+    safe = deepcopy(storage_test)
+
+    moves = [
+        (3, Direction.West),
+        (3, Direction.North),
+        (1, Direction.Up),
+        (1, Direction.East),
+    ]
+    for box_id, direction in moves:
+        assert storage_test.apply_move(box_id, direction).__contains__("Successful!")
+
+    assert len(storage_test.moveJournal) == len(moves)
+    assert storage_test.get_box_position(1) == Position(1, 0, 1)
+
+    storage_test.rollback()
+
+    assert len(storage_test.moveJournal) == 0
+    assert storage_test.zobristHash == safe.zobristHash
+    utils.noChanges(safe, storage_test)
+
+
+# Test an invalid move isn't added to the journal
+def test_apply_invalid_move():
+    storage_test = Storage(5, 5, 5)
+    storage_test.add_box(1, Box(Position(0, 0, 0)))
+    storage_test.add_box(2, Box(Position(0, 0, 1)))
+
+    assert (
+        storage_test.apply_move(1, Direction.North)
+        == error_messages.MOVE_SUPPORTING_BOX_CAUSES_FLOATING_ERROR_MSG
+    )
+    assert len(storage_test.moveJournal) == 0
+
+    assert storage_test.apply_move(2, Direction.North).__contains__("Successful!")
+    assert storage_test.unstableBoxID == 2
+
+    storage_test.undo_move()
+
+    assert storage_test.unstableBoxID is None
+    assert storage_test.get_box_position(2) == Position(0, 0, 1)
+
+
+# Test every grid backend gives the same answers as the nested lists
+@pytest.mark.parametrize("backend", ["numpy", "chunked"])
+def test_grid_backends_match(backend):
+    storages = [Storage(10, 10, 10), Storage(10, 10, 10, backend=backend)]
+
+    for storage_test in storages:
+        storage_test.add_box(1, Box(Position(0, 0, 0)))
+        storage_test.add_box(2, Box(Position(0, 0, 1)))
+        storage_test.add_box(3, Box(Position(3, 2, 0)))
+        # These two straddle the edge of a chunk
+        storage_test.add_box(4, Box(Position(7, 8, 0)))
+        storage_test.add_box(5, Box(Position(7, 8, 1)))
+        assert storage_test.move_box(2, Direction.East).__contains__("Successful!")
+        assert storage_test.remove_box(3).__contains__("Successful!")
+
+    listGrid, otherGrid = storages[0].grid, storages[1].grid
+    assert listGrid.equals(otherGrid) and otherGrid.equals(listGrid)
+    assert listGrid.serialize() == otherGrid.serialize()
+    assert listGrid.heightMap() == otherGrid.heightMap()
+    assert listGrid.columnHeight(7, 8) == otherGrid.columnHeight(7, 8) == 2
+    assert listGrid.layer(0) == otherGrid.layer(0)
+    assert sorted(listGrid.occupied()) == sorted(otherGrid.occupied()) == [1, 2, 4, 5]
+    assert listGrid.maxID() == otherGrid.maxID() == 5
+
+    # matrix looks the same whatever the backend
+    assert storages[1].matrix == storages[0].matrix
+    assert storages[1].matrix[1][0][1] == 2
+
+    for storage_test in storages:
+        assert storage_test.get_id_at_position(Position(1, 0, 1)) == 2
+        assert storage_test.get_id_at_position(Position(3, 2, 0)) == 0
+
+        storage_test.clear_storage()
+        assert storage_test.grid.isEmpty()
+
+    # Clearing the storage keeps the same backend
+    assert type(storages[1].grid) is type(otherGrid)
+
+
+# Test the chunked grid only keeps the chunks with boxes in them
+def test_chunked_grid_is_sparse():
+    storage_test = Storage(1000, 1000, 50, backend="chunked")
+    storage_test.add_box(1, Box(Position(999, 999, 0)))
+    storage_test.add_box(2, Box(Position(999, 999, 1)))
+    storage_test.add_box(3, Box(Position(500, 500, 0)))
+
+    assert len(storage_test.grid.cells) == 2
+    assert storage_test.grid.columnHeight(999, 999) == 2
+
+    storage_test.remove_box(2)
+    storage_test.remove_box(1)
+    assert len(storage_test.grid.cells) == 1
+
+    assert storage_test.move_box(3, Direction.North).__contains__("Successful!")
+    assert storage_test.get_id_at_position(Position(500, 501, 0)) == 3
+    assert storage_test.get_id_at_position(Position(500, 500, 0)) == 0
+
+
+# Test an unknown grid backend is rejected
+def test_unknown_grid_backend():
+    with pytest.raises(ValueError):
+        Storage(5, 5, 5, backend="abacus")
+
+
+# Test the column heights follow adding, moving, removing and undoing
+def test_column_heights():
+    storage_test = Storage(5, 5, 5)
+    storage_test.add_box(1, Box(Position(0, 0, 0)))
+    storage_test.add_box(2, Box(Position(0, 0, 1)))
+    storage_test.add_box(3, Box(Position(0, 0, 2)))
+
+    assert storage_test.column_height(0, 0) == 3
+    assert storage_test.column_top(0, 0) == 3
+    assert storage_test.column_height(1, 0) == 0
+    assert storage_test.column_top(1, 0) == 0
+    assert storage_test.support_depth(Position(0, 0, 4)) == 1
+    assert storage_test.support_depth(Position(0, 0, 1)) == 0
+
+    # Box 3 is left hanging over an empty column
+    assert storage_test.apply_move(3, Direction.East).__contains__("Successful!")
+    assert storage_test.column_height(0, 0) == 2
+    assert storage_test.column_top(0, 0) == 2
+    assert storage_test.column_height(1, 0) == 3
+    assert storage_test.support_depth(Position(1, 0, 2)) == 2
+    assert storage_test.support_depth(Position(1, 0, 1)) == 1
+
+    storage_test.rollback()
+    assert storage_test.column_height(0, 0) == 3
+    assert storage_test.column_height(1, 0) == 0
+
+    storage_test.remove_box(3)
+    storage_test.remove_box(2)
+    assert storage_test.column_height(0, 0) == 1
+    assert storage_test.column_top(0, 0) == 1
+    assert storage_test.column_height(0, 0) == storage_test.grid.columnHeight(0, 0)
+
+
+# Test the moves survive being stored as masks, and the boxes moving into a cell can be found
+def test_moves_dictionary_masks():
+    md = movesDictionary()
+    md.unlocked = {
+        Position(1, 1, 0): [Position(1, 2, 0), Position(2, 1, 0)],
+        Position(3, 1, 0): [Position(2, 1, 0), Position(3, 1, 1)],
+    }
+    md.locked = {Position(2, 0, 0): [Position(2, 1, 0)]}
+
+    compare_dicts(
+        md.unlocked,
+        {
+            Position(1, 1, 0): [Position(1, 2, 0), Position(2, 1, 0)],
+            Position(3, 1, 0): [Position(2, 1, 0), Position(3, 1, 1)],
+        },
+    )
+    assert md.is_locked(Position(2, 0, 0))
+
+    assert set(md.movesInto(Position(2, 1, 0))) == {
+        (Position(1, 1, 0), Direction.East, False),
+        (Position(3, 1, 0), Direction.West, False),
+        (Position(2, 0, 0), Direction.North, True),
+    }
+
+    copy = deepcopy(md)
+
+    md.removeEndPos(Position(2, 1, 0))
+    assert list(md.movesInto(Position(2, 1, 0))) == []
+    assert md.getDestinations(Position(1, 1, 0)) == [Position(1, 2, 0)]
+    assert md.getDestinations(Position(2, 0, 0)) == []
+
+    # Removing a move that isn't there is fine
+    md.removeDestination(Position(1, 1, 0), Position(2, 1, 0))
+    assert md.getDestinations(Position(1, 1, 0)) == [Position(1, 2, 0)]
+
+    # The copy is untouched
+    assert len(list(copy.movesInto(Position(2, 1, 0)))) == 3
+    assert set(copy.unlockedMoves()) == {
+        (Position(1, 1, 0), Direction.North),
+        (Position(1, 1, 0), Direction.East),
+        (Position(3, 1, 0), Direction.West),
+        (Position(3, 1, 0), Direction.Up),
+    }
+
+
+# Test a snapshot of the moves shares its entries until one of them is changed
+def test_moves_snapshot():
+    storage_test = Storage(10, 10, 10)
+    for box_id in range(1, 40):
+        storage_test.add_box(box_id, Box(Position(box_id % 10, box_id // 10, 0)))
+
+    before = storage_test.availableMoves.unlocked
+    snapshot = storage_test.availableMoves.snapshot()
+
+    # Nothing is copied until something changes
+    assert all(
+        a is b
+        for a, b in zip(
+            snapshot.unlockedMasks.buckets,
+            storage_test.availableMoves.unlockedMasks.buckets,
+        )
+    )
+
+    storage_test.move_box(1, Direction.Up)
+    storage_test.move_box(1, Direction.East)
+
+    assert snapshot.unlocked == before
+    assert storage_test.availableMoves.unlocked != before
+
+    # Only the buckets with changed entries were copied
+    shared = sum(
+        a is b
+        for a, b in zip(
+            snapshot.unlockedMasks.buckets,
+            storage_test.availableMoves.unlockedMasks.buckets,
+        )
+    )
+    assert shared > 0
+
+
+# Test modifyMoves leaves the dictionary it's given alone
+def test_modify_moves_keeps_original():
+    storage_test = Storage(5, 5, 5)
+    storage_test.add_box(1, Box(Position(0, 0, 0)))
+    storage_test.add_box(2, Box(Position(1, 0, 0)))
+
+    original = storage_test.availableMoves.snapshot()
+    before = original.unlocked
+
+    modified = storage_test.modifyMoves(original, 1, Direction.North)
+
+    assert original.unlocked == before
+    assert Position(0, 1, 0) in modified.unlocked
+    assert Position(0, 0, 0) not in modified.unlocked
+    assert storage_test.get_box_position(1) == Position(0, 0, 0)
+
+
+# Test the change listeners hear about real changes, but not the ones a search makes and undoes
+def test_change_listeners():
+    storage_test = Storage(5, 5, 5)
+    heard = []
+    storage_test.changeListeners.append(
+        lambda storage: heard.append(storage.zobristHash)
+    )
+
+    storage_test.add_box(1, Box(Position(0, 0, 0)))
+    storage_test.add_box(2, Box(Position(1, 0, 0)))
+    assert len(heard) == 2
+
+    # Listeners are told before the change
+    before = storage_test.zobristHash
+    storage_test.move_box(1, Direction.North)
+    assert heard[-1] == before
+    assert len(heard) == 3
+
+    # Invalid changes, moves that are undone and forced scratch changes aren't passed on
+    storage_test.move_box(1, Direction.Down)
+    storage_test.apply_move(2, Direction.North)
+    storage_test.undo_move()
+    storage_test.modifyMoves(storage_test.availableMoves, 2, Direction.East)
+    storage_test.remove_box(2, force=True, ignoreMoves=True)
+    storage_test.add_box(2, Box(Position(1, 0, 0)), force=True, ignoreMoves=True)
+    assert len(heard) == 3
+
+    storage_test.remove_box(2)
+    assert len(heard) == 4
+
+    # Clearing the storage keeps its listeners
+    storage_test.clear_storage()
+    assert len(heard) == 5
+    storage_test.add_box(3, Box(Position(0, 0, 0)))
+    assert len(heard) == 6
+
+
+# Test copying a watched storage leaves whatever is watching it alone
+def test_deepcopy_drops_listeners():
+    storage_test = Storage(3, 4, 1)
+    storage_test.add_box(1, Box(Position(0, 0, 0)))
+    cache = RouteCache()
+    cache.watch(storage_test)
+    cache.navigate(storage_test, 1, Position(0, 3, 0))
+    assert len(cache) == 1
+
+    copy = deepcopy(storage_test)
+    assert copy.changeListeners == []
+    assert storage_test.changeListeners[0].__self__ is cache
+    assert copy.serialize_box_positions() == storage_test.serialize_box_positions()
+    assert copy.zobristHash == storage_test.zobristHash
+
+    # Changing the copy doesn't touch the cache, but changing the original still does
+    copy.move_box(1, Direction.East)
+    assert len(cache) == 1
+    storage_test.move_box(1, Direction.East)
+    assert len(cache) == 0
@@ -46,6 +46,25 @@ def test_fill_command():
     assert not warehouse_test.is_valid_and_occupied(Position(4, 2, 0))
 
 
+# Test a stencil is only drawn into an empty warehouse, and only if it fits
+def test_stencil_layer():
+    warehouse_test = Warehouse(3, 3, 1)
+    assert (
+        warehouse_test.stencilLayer([[1, 0, 0, 0]], 1)
+        == error_messages.STENCIL_OVERFLOW_ERROR_MSG
+    )
+
+    warehouse_test.stencilLayer([[1, 0], [0, 1]], 1)
+    assert warehouse_test.get_id_at_position(Position(0, 0, 0)) == 1
+    assert warehouse_test.get_id_at_position(Position(1, 1, 0)) == 2
+
+    assert (
+        warehouse_test.stencilLayer([[0, 0, 1]], 3)
+        == error_messages.DIRTY_MATRIX_ERROR_MSG
+    )
+    assert not warehouse_test.is_valid_and_occupied(Position(0, 2, 0))
+
+
 # Test compare function
 def test_compare():
     storage_test = Warehouse(10, 10, 10)
@@ -6,6 +6,9 @@ from itertools import groupby
 
 
 # beat_the_clock(functionName, (a,b,...), limit)
+# This stops the function by raising an exception in its thread, which can land anywhere (leaving whatever it
+# was changing half done) and can't interrupt C code. Searches should be given a SearchBudget deadline or a
+# CancellationToken instead (see a_star_client/budget.py), which they check between expansions
 def beat_the_clock(func, args, timeout):
     result = [None]
     exception = [None]
@@ -59,15 +62,13 @@ def prettyPrintRoute(route: deque):
 def noDuplicates(storage, identifier):
     # Check no boxes have been duplicated in the matrix
     seen = set()
-    # Check each element in the array
-    for sublist1 in storage.matrix:
-        for subsublist in sublist1:
-            for elem in subsublist:
-                # If the element has already been seen, something's gone wrong!
-                if elem != 0 and elem in seen:
-                    pprint.pprint(storage.matrix)
-                    exit("Duplicated entry %s (%s)" % (elem, identifier))
-                seen.add(elem)
+    # Check each box in the grid
+    for elem in storage.grid.occupied():
+        # If the element has already been seen, something's gone wrong!
+        if elem in seen:
+            pprint.pprint(storage.grid.serialize())
+            exit("Duplicated entry %s (%s)" % (elem, identifier))
+        seen.add(elem)
 
 
 def noCrashing(storage, startPos, endPositions):
@@ -103,7 +104,7 @@ def noChanges(safe, storage):
         pprint.pprint(storage.boxes)
         exit("Box array not the same!")
 
-    if safe.matrix != storage.matrix:
+    if not safe.grid.equals(storage.grid):
         exit("Matrix not the same!")
 
     if safe.unstableBoxID != storage.unstableBoxID:
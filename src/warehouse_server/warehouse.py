@@ -1,6 +1,5 @@
 import random
 import numpy as np
-from itertools import chain
 
 from .storage import Storage, Position, Box
 from . import error_messages
@@ -77,24 +76,25 @@ class Warehouse(Storage):
 
     def prettyPrintLayer(self, layer):
         # Find the largest element's character length
-        maxLen = len(str(max(map(max, self.matrix))[0])) + 1
+        maxLen = len(str(self.grid.maxID())) + 1
 
+        cells = self.grid.layer(layer)
         for y in range(self.depth - 1, -1, -1):
             string = ""
             for x in range(0, self.width):
                 # Add to the readout with a buffer
-                value = str(self.matrix[x][y][layer])
+                value = str(cells[x][y])
                 string = string + value + " " * (maxLen - len(value))
             print(string)
 
     # Draws a maze based on a 2D array
     def stencilLayer(self, stencil: [], startID: int):
         # Make sure the warehouse is empty
-        if all(x == 0 for x in chain(self.matrix)):
+        if not self.grid.isEmpty():
             return error_messages.DIRTY_MATRIX_ERROR_MSG
 
         # Make sure the start coordinate doesn't overflow the stencil outside the warehouse
-        if len(self.matrix) < len(stencil) or len(self.matrix[0]) < len(stencil[0]):
+        if self.width < len(stencil) or self.depth < len(stencil[0]):
             return error_messages.STENCIL_OVERFLOW_ERROR_MSG
 
         for i in range(len(stencil)):
@@ -0,0 +1,47 @@
+# Zobrist hashing gives every (box, cell) pair its own random 64-bit key
+# The hash of a whole layout is the XOR of the keys of every box's position,
+# so moving a box only takes two XORs to update, no matter how many boxes there are
+
+MASK = (1 << 64) - 1
+
+
+# A fast, well-mixed 64-bit hash of an integer (the "splitmix64" finaliser)
+# The keys are derived from (seed, box_id, cell) rather than drawn in order from a random generator,
+# so every copy of the table (even in other processes) agrees on every key
+def splitmix64(value: int) -> int:
+    value = (value + 0x9E3779B97F4A7C15) & MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK
+    return value ^ (value >> 31)
+
+
+class ZobristTable:
+    def __init__(self, width: int, depth: int, height: int, seed=0):
+        self.width = width
+        self.depth = depth
+        self.height = height
+        self.seed = seed
+
+        # Keys are only generated when they're first needed
+        self.keys = dict()
+
+    def key(self, box_id: int, position) -> int:
+        cell = position.x + self.width * (position.y + self.depth * position.z)
+
+        value = self.keys.get((box_id, cell))
+        if value is None:
+            value = splitmix64(splitmix64(self.seed ^ box_id) ^ cell)
+            self.keys[(box_id, cell)] = value
+
+        return value
+
+    # XOR this into a hash to move a box from start to end
+    def moveKey(self, box_id: int, start, end) -> int:
+        return self.key(box_id, start) ^ self.key(box_id, end)
+
+    # Calculate the hash of a layout from scratch
+    def hashBoxes(self, boxes: dict) -> int:
+        value = 0
+        for box_id, box in boxes.items():
+            value ^= self.key(box_id, box.position)
+        return value